@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+WebSocket fan-out micro-benchmark for RoomManager.
+
+Fills one room with N fake sockets (one of them artificially slow), broadcasts
+presence/chat frames at a fixed rate and reports how long the broadcast call
+blocks the sender plus p50/p99 delivery latency to the healthy sockets.
+
+    python bench_fanout.py --sockets 200 --messages 500 --slow-delay 0.05
+    python bench_fanout.py --mode serial   # the old await-each-socket loop
+    python bench_fanout.py --mode codec    # presence bytes/CPU: JSON vs compact
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import server
+
+
+class FakeSocket:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.latencies = []
+
+    async def accept(self):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+    async def send_text(self, data: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        sent = json.loads(data)["t"]
+        self.latencies.append(time.perf_counter() - sent)
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def serial_broadcast(sockets, message):
+    data = json.dumps(message)
+    for ws in sockets:
+        await ws.send_text(data)
+
+
+async def run(args):
+    manager = server.RoomManager()
+    code = "BENCH"
+    fast = [FakeSocket() for _ in range(args.sockets - 1)]
+    slow = FakeSocket(args.slow_delay)
+    sockets = fast[: len(fast) // 2] + [slow] + fast[len(fast) // 2:]
+    for ws in sockets:
+        await manager.connect(code, ws)
+        manager.join(code, ws)
+
+    interval = 1.0 / args.rate
+    blocked = []
+    for i in range(args.messages):
+        kind = "chat" if i % args.chat_every == 0 else "presence"
+        message = {"type": kind, "n": i, "t": time.perf_counter()}
+        t0 = time.perf_counter()
+        if args.mode == "serial":
+            await serial_broadcast(sockets, message)
+        else:
+            await manager.broadcast(code, message)
+        blocked.append(time.perf_counter() - t0)
+        await asyncio.sleep(interval)
+    await asyncio.sleep(args.drain)
+
+    lat = [x for ws in fast for x in ws.latencies]
+    expected = len(fast) * args.messages
+    print(f"mode={args.mode} sockets={args.sockets} messages={args.messages} slow_delay={args.slow_delay}s")
+    print(f"  broadcast call   p50={pct(blocked, 50) * 1e3:8.3f} ms  p99={pct(blocked, 99) * 1e3:8.3f} ms")
+    print(f"  delivery (fast)  p50={pct(lat, 50) * 1e3:8.3f} ms  p99={pct(lat, 99) * 1e3:8.3f} ms"
+          f"  mean={statistics.mean(lat) * 1e3 if lat else 0:.3f} ms")
+    print(f"  delivered to fast sockets: {len(lat)}/{expected}")
+    slow_conn = manager.conns.get(slow)
+    print(f"  slow socket: delivered={len(slow.latencies)} dropped={slow_conn.dropped if slow_conn else 'n/a'}"
+          f" evicted={manager.evicted}")
+
+
+def bench_codec(args):
+    users = [{"id": f"user-{i:04d}", "name": f"Guest {i}", "color": "#7c3aed", "initial": "G"} for i in range(args.users)]
+    rounds = args.messages
+
+    def heads(r):
+        return [{"user": u, "head": {"pos": {"x": 100 + (r * 3 + i) % 400, "y": 80 + (r * 5 + i) % 300}, "size": 64}}
+                for i, u in enumerate(users)]
+
+    # old protocol: one JSON frame per move per user
+    t0 = time.perf_counter()
+    json_bytes = 0
+    for r in range(rounds):
+        for upd in heads(r):
+            frame = {"type": "presence", "head": upd["head"], "user": upd["user"], "ts": server.realtime_ts()}
+            json_bytes += len(json.dumps(frame))
+    json_cpu = time.perf_counter() - t0
+
+    # batched JSON (coalescer output) and the compact codec for the same batches
+    uids = {}
+    codec = server.CompactCodec(uids, lambda uid: uids.setdefault(uid, len(uids) + 1))
+    batch_bytes = compact_bytes = 0
+    batch_cpu = compact_cpu = 0.0
+    for r in range(rounds):
+        event = {"type": "presence", "event": "batch", "updates": heads(r), "ts": server.realtime_ts()}
+        t0 = time.perf_counter()
+        frame = server.dumps_frame(event)
+        batch_cpu += time.perf_counter() - t0
+        batch_bytes += len(frame)
+        t0 = time.perf_counter()
+        chunks = codec.encode(frame, event)
+        compact_cpu += time.perf_counter() - t0
+        compact_bytes += sum(len(c) for c in chunks)
+
+    moves = rounds * len(users)
+    print(f"codec users={len(users)} ticks={rounds} (per head update)")
+    print(f"  json per-move    {json_bytes / moves:8.1f} B  {json_cpu / moves * 1e6:7.2f} us")
+    print(f"  json batch       {batch_bytes / moves:8.1f} B  {batch_cpu / moves * 1e6:7.2f} us")
+    print(f"  compact batch    {compact_bytes / moves:8.1f} B  {compact_cpu / moves * 1e6:7.2f} us"
+          f"  (includes one-off user intros)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=100.0, help="broadcasts per second")
+    parser.add_argument("--chat-every", type=int, default=25, help="every Nth frame is chat, the rest presence")
+    parser.add_argument("--slow-delay", type=float, default=0.05, help="per-frame send delay of the slow socket")
+    parser.add_argument("--drain", type=float, default=1.0, help="seconds to let writers drain")
+    parser.add_argument("--users", type=int, default=10, help="codec mode: users moving per tick")
+    parser.add_argument("--mode", choices=("queued", "serial", "codec"), default="queued")
+    args = parser.parse_args()
+    if args.mode == "codec":
+        bench_codec(args)
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+In-process load test for the realtime and proxy paths.
+
+Starts the backend on a local port (uvicorn, same process) together with a mock
+Hyperbeam upstream, then drives N rooms x M WebSocket clients plus P long-pollers
+per room sending chat and presence at realistic rates. Reports request and message
+throughput, p50/p95/p99 fan-out latency, server event-loop lag and memory per room,
+and writes the results as JSON so runs can be compared.
+
+    python loadtest.py --rooms 20 --clients 10 --pollers 2 --duration 20
+    python loadtest.py --compare bench_results/loadtest-prev.json
+    python loadtest.py --warm-pool 3 --launch-interval 0.5   # launch latency via the pool
+
+Sessions, rooms and chat history live in the in-memory store by default, so the
+numbers leave out database latency; --storage mongo uses the configured MongoDB
+(MONGO_URL, DB_NAME) instead. Pass --no-sessions to exercise only the realtime paths
+on ad-hoc room codes.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import statistics
+import string
+import threading
+import time
+from pathlib import Path
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+MOCK_PORT = _free_port()
+# Must be set before the app module reads it
+os.environ.setdefault("HYPERBEAM_BASE", f"http://127.0.0.1:{MOCK_PORT}/v0")
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+import websockets  # noqa: E402
+from fastapi import FastAPI, Response  # noqa: E402
+
+import server  # noqa: E402
+
+
+# -------------------------------------------------------------------------------------
+# Mock Hyperbeam upstream
+# -------------------------------------------------------------------------------------
+def build_mock_hyperbeam(latency: float) -> FastAPI:
+    mock = FastAPI()
+
+    @mock.post("/v0/vm")
+    async def create_vm():
+        await asyncio.sleep(latency)
+        vm = "".join(random.choice(string.ascii_lowercase) for _ in range(12))
+        return {"session_id": vm, "embed_url": f"https://mock.hyperbeam/{vm}", "admin_token": "mock"}
+
+    @mock.delete("/v0/vm/{vm}")
+    async def delete_vm(vm: str):
+        await asyncio.sleep(latency)
+        return Response(status_code=204)
+
+    return mock
+
+
+def start_uvicorn(app, port: int) -> uvicorn.Server:
+    srv = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    threading.Thread(target=srv.run, daemon=True).start()
+    while not srv.started:
+        time.sleep(0.02)
+    return srv
+
+
+# -------------------------------------------------------------------------------------
+# Measurements
+# -------------------------------------------------------------------------------------
+class Stats:
+    def __init__(self) -> None:
+        self.fanout = []        # seconds from send to receipt at another client
+        self.http_requests = 0
+        self.http_errors = 0
+        self.ws_sent = 0
+        self.ws_received = 0
+        self.loop_lag = []      # server event-loop lag samples (seconds)
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def install_lag_sampler(stats: Stats, interval: float = 0.05):
+    # Runs inside the server's loop: how late does a sleep(interval) wake up?
+    async def sampler():
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(interval)
+            stats.loop_lag.append(max(0.0, loop.time() - t0 - interval))
+
+    async def start():
+        asyncio.get_running_loop().create_task(sampler())
+
+    server.app.router.on_startup.append(start)
+
+
+def _record(stats: Stats, me: str, event: dict, now: float):
+    if event.get("type") == "chat":
+        try:
+            body = json.loads(event.get("text") or "{}")
+        except ValueError:
+            return
+        if body.get("from") != me and "t" in body:
+            stats.fanout.append(now - body["t"])
+    elif event.get("event") == "batch":
+        for update in event.get("updates", ()):
+            head = update.get("head") or {}
+            if (update.get("user") or {}).get("id") != me and "t" in head:
+                stats.fanout.append(now - head["t"])
+
+
+# -------------------------------------------------------------------------------------
+# Simulated clients
+# -------------------------------------------------------------------------------------
+async def ws_client(args, base_ws: str, code: str, n: int, stats: Stats, stop: asyncio.Event):
+    me = f"{code}-ws{n}"
+    async with websockets.connect(f"{base_ws}/api/hb/ws/room/{code}", max_queue=None) as ws:
+        await ws.send(json.dumps({"type": "hello", "user": {"id": me, "name": me, "color": "#0ea5e9", "initial": "W"}}))
+
+        async def reader():
+            async for raw in ws:
+                stats.ws_received += 1
+                _record(stats, me, json.loads(raw), time.perf_counter())
+
+        async def writer():
+            next_chat = time.perf_counter() + random.uniform(0, args.chat_interval)
+            x = y = 0
+            while not stop.is_set():
+                await asyncio.sleep(1.0 / args.presence_hz)
+                x, y = (x + 7) % 800, (y + 3) % 600
+                await ws.send(json.dumps({"type": "presence", "head": {"pos": {"x": x, "y": y}, "size": 64, "t": time.perf_counter()}}))
+                stats.ws_sent += 1
+                if time.perf_counter() >= next_chat:
+                    next_chat += args.chat_interval
+                    await ws.send(json.dumps({"type": "chat", "text": json.dumps({"from": me, "t": time.perf_counter()})}))
+                    stats.ws_sent += 1
+
+        read_task = asyncio.create_task(reader())
+        try:
+            await writer()
+        finally:
+            read_task.cancel()
+
+
+async def poller(args, http: httpx.AsyncClient, code: str, n: int, stats: Stats, stop: asyncio.Event):
+    me = f"{code}-poll{n}"
+    since = 0
+
+    async def post_loop():
+        next_chat = time.perf_counter() + random.uniform(0, args.chat_interval)
+        while not stop.is_set():
+            await asyncio.sleep(max(0.25, 1.0 / args.presence_hz))
+            payload = {"type": "presence", "head": {"pos": {"x": 1, "y": 1}, "size": 64, "t": time.perf_counter()}, "user": {"id": me}}
+            if time.perf_counter() >= next_chat:
+                next_chat += args.chat_interval
+                payload = {"type": "chat", "text": json.dumps({"from": me, "t": time.perf_counter()}), "user": {"id": me}}
+            try:
+                r = await http.post(f"/api/hb/rooms/{code}/events", json=payload)
+                stats.http_requests += 1
+                stats.http_errors += r.status_code >= 400
+            except httpx.HTTPError:
+                stats.http_errors += 1
+
+    post_task = asyncio.create_task(post_loop())
+    try:
+        while not stop.is_set():
+            try:
+                r = await http.get(f"/api/hb/rooms/{code}/events", params={"since": since, "wait": 5})
+                stats.http_requests += 1
+                if r.status_code >= 400:
+                    stats.http_errors += 1
+                    continue
+                body = r.json()
+                now = time.perf_counter()
+                for event in body["events"]:
+                    _record(stats, me, event, now)
+                since = body["last_id"] or since
+            except httpx.HTTPError:
+                stats.http_errors += 1
+    finally:
+        post_task.cancel()
+
+
+async def create_rooms(args, http: httpx.AsyncClient, stats: Stats):
+    codes, launch = [], []
+    for _ in range(args.rooms):
+        t0 = time.perf_counter()
+        r = await http.post("/api/hb/sessions", json={}, headers={"Authorization": "Bearer loadtest"})
+        launch.append(time.perf_counter() - t0)
+        r.raise_for_status()
+        r = await http.post("/api/hb/rooms", json={"session_uuid": r.json()["session_uuid"]})
+        r.raise_for_status()
+        codes.append(r.json()["code"])
+        stats.http_requests += 2
+        await asyncio.sleep(args.launch_interval)
+    return codes, launch
+
+
+async def run(args) -> dict:
+    stats = Stats()
+    install_lag_sampler(stats)
+    if args.warm_pool:
+        server.HB_WARM_POOL_ENABLED = True
+        server.warm_pool.max_size = args.warm_pool
+    server.STORAGE_BACKEND = args.storage
+    if args.no_sessions and args.storage == "mongo":
+        # the store may not be reachable: skip the startup work that needs one
+        server.app.router.on_startup.remove(server.startup_storage)
+        server.app.router.on_startup.remove(server.startup_reaper)
+    mock = start_uvicorn(build_mock_hyperbeam(args.upstream_latency), MOCK_PORT)
+    port = _free_port()
+    app_srv = start_uvicorn(server.app, port)
+    base = f"http://127.0.0.1:{port}"
+
+    limits = httpx.Limits(max_connections=args.rooms * args.pollers * 2 + 10)
+    async with httpx.AsyncClient(base_url=base, timeout=30, limits=limits) as http:
+        launch = []
+        if args.no_sessions:
+            codes = [f"LT{i:04d}" for i in range(args.rooms)]
+        else:
+            codes, launch = await create_rooms(args, http, stats)
+
+        rss_before = rss_bytes()
+        stop = asyncio.Event()
+        tasks = []
+        for code in codes:
+            tasks += [asyncio.create_task(ws_client(args, base.replace("http", "ws", 1), code, i, stats, stop)) for i in range(args.clients)]
+            tasks += [asyncio.create_task(poller(args, http, code, i, stats, stop)) for i in range(args.pollers)]
+
+        await asyncio.sleep(args.warmup)
+        stats.fanout.clear()
+        stats.loop_lag.clear()
+        counters0 = (stats.http_requests, stats.ws_sent, stats.ws_received)
+        t0 = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        elapsed = time.perf_counter() - t0
+        counters1 = (stats.http_requests, stats.ws_sent, stats.ws_received)
+        rss_after = rss_bytes()
+
+        stop.set()
+        await asyncio.sleep(0.5)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    app_srv.should_exit = True
+    mock.should_exit = True
+
+    rooms = max(1, len(codes))
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "http_rps": (counters1[0] - counters0[0]) / elapsed,
+        "ws_sent_per_s": (counters1[1] - counters0[1]) / elapsed,
+        "ws_received_per_s": (counters1[2] - counters0[2]) / elapsed,
+        "http_errors": stats.http_errors,
+        "fanout_ms": {p: pct(stats.fanout, int(p[1:])) * 1e3 for p in ("p50", "p95", "p99")},
+        "fanout_samples": len(stats.fanout),
+        "loop_lag_ms": {
+            "mean": statistics.mean(stats.loop_lag) * 1e3 if stats.loop_lag else 0.0,
+            "p99": pct(stats.loop_lag, 99) * 1e3,
+            "max": max(stats.loop_lag, default=0.0) * 1e3,
+        },
+        "launch_ms": {p: pct(launch, int(p[1:])) * 1e3 for p in ("p50", "p99")} if launch else None,
+        "warm_pool": dict(server.warm_pool.stats) if args.warm_pool else None,
+        "memory": {
+            "room_log_bytes_per_room": server.room_logs.total_bytes / rooms,
+            "rss_delta_bytes_per_room": (rss_after - rss_before) / rooms,
+        },
+    }
+
+
+def compare(current: dict, previous: dict):
+    def row(label, cur, prev, lower_is_better=True):
+        if not prev:
+            print(f"  {label:28s} {cur:10.2f}")
+            return
+        change = (cur - prev) / prev * 100
+        worse = change > 0 if lower_is_better else change < 0
+        flag = "  <-- regression" if worse and abs(change) > 10 else ""
+        print(f"  {label:28s} {cur:10.2f}  (was {prev:.2f}, {change:+.1f}%){flag}")
+
+    print(f"compared with {previous.get('timestamp')}:")
+    row("http req/s", current["http_rps"], previous.get("http_rps"), lower_is_better=False)
+    row("ws received/s", current["ws_received_per_s"], previous.get("ws_received_per_s"), lower_is_better=False)
+    for p in ("p50", "p95", "p99"):
+        row(f"fan-out {p} ms", current["fanout_ms"][p], previous.get("fanout_ms", {}).get(p))
+    if current.get("launch_ms") and previous.get("launch_ms"):
+        row("launch p50 ms", current["launch_ms"]["p50"], previous["launch_ms"].get("p50"))
+    row("loop lag p99 ms", current["loop_lag_ms"]["p99"], previous.get("loop_lag_ms", {}).get("p99"))
+    row("room log bytes/room", current["memory"]["room_log_bytes_per_room"],
+        previous.get("memory", {}).get("room_log_bytes_per_room"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=8, help="WebSocket clients per room")
+    parser.add_argument("--pollers", type=int, default=2, help="long-poll clients per room")
+    parser.add_argument("--presence-hz", type=float, default=10.0, help="head moves per second per client")
+    parser.add_argument("--chat-interval", type=float, default=5.0, help="seconds between chat messages per client")
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--upstream-latency", type=float, default=0.2, help="mock Hyperbeam response delay")
+    parser.add_argument("--warm-pool", type=int, default=0, help="enable the warm pool with this max size per key")
+    parser.add_argument("--launch-interval", type=float, default=0.0, help="seconds between session launches")
+    parser.add_argument("--storage", choices=("memory", "mongo"), default="memory", help="session/room store backend")
+    parser.add_argument("--no-sessions", action="store_true", help="skip session/room creation")
+    parser.add_argument("--out", default=None, help="result file (default bench_results/loadtest-<ts>.json)")
+    parser.add_argument("--compare", default=None, help="previous result file to diff against")
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+
+    out = Path(args.out or Path(__file__).parent / "bench_results" / f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2))
+    print(f"saved {out}")
+    if args.compare:
+        compare(result, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main()
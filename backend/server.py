@@ -1,28 +1,191 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Header, Depends, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Header, Depends, WebSocket, WebSocketDisconnect, Query, Request
 from dotenv import load_dotenv
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
-from starlette.concurrency import run_in_threadpool
+from pymongo import CursorType, InsertOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError
+from bson import ObjectId
 import os
 import logging
+from abc import ABC, abstractmethod
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any, Set
+from typing import List, Optional, Dict, Any, Set, Tuple, Deque, Callable, AsyncIterator, Literal
 import uuid
-from datetime import datetime, timezone
-import requests
+from datetime import datetime, timedelta, timezone
+import httpx
 import random
 import string
 import json
+import asyncio
+import time
+import base64
+import contextlib
+import copy
+import hashlib
+import heapq
+import hmac
+import math
+import struct
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# -------------------------------------------------------------------------------------
+# Metrics: in-process registry rendered as Prometheus text at /api/metrics
+# -------------------------------------------------------------------------------------
+# Counters and histograms are plain dict/list updates. All instrumentation (route
+# latency, broadcast timing, Hyperbeam and Mongo calls, event-loop lag) sits behind
+# METRICS_ENABLED, so with it off the hot paths pay one flag check.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+METRICS_LAG_INTERVAL = float(os.environ.get('METRICS_LAG_INTERVAL', '0.5'))
+METRICS_ROOM_LABELS_MAX = int(os.environ.get('METRICS_ROOM_LABELS_MAX', '20'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[Any, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Metric:
+    """A named metric family. `fn`, when given, is read at scrape time instead of
+    stored values: a number, or a {label values tuple: number} dict."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), fn: Optional[Callable[[], Any]] = None) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values: Dict[Tuple[Any, ...], float] = {}
+
+    def _series(self) -> Dict[Tuple[Any, ...], float]:
+        if self.fn is None:
+            return self._values
+        value = self.fn()
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self, out: List[str]) -> None:
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        for labels, value in list(self._series().items()):
+            out.append(f"{self.name}{_fmt_labels(self.labelnames, labels)} {_fmt_value(value)}")
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: Any, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: Any) -> None:
+        self._values[labels] = value
+
+class Histogram(Metric):
+    """Fixed-bucket histogram. observe() may be called from driver threads."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._hist: Dict[Tuple[Any, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: Any) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._hist.get(labels)
+            if series is None:
+                series = self._hist[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self, out: List[str]) -> None:
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        names = self.labelnames + ("le",)
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._hist.items()]
+        for labels, series in snapshot:
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                running += count
+                out.append(f"{self.name}_bucket{_fmt_labels(names, labels + (_fmt_value(bound),))} {running}")
+            suffix = _fmt_labels(self.labelnames, labels)
+            out.append(f"{self.name}_sum{suffix} {_fmt_value(series[-1])}")
+            out.append(f"{self.name}_count{suffix} {running}")
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Any:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = (), fn=None) -> Counter:
+        return self.register(Counter(name, help, labelnames, fn))
+
+    def gauge(self, name: str, help: str, labelnames: Tuple[str, ...] = (), fn=None) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        out: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                metric.render(out)
+            except Exception:
+                logging.exception("Failed to render metric %s", metric.name)
+        return "\n".join(out) + "\n"
+
+metrics = MetricsRegistry()
+
+# Hot-path instruments; scrape-time gauges over existing stats live next to /api/metrics
+HTTP_REQUESTS = metrics.counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_SECONDS = metrics.histogram("http_request_duration_seconds", "Time to response start by route.", ("method", "route"))
+HB_UPSTREAM_REQUESTS = metrics.counter("hb_upstream_requests_total", "Hyperbeam API calls by operation and status.", ("op", "status"))
+HB_UPSTREAM_SECONDS = metrics.histogram("hb_upstream_duration_seconds", "Hyperbeam API call latency.", ("op",))
+MONGO_SECONDS = metrics.histogram("mongo_command_duration_seconds", "MongoDB command latency as seen by the driver.", ("command", "outcome"))
+HB_LAUNCH_SECONDS = metrics.histogram("hb_session_launch_seconds", "Time for POST /sessions to obtain a VM, by source.", ("source",))
+WS_BROADCAST_SECONDS = metrics.histogram("ws_broadcast_duration_seconds", "Time to enqueue one frame for every socket in a room.", ("kind",), FAST_BUCKETS)
+WS_FRAMES = metrics.counter("ws_frames_enqueued_total", "Frames queued to sockets by broadcasts.", ("kind",))
+EVENT_LOOP_LAG = metrics.histogram("event_loop_lag_seconds", "How late a periodic sleep wakes up on the event loop.", (), FAST_BUCKETS + (0.1, 0.25, 0.5, 1.0))
+
+# Event types used as label values; anything else a client sends is folded into "other"
+METRIC_EVENT_KINDS = frozenset(("chat", "presence", "pong", "welcome", "gap", "replay"))
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Driver-level timings for every command, whichever code path issued it."""
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, event.command_name, "ok")
+
+    def failed(self, event) -> None:
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, event.command_name, "error")
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -37,6 +200,43 @@ hb_router = APIRouter(prefix="/api/hb", tags=["hyperbeam"])
 def now_iso():
     return datetime.now(timezone.utc).isoformat()
 
+# -------------------------------------------------------------------------------------
+# Realtime serialization: optional orjson backend, compact separators, cached clock
+# -------------------------------------------------------------------------------------
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
+
+REALTIME_JSON = os.environ.get('REALTIME_JSON', 'orjson' if orjson is not None else 'json')
+
+if REALTIME_JSON == 'orjson' and orjson is not None:
+    def dumps_frame(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, default=str)
+        except TypeError:
+            # orjson refuses ints beyond 64 bits and non-str keys; stdlib json takes both
+            return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+    def loads_frame(raw: Any) -> Any:
+        return orjson.loads(raw)
+else:
+    def dumps_frame(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+    def loads_frame(raw: Any) -> Any:
+        return json.loads(raw)
+
+_realtime_clock: List[Any] = [0, ""]
+
+def realtime_ts() -> str:
+    """now_iso() at millisecond resolution, formatted at most once per millisecond."""
+    ms = int(time.time() * 1000)
+    if ms != _realtime_clock[0]:
+        _realtime_clock[0] = ms
+        _realtime_clock[1] = datetime.fromtimestamp(ms / 1000, timezone.utc).isoformat(timespec="milliseconds")
+    return _realtime_clock[1]
+
 def prepare_for_mongo(data: Dict[str, Any]) -> Dict[str, Any]:
     # Ensure datetimes are strings
     for k, v in list(data.items()):
@@ -44,6 +244,546 @@ def prepare_for_mongo(data: Dict[str, Any]) -> Dict[str, Any]:
             data[k] = v.isoformat()
     return data
 
+# -------------------------------------------------------------------------------------
+# Storage: sessions, rooms, status checks, chat history and idempotency records
+# -------------------------------------------------------------------------------------
+# Routes and background tasks go through get_storage(), built on first use (normally
+# the startup hook) from STORAGE_BACKEND: "mongo" (MONGO_URL, DB_NAME) or "memory",
+# which keeps everything in this process in dicts and sorted lists. Memory is for
+# single-node deployments and for measuring the proxy and realtime paths without
+# database latency; its data is gone on restart and it can't be shared between
+# workers (nor can it back ROOM_BROKER=mongo).
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+
+SESSION_SCAN_PROJECTION = {"_id": 0, "session_uuid": 1, "hyperbeam_session_id": 1, "created_at": 1,
+                           "last_accessed": 1, "timeout_absolute": 1, "timeout_inactive": 1}
+
+class Storage(ABC):
+    """Persistence seam. Documents come back as plain dicts without `_id`."""
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    # sessions
+    @abstractmethod
+    async def get_session(self, session_uuid: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def insert_session(self, doc: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def update_session(self, session_uuid: str, fields: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def touch_sessions(self, touches: Dict[str, str]) -> None:
+        """Raise last_accessed to the given timestamps; a stale one never lowers it."""
+
+    @abstractmethod
+    def active_sessions(self) -> AsyncIterator[Dict[str, Any]]:
+        """Active sessions, least recently accessed first (SESSION_SCAN_PROJECTION)."""
+
+    @abstractmethod
+    async def end_sessions(self, ended: Dict[str, Dict[str, Any]]) -> List[str]:
+        """Set the given fields on each session that is still active; returns the
+        uuids this call ended, so concurrent callers never both act on one."""
+
+    # rooms
+    @abstractmethod
+    async def get_room(self, code: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def insert_room(self, doc: Dict[str, Any]) -> None:
+        """Raises DuplicateKeyError if the code is taken."""
+
+    @abstractmethod
+    async def rooms_for_sessions(self, session_uuids: List[str]) -> List[Dict[str, Any]]:
+        ...
+
+    # batched inserts from the write-behind queue (status checks, chat history)
+    @abstractmethod
+    async def insert_batch(self, collection: str, docs: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    def status_checks(self, after: Optional[Tuple[str, str]], limit: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+        """Status checks ordered by (timestamp, id), starting after that key."""
+
+    # chat history
+    @abstractmethod
+    async def chat_range(self, code: str, after: Optional[int], before: Optional[int], limit: int,
+                         newest: bool) -> List[Dict[str, Any]]:
+        """Chat events with after < seq < before in seq order: the newest `limit` of
+        them when `newest`, otherwise the oldest."""
+
+    @abstractmethod
+    async def last_chat_seq(self, code: str) -> int:
+        ...
+
+    @abstractmethod
+    async def trim_chat(self, code: str, keep: int) -> int:
+        """Delete all but the newest `keep` messages of a room; returns how many went."""
+
+    # idempotency claims: {_id, fingerprint, response, created_at, expires_at}
+    @abstractmethod
+    async def get_claim(self, scope: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def insert_claim(self, doc: Dict[str, Any]) -> None:
+        """Raises DuplicateKeyError if the scope is already claimed."""
+
+    @abstractmethod
+    async def delete_claim(self, scope: str, expires_at: Optional[datetime] = None) -> None:
+        """Delete a claim; with `expires_at`, only if it still has that expiry."""
+
+    @abstractmethod
+    async def complete_claim(self, scope: str, response: Dict[str, Any], expires_at: datetime) -> None:
+        ...
+
+def _utc(dt: datetime) -> datetime:
+    # the driver hands back naive UTC datetimes
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+class MongoStorage(Storage):
+    def __init__(self, client, name: str) -> None:
+        self.client = client
+        self.db = client[name]
+
+    async def start(self) -> None:
+        await self.ensure_indexes()
+
+    async def close(self) -> None:
+        self.client.close()
+
+    async def ensure_indexes(self) -> None:
+        # Idempotent; a failure (e.g. legacy duplicates) is logged rather than blocking startup
+        db = self.db
+        specs = [
+            (db.hb_sessions, [("session_uuid", 1)], {"unique": True}),
+            # active-session scans (reaper, admin queries) filter on is_active and age
+            (db.hb_sessions, [("is_active", 1), ("last_accessed", 1)], {}),
+            (db.hb_rooms, [("code", 1)], {"unique": True}),
+            (db.hb_rooms, [("session_uuid", 1)], {}),
+            # keyset pagination for GET /api/status
+            (db.status_checks, [("timestamp", 1), ("id", 1)], {}),
+            # chat history paging and per-room trimming; TTL drops old messages
+            (db[CHAT_HISTORY_COLLECTION], [("code", 1), ("seq", 1)], {"unique": True}),
+            (db[CHAT_HISTORY_COLLECTION], [("created_at", 1)], {"expireAfterSeconds": int(CHAT_HISTORY_TTL_DAYS * 86400)}),
+            # completed and abandoned Idempotency-Key entries remove themselves
+            (db[IDEMPOTENCY_COLLECTION], [("expires_at", 1)], {"expireAfterSeconds": 0}),
+        ]
+        for coll, keys, opts in specs:
+            try:
+                await coll.create_index(keys, **opts)
+            except Exception:
+                logging.exception("Failed to ensure index %s on %s", keys, coll.name)
+
+    async def get_session(self, session_uuid: str) -> Optional[Dict[str, Any]]:
+        return await self.db.hb_sessions.find_one({"session_uuid": session_uuid}, {"_id": 0})
+
+    async def insert_session(self, doc: Dict[str, Any]) -> None:
+        await self.db.hb_sessions.insert_one(dict(doc))
+
+    async def update_session(self, session_uuid: str, fields: Dict[str, Any]) -> None:
+        await self.db.hb_sessions.update_one({"session_uuid": session_uuid}, {"$set": fields})
+
+    async def touch_sessions(self, touches: Dict[str, str]) -> None:
+        # $max so a stale bump never rewinds a newer last_accessed (e.g. from terminate)
+        await self.db.hb_sessions.bulk_write([
+            UpdateOne({"session_uuid": k}, {"$max": {"last_accessed": v}}) for k, v in touches.items()
+        ], ordered=False)
+
+    async def active_sessions(self) -> AsyncIterator[Dict[str, Any]]:
+        cursor = self.db.hb_sessions.find({"is_active": True}, SESSION_SCAN_PROJECTION).sort("last_accessed", 1)
+        try:
+            async for doc in cursor:
+                yield doc
+        finally:
+            await cursor.close()
+
+    async def end_sessions(self, ended: Dict[str, Dict[str, Any]]) -> List[str]:
+        # one conditional update per session: a bulk write can't say which ones matched
+        uuids = list(ended)
+        results = await asyncio.gather(*(
+            self.db.hb_sessions.update_one({"session_uuid": k, "is_active": True}, {"$set": ended[k]})
+            for k in uuids
+        ))
+        return [k for k, r in zip(uuids, results) if r.modified_count]
+
+    async def get_room(self, code: str) -> Optional[Dict[str, Any]]:
+        return await self.db.hb_rooms.find_one({"code": code}, {"_id": 0})
+
+    async def insert_room(self, doc: Dict[str, Any]) -> None:
+        await self.db.hb_rooms.insert_one(dict(doc))
+
+    async def rooms_for_sessions(self, session_uuids: List[str]) -> List[Dict[str, Any]]:
+        return await self.db.hb_rooms.find({"session_uuid": {"$in": session_uuids}}, {"_id": 0}).to_list(None)
+
+    async def insert_batch(self, collection: str, docs: List[Dict[str, Any]]) -> None:
+        await self.db[collection].bulk_write([InsertOne(d) for d in docs], ordered=False)
+
+    async def status_checks(self, after: Optional[Tuple[str, str]], limit: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+        query: Dict[str, Any] = {}
+        if after:
+            ts, sid = after
+            query = {"$or": [{"timestamp": {"$gt": ts}}, {"timestamp": ts, "id": {"$gt": sid}}]}
+        cursor = self.db.status_checks.find(query, STATUS_PROJECTION).sort([("timestamp", 1), ("id", 1)])
+        if limit:
+            cursor = cursor.limit(limit)
+        async for doc in cursor.batch_size(STATUS_PAGE_MAX):
+            yield doc
+
+    async def chat_range(self, code: str, after: Optional[int], before: Optional[int], limit: int,
+                         newest: bool) -> List[Dict[str, Any]]:
+        seq_range: Dict[str, int] = {}
+        if after is not None:
+            seq_range["$gt"] = after
+        if before is not None:
+            seq_range["$lt"] = before
+        query: Dict[str, Any] = {"code": code}
+        if seq_range:
+            query["seq"] = seq_range
+        docs = await self.db[CHAT_HISTORY_COLLECTION].find(query, {"_id": 0, "event": 1}) \
+            .sort("seq", -1 if newest else 1).limit(limit).to_list(limit)
+        if newest:
+            docs.reverse()
+        return [d["event"] for d in docs]
+
+    async def last_chat_seq(self, code: str) -> int:
+        doc = await self.db[CHAT_HISTORY_COLLECTION].find_one({"code": code}, {"_id": 0, "seq": 1}, sort=[("seq", -1)])
+        return doc["seq"] if doc else 0
+
+    async def trim_chat(self, code: str, keep: int) -> int:
+        coll = self.db[CHAT_HISTORY_COLLECTION]
+        cutoff = await coll.find({"code": code}, {"_id": 0, "seq": 1}).sort("seq", -1).skip(keep).limit(1).to_list(1)
+        if not cutoff:
+            return 0
+        result = await coll.delete_many({"code": code, "seq": {"$lte": cutoff[0]["seq"]}})
+        return result.deleted_count
+
+    async def get_claim(self, scope: str) -> Optional[Dict[str, Any]]:
+        doc = await self.db[IDEMPOTENCY_COLLECTION].find_one({"_id": scope})
+        if doc is not None:
+            doc["expires_at"] = _utc(doc["expires_at"])
+        return doc
+
+    async def insert_claim(self, doc: Dict[str, Any]) -> None:
+        await self.db[IDEMPOTENCY_COLLECTION].insert_one(doc)
+
+    async def delete_claim(self, scope: str, expires_at: Optional[datetime] = None) -> None:
+        query: Dict[str, Any] = {"_id": scope}
+        if expires_at is not None:
+            query["expires_at"] = expires_at
+        await self.db[IDEMPOTENCY_COLLECTION].delete_one(query)
+
+    async def complete_claim(self, scope: str, response: Dict[str, Any], expires_at: datetime) -> None:
+        await self.db[IDEMPOTENCY_COLLECTION].update_one(
+            {"_id": scope}, {"$set": {"response": response, "expires_at": expires_at}}
+        )
+
+class MemoryStorage(Storage):
+    """Everything in this process: dicts keyed like the Mongo unique indexes, and
+    sorted lists (bisected) where Mongo would range-scan an index. Documents are
+    copied on the way in and out, as a round trip through Mongo would."""
+
+    CLAIM_SWEEP_INTERVAL = 60.0
+
+    def __init__(self) -> None:
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._rooms: Dict[str, Dict[str, Any]] = {}
+        self._rooms_by_session: Dict[str, Set[str]] = {}
+        self._status_keys: List[Tuple[str, str]] = []  # (timestamp, id), sorted
+        self._status: List[Dict[str, Any]] = []         # parallel to _status_keys
+        self._chat_seqs: Dict[str, List[int]] = {}       # code -> sorted seqs
+        self._chat: Dict[str, List[Dict[str, Any]]] = {}  # code -> events, parallel
+        self._claims: Dict[str, Dict[str, Any]] = {}
+        self._next_claim_sweep = time.monotonic() + self.CLAIM_SWEEP_INTERVAL
+
+    async def get_session(self, session_uuid: str) -> Optional[Dict[str, Any]]:
+        doc = self._sessions.get(session_uuid)
+        return copy.deepcopy(doc) if doc is not None else None
+
+    async def insert_session(self, doc: Dict[str, Any]) -> None:
+        if doc["session_uuid"] in self._sessions:
+            raise DuplicateKeyError("session_uuid already exists")
+        self._sessions[doc["session_uuid"]] = copy.deepcopy(doc)
+
+    async def update_session(self, session_uuid: str, fields: Dict[str, Any]) -> None:
+        doc = self._sessions.get(session_uuid)
+        if doc is not None:
+            doc.update(copy.deepcopy(fields))
+
+    async def touch_sessions(self, touches: Dict[str, str]) -> None:
+        for session_uuid, ts in touches.items():
+            doc = self._sessions.get(session_uuid)
+            if doc is not None and (doc.get("last_accessed") or "") < ts:
+                doc["last_accessed"] = ts
+
+    async def active_sessions(self) -> AsyncIterator[Dict[str, Any]]:
+        active = [d for d in self._sessions.values() if d.get("is_active")]
+        active.sort(key=lambda d: d.get("last_accessed") or "")
+        for doc in active:
+            yield {k: copy.deepcopy(doc[k]) for k in SESSION_SCAN_PROJECTION if k in doc}
+
+    async def end_sessions(self, ended: Dict[str, Dict[str, Any]]) -> List[str]:
+        flipped = []
+        for session_uuid, fields in ended.items():
+            doc = self._sessions.get(session_uuid)
+            if doc is not None and doc.get("is_active"):
+                doc.update(fields)
+                flipped.append(session_uuid)
+        return flipped
+
+    async def get_room(self, code: str) -> Optional[Dict[str, Any]]:
+        doc = self._rooms.get(code)
+        return dict(doc) if doc is not None else None
+
+    async def insert_room(self, doc: Dict[str, Any]) -> None:
+        if doc["code"] in self._rooms:
+            raise DuplicateKeyError("room code already exists")
+        self._rooms[doc["code"]] = dict(doc)
+        self._rooms_by_session.setdefault(doc["session_uuid"], set()).add(doc["code"])
+
+    async def rooms_for_sessions(self, session_uuids: List[str]) -> List[Dict[str, Any]]:
+        return [dict(self._rooms[code]) for s in session_uuids for code in self._rooms_by_session.get(s, ())]
+
+    async def insert_batch(self, collection: str, docs: List[Dict[str, Any]]) -> None:
+        if collection == "status_checks":
+            for doc in docs:
+                self._insert_status(doc)
+        elif collection == CHAT_HISTORY_COLLECTION:
+            for doc in docs:
+                self._insert_chat(doc)
+        else:
+            raise ValueError(f"MemoryStorage has no collection {collection!r}")
+
+    def _insert_status(self, doc: Dict[str, Any]) -> None:
+        key = (doc["timestamp"], doc["id"])
+        i = bisect_right(self._status_keys, key)  # almost always the end
+        self._status_keys.insert(i, key)
+        self._status.insert(i, {k: doc[k] for k, keep in STATUS_PROJECTION.items() if keep and k in doc})
+
+    async def status_checks(self, after: Optional[Tuple[str, str]], limit: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+        start = bisect_right(self._status_keys, after) if after else 0
+        end = len(self._status) if not limit else min(len(self._status), start + limit)
+        for i in range(start, end):
+            yield dict(self._status[i])
+
+    def _insert_chat(self, doc: Dict[str, Any]) -> None:
+        seqs = self._chat_seqs.setdefault(doc["code"], [])
+        events = self._chat.setdefault(doc["code"], [])
+        i = bisect_left(seqs, doc["seq"])
+        if i < len(seqs) and seqs[i] == doc["seq"]:
+            return  # unique (code, seq), as in Mongo
+        seqs.insert(i, doc["seq"])
+        events.insert(i, copy.deepcopy(doc["event"]))
+
+    async def chat_range(self, code: str, after: Optional[int], before: Optional[int], limit: int,
+                         newest: bool) -> List[Dict[str, Any]]:
+        seqs = self._chat_seqs.get(code, [])
+        events = self._chat.get(code, [])
+        lo = bisect_right(seqs, after) if after is not None else 0
+        hi = bisect_left(seqs, before) if before is not None else len(seqs)
+        if newest:
+            lo = max(lo, hi - limit)
+        else:
+            hi = min(hi, lo + limit)
+        return copy.deepcopy(events[lo:hi])
+
+    async def last_chat_seq(self, code: str) -> int:
+        seqs = self._chat_seqs.get(code)
+        return seqs[-1] if seqs else 0
+
+    async def trim_chat(self, code: str, keep: int) -> int:
+        seqs = self._chat_seqs.get(code, [])
+        drop = max(0, len(seqs) - keep)
+        if drop:
+            del seqs[:drop]
+            del self._chat[code][:drop]
+        return drop
+
+    async def get_claim(self, scope: str) -> Optional[Dict[str, Any]]:
+        doc = self._claims.get(scope)
+        return copy.deepcopy(doc) if doc is not None else None
+
+    async def insert_claim(self, doc: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        if now >= self._next_claim_sweep:
+            # what the TTL index does for Mongo
+            self._next_claim_sweep = now + self.CLAIM_SWEEP_INTERVAL
+            cutoff = datetime.now(timezone.utc)
+            for scope in [s for s, d in self._claims.items() if d["expires_at"] <= cutoff]:
+                del self._claims[scope]
+        if doc["_id"] in self._claims:
+            raise DuplicateKeyError("idempotency key already claimed")
+        self._claims[doc["_id"]] = copy.deepcopy(doc)
+
+    async def delete_claim(self, scope: str, expires_at: Optional[datetime] = None) -> None:
+        doc = self._claims.get(scope)
+        if doc is not None and (expires_at is None or doc["expires_at"] == expires_at):
+            del self._claims[scope]
+
+    async def complete_claim(self, scope: str, response: Dict[str, Any], expires_at: datetime) -> None:
+        doc = self._claims.get(scope)
+        if doc is not None:
+            doc["response"] = copy.deepcopy(response)
+            doc["expires_at"] = expires_at
+
+def _build_storage() -> Storage:
+    if STORAGE_BACKEND == "memory":
+        return MemoryStorage()
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=[MongoCommandMetrics()] if METRICS_ENABLED else [])
+    return MongoStorage(client, os.environ['DB_NAME'])
+
+storage: Optional[Storage] = None
+
+def get_storage() -> Storage:
+    global storage
+    if storage is None:
+        storage = _build_storage()
+    return storage
+
+# -------------------------------------------------------------------------------------
+# Write-behind batching for small, staleness-tolerant store writes
+# -------------------------------------------------------------------------------------
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', '2.0'))
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get('WRITE_BEHIND_MAX_BATCH', '500'))
+WRITE_BEHIND_MAX_PENDING = WRITE_BEHIND_MAX_BATCH * 10
+
+class WriteBehind:
+    """Buffers last_accessed bumps and fire-and-forget inserts, flushed in batches.
+
+    Repeated bumps for one session collapse to the newest timestamp. A flush runs
+    every WRITE_BEHIND_INTERVAL seconds, or sooner once WRITE_BEHIND_MAX_BATCH ops
+    are queued. Failed batches are re-queued (up to WRITE_BEHIND_MAX_PENDING).
+    """
+
+    def __init__(self, interval: float = WRITE_BEHIND_INTERVAL, max_batch: int = WRITE_BEHIND_MAX_BATCH) -> None:
+        self.interval = interval
+        self.max_batch = max_batch
+        self._touches: Dict[str, str] = {}
+        self._inserts: Dict[str, List[Dict[str, Any]]] = {}
+        self._pending_inserts = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.stats: Dict[str, Any] = {
+            "flushes": 0, "ops": 0, "merged": 0, "errors": 0, "dropped": 0, "duplicates": 0,
+            "last_batch": 0, "max_batch": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0,
+        }
+
+    @property
+    def pending(self) -> int:
+        return len(self._touches) + self._pending_inserts
+
+    def touch(self, session_uuid: str, ts: str) -> None:
+        prev = self._touches.get(session_uuid)
+        if prev is not None:
+            self.stats["merged"] += 1
+            if prev >= ts:
+                return
+        self._touches[session_uuid] = ts
+        self._kick()
+
+    def insert(self, collection: str, doc: Dict[str, Any]) -> None:
+        self._inserts.setdefault(collection, []).append(doc)
+        self._pending_inserts += 1
+        self._kick()
+
+    def _kick(self) -> None:
+        if self._closing:
+            return  # close() flushes what is queued once the loop has stopped
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        if self.pending >= self.max_batch:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        touches, self._touches = self._touches, {}
+        inserts, self._inserts = self._inserts, {}
+        self._pending_inserts = 0
+        if not touches and not inserts:
+            return
+
+        store = get_storage()
+        started = time.perf_counter()
+        size = 0
+        batches: List[Tuple[str, Any]] = [("hb_sessions", touches)] if touches else []
+        batches += inserts.items()
+        for name, ops in batches:
+            try:
+                if name == "hb_sessions":
+                    await store.touch_sessions(ops)
+                else:
+                    await store.insert_batch(name, ops)
+                size += len(ops)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if errors and all(err.get("code") == 11000 for err in errors):
+                    # rows a previous, partly applied batch already wrote; nothing to retry
+                    self.stats["duplicates"] += len(errors)
+                    size += len(ops) - len(errors)
+                    continue
+                logging.exception("Write-behind flush to %s failed", name)
+                self.stats["errors"] += 1
+                self._requeue(name, touches, inserts)
+            except Exception:
+                logging.exception("Write-behind flush to %s failed", name)
+                self.stats["errors"] += 1
+                self._requeue(name, touches, inserts)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stats["flushes"] += 1
+        self.stats["ops"] += size
+        self.stats["last_batch"] = size
+        self.stats["max_batch"] = max(self.stats["max_batch"], size)
+        self.stats["last_flush_ms"] = elapsed
+        self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], elapsed)
+
+    def _requeue(self, name: str, touches: Dict[str, str], inserts: Dict[str, List[Dict[str, Any]]]) -> None:
+        if self.pending >= WRITE_BEHIND_MAX_PENDING:
+            self.stats["dropped"] += len(touches) if name == "hb_sessions" else len(inserts.get(name, []))
+            return
+        if name == "hb_sessions":
+            for k, v in touches.items():
+                if self._touches.get(k, "") < v:
+                    self._touches[k] = v
+        else:
+            docs = inserts.get(name, [])
+            self._inserts[name] = docs + self._inserts.get(name, [])
+            self._pending_inserts += len(docs)
+
+    async def close(self) -> None:
+        # Cancelling the loop mid-flush would lose the batch it already swapped out:
+        # stop it between flushes instead, then flush whatever is still queued.
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            self._closing = True
+            self._wakeup.set()
+            try:
+                await asyncio.gather(task, return_exceptions=True)
+            finally:
+                self._closing = False
+        await self.flush()
+
+write_behind = WriteBehind()
+
 # -------------------------------------------------------------------------------------
 # Demo Status models and routes (kept intact)
 # -------------------------------------------------------------------------------------
@@ -62,19 +802,248 @@ async def root():
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_obj = StatusCheck(client_name=input.client_name)
-    await db.status_checks.insert_one(prepare_for_mongo(status_obj.model_dump()))
+    write_behind.insert("status_checks", prepare_for_mongo(status_obj.model_dump()))
     return status_obj
 
+# Keyset pagination on (timestamp, id): the cursor is the last row of the previous
+# page, so every page is an index range scan no matter how deep it is.
+STATUS_PAGE_DEFAULT = 100
+STATUS_PAGE_MAX = 1000
+STATUS_PROJECTION = {"_id": 0, "id": 1, "client_name": 1, "timestamp": 1}
+
+def _encode_status_cursor(doc: Dict[str, Any]) -> str:
+    raw = json.dumps([doc.get("timestamp"), doc.get("id")]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_status_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, sid = json.loads(raw)
+        return str(ts), str(sid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(length=None)
-    # Pydantic will ignore Mongo's _id
-    return [StatusCheck(**sc) for sc in status_checks]
+async def get_status_checks(
+    limit: Optional[int] = Query(None, ge=1, le=STATUS_PAGE_MAX),
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor"),
+    fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+):
+    start = _decode_status_cursor(after) if after else None
+
+    if fmt == "ndjson":
+        # Streamed straight off the store's cursor: constant memory, unbounded unless limited
+        async def _rows():
+            async for doc in get_storage().status_checks(start, limit):
+                yield json.dumps(doc) + "\n"
+
+        return StreamingResponse(_rows(), media_type="application/x-ndjson")
+
+    page_size = limit or STATUS_PAGE_DEFAULT
+    docs = [doc async for doc in get_storage().status_checks(start, page_size)]
+    headers = {"X-Next-Cursor": _encode_status_cursor(docs[-1])} if len(docs) == page_size else {}
+    # Projection already matches StatusCheck; skip per-row model validation
+    return JSONResponse(docs, headers=headers)
 
 # -------------------------------------------------------------------------------------
 # Hyperbeam proxy: create/list/terminate sessions via backend
 # -------------------------------------------------------------------------------------
-HYPERBEAM_BASE = "https://engine.hyperbeam.com/v0"
+HYPERBEAM_BASE = os.environ.get('HYPERBEAM_BASE', "https://engine.hyperbeam.com/v0")
+
+# Shared upstream client: one keep-alive pool for every Hyperbeam call instead of a
+# fresh TLS connection (and a threadpool slot) per request. Created on startup and
+# closed on shutdown after the background tasks that call upstream have stopped;
+# a call after that fails as unavailable instead of opening a new, unclosed pool.
+HB_MAX_CONNECTIONS = int(os.environ.get('HB_MAX_CONNECTIONS', '100'))
+HB_MAX_KEEPALIVE = int(os.environ.get('HB_MAX_KEEPALIVE', '20'))
+HB_KEEPALIVE_EXPIRY = float(os.environ.get('HB_KEEPALIVE_EXPIRY', '30'))
+HB_CONNECT_TIMEOUT = float(os.environ.get('HB_CONNECT_TIMEOUT', '5'))
+HB_READ_TIMEOUT = float(os.environ.get('HB_READ_TIMEOUT', '30'))
+HB_POOL_TIMEOUT = float(os.environ.get('HB_POOL_TIMEOUT', '10'))
+
+hb_http: Optional[httpx.AsyncClient] = None
+hb_http_closed = False
+
+def _build_hb_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=HYPERBEAM_BASE,
+        limits=httpx.Limits(
+            max_connections=HB_MAX_CONNECTIONS,
+            max_keepalive_connections=HB_MAX_KEEPALIVE,
+            keepalive_expiry=HB_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=HB_CONNECT_TIMEOUT,
+            read=HB_READ_TIMEOUT,
+            write=HB_READ_TIMEOUT,
+            pool=HB_POOL_TIMEOUT,
+        ),
+    )
+
+def get_hb_client() -> httpx.AsyncClient:
+    global hb_http
+    if hb_http is None:
+        if hb_http_closed:
+            raise UpstreamUnavailable("Hyperbeam client closed", 1)
+        # Lazily created when the app is driven without lifespan events (e.g. scripts)
+        hb_http = _build_hb_client()
+    return hb_http
+
+# Upstream guard: at most HB_MAX_CONCURRENCY calls in flight, each caller waiting at
+# most HB_QUEUE_TIMEOUT for a slot. After HB_BREAKER_FAILURES consecutive failures
+# (network errors or 5xx) the breaker opens and calls fail fast with 503 +
+# Retry-After; after HB_BREAKER_COOLDOWN one probe call is let through (half-open)
+# and its outcome closes or re-opens the breaker. A 429 counts neither way: it is
+# one API key's quota, and the breaker is shared by every tenant on the worker.
+HB_MAX_CONCURRENCY = int(os.environ.get('HB_MAX_CONCURRENCY', '32'))
+HB_QUEUE_TIMEOUT = float(os.environ.get('HB_QUEUE_TIMEOUT', '2'))
+HB_BREAKER_FAILURES = int(os.environ.get('HB_BREAKER_FAILURES', '5'))
+HB_BREAKER_COOLDOWN = float(os.environ.get('HB_BREAKER_COOLDOWN', '30'))
+# Retries (with full jitter) are only used for terminates, which are safe to repeat
+HB_TERMINATE_RETRIES = int(os.environ.get('HB_TERMINATE_RETRIES', '2'))
+HB_RETRY_BASE_DELAY = float(os.environ.get('HB_RETRY_BASE_DELAY', '0.2'))
+HB_RETRY_MAX_DELAY = float(os.environ.get('HB_RETRY_MAX_DELAY', '2'))
+HB_RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+class UpstreamUnavailable(httpx.HTTPError):
+    """Raised without calling Hyperbeam: breaker open or no free slot in time."""
+
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class UpstreamGuard:
+    """Concurrency limit plus circuit breaker (closed -> open -> half_open -> closed)."""
+
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(
+        self,
+        max_concurrency: int = HB_MAX_CONCURRENCY,
+        queue_timeout: float = HB_QUEUE_TIMEOUT,
+        failure_threshold: int = HB_BREAKER_FAILURES,
+        cooldown: float = HB_BREAKER_COOLDOWN,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.inflight = 0
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.stats: Dict[str, int] = {"opened": 0, "rejected_open": 0, "rejected_queue": 0}
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self._opened_at + self.cooldown - time.monotonic()))
+
+    def _admit(self) -> bool:
+        """Raise if the breaker rejects the call; True when it is the half-open probe."""
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.cooldown:
+                self.stats["rejected_open"] += 1
+                raise UpstreamUnavailable("Hyperbeam circuit open", self.retry_after())
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                self.stats["rejected_open"] += 1
+                raise UpstreamUnavailable("Hyperbeam circuit half-open", 1)
+            self._probing = True
+            return True
+        return False
+
+    def _record(self, ok: bool) -> None:
+        if ok:
+            self.failures = 0
+            self.state = "closed"
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.stats["opened"] += 1
+                logging.warning("Hyperbeam circuit opened after %d consecutive failures", self.failures)
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    async def call(self, send) -> httpx.Response:
+        probe = self._admit()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected_queue"] += 1
+            if probe:
+                self._probing = False
+            raise UpstreamUnavailable("Hyperbeam call queue full", 1) from None
+        except BaseException:
+            if probe:
+                self._probing = False
+            raise
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+        ok: Optional[bool] = None
+        try:
+            resp = await send()
+            if resp.status_code != 429:
+                ok = resp.status_code < 500
+            return resp
+        except httpx.HTTPError:
+            ok = False
+            raise
+        finally:
+            self.inflight -= 1
+            self._slots.release()
+            if probe:
+                self._probing = False
+            if ok is not None:  # a cancelled caller says nothing about upstream health
+                self._record(ok)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"state": self.state, "inflight": self.inflight, "queued": self.waiting, "failures": self.failures}
+
+hb_upstream = UpstreamGuard()
+
+async def _hb_send(op: str, method: str, url: str, **kwargs) -> httpx.Response:
+    """One Hyperbeam call on the shared client, timed and counted by `op` and status."""
+    if not METRICS_ENABLED:
+        return await get_hb_client().request(method, url, **kwargs)
+    started = time.perf_counter()
+    status = "error"
+    try:
+        resp = await get_hb_client().request(method, url, **kwargs)
+        status = str(resp.status_code)
+        return resp
+    finally:
+        HB_UPSTREAM_SECONDS.observe(time.perf_counter() - started, op)
+        HB_UPSTREAM_REQUESTS.inc(op, status)
+
+async def _hb_request(op: str, method: str, url: str, retries: int = 0, **kwargs) -> httpx.Response:
+    """Hyperbeam call through the upstream guard. `retries` is for idempotent calls only:
+    transport errors and retryable statuses are retried after a jittered backoff."""
+    for attempt in range(retries + 1):
+        try:
+            resp = await hb_upstream.call(lambda: _hb_send(op, method, url, **kwargs))
+        except UpstreamUnavailable:
+            raise
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+        else:
+            if resp.status_code not in HB_RETRY_STATUSES or attempt == retries:
+                return resp
+        await asyncio.sleep(random.uniform(0, min(HB_RETRY_MAX_DELAY, HB_RETRY_BASE_DELAY * 2 ** attempt)))
+    raise AssertionError("unreachable")
+
+def _upstream_unavailable(e: UpstreamUnavailable) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Hyperbeam temporarily unavailable",
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
 class HBCreatePayload(BaseModel):
     start_url: Optional[str] = None
@@ -95,12 +1064,453 @@ async def _validate_api_key(authorization: str = Header(...)) -> str:
         raise HTTPException(status_code=401, detail="Invalid authorization header. Use 'Bearer <api_key>'")
     return authorization.split("Bearer ", 1)[1]
 
+# -------------------------------------------------------------------------------------
+# Read-through cache for session/room lookups
+# -------------------------------------------------------------------------------------
+# Joiners hammer GET /rooms/{code} and GET /sessions/{uuid} when a share code goes
+# out. Room docs never change and session docs only flip is_active on terminate,
+# which invalidates explicitly; the TTL bounds staleness across workers.
+HB_CACHE_ENABLED = os.environ.get('HB_CACHE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+HB_CACHE_TTL = float(os.environ.get('HB_CACHE_TTL', '30'))
+HB_CACHE_MAX_ENTRIES = int(os.environ.get('HB_CACHE_MAX_ENTRIES', '10000'))
+
+class TTLCache:
+    """Bounded LRU with a per-entry TTL and single-flight loading of misses."""
+
+    def __init__(self, maxsize: int = HB_CACHE_MAX_ENTRIES, ttl: float = HB_CACHE_TTL, enabled: bool = HB_CACHE_ENABLED) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    async def get_or_load(self, key: str, loader) -> Any:
+        """Return the cached value for `key`, or await `loader()` once for all concurrent callers."""
+        if not self.enabled:
+            return await loader()
+        while True:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.stats["hits"] += 1
+                    self._data.move_to_end(key)
+                    return entry[1]
+                del self._data[key]
+            pending = self._inflight.get(key)
+            if pending is None:
+                return await self._load(key, loader)
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise  # this caller was cancelled
+                # the leading caller was cancelled, not this one: retry, maybe as the new leader
+
+    async def _load(self, key: str, loader) -> Any:
+        self.stats["misses"] += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            if not fut.done():
+                fut.set_exception(e)
+                fut.exception()  # retrieved: don't warn when nobody else was waiting
+            raise
+        finally:
+            current = self._inflight.get(key) is fut
+            if current:
+                del self._inflight[key]
+        # Don't cache a load that raced with invalidate(), and never cache misses
+        if current and value is not None:
+            self.set(key, value)
+        if not fut.done():
+            fut.set_result(value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key: str) -> None:
+        self.stats["invalidations"] += 1
+        self._data.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._inflight.clear()
+
+session_cache = TTLCache()  # session_uuid -> hb_sessions doc
+room_cache = TTLCache()     # code -> hb_rooms doc
+
+async def _load_session(session_uuid: str) -> Optional[Dict[str, Any]]:
+    return await session_cache.get_or_load(
+        session_uuid, lambda: get_storage().get_session(session_uuid)
+    )
+
+async def _load_room(code: str) -> Optional[Dict[str, Any]]:
+    return await room_cache.get_or_load(code, lambda: get_storage().get_room(code))
+
+# -------------------------------------------------------------------------------------
+# Warm pool: pre-created VMs handed out on create
+# -------------------------------------------------------------------------------------
+# Optional (HB_WARM_POOL_ENABLED). One pool per API key and launch shape (size, kiosk,
+# start URL, timeouts), created once an upstream create for it has succeeded, so a
+# bad API key never gets a pool. A pool keeps as many
+# idle VMs as there were creates in the last HB_WARM_POOL_WINDOW seconds, clamped to
+# [HB_WARM_POOL_MIN, HB_WARM_POOL_MAX], and refills in the background after every
+# handout. Idle VMs are terminated once they reach HB_WARM_POOL_MAX_AGE, or
+# HB_WARM_POOL_RETIRE_MARGIN seconds before Hyperbeam's own timeouts would end them.
+# A failed launch stops refills for that pool for HB_WARM_POOL_BACKOFF_BASE seconds,
+# doubling per consecutive failure up to HB_WARM_POOL_BACKOFF_MAX; a 401 or 403
+# drops the pool. Pools are per worker.
+HB_WARM_POOL_ENABLED = os.environ.get('HB_WARM_POOL_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+HB_WARM_POOL_MIN = int(os.environ.get('HB_WARM_POOL_MIN', '0'))
+HB_WARM_POOL_MAX = int(os.environ.get('HB_WARM_POOL_MAX', '3'))
+HB_WARM_POOL_WINDOW = float(os.environ.get('HB_WARM_POOL_WINDOW', '300'))
+HB_WARM_POOL_MAX_AGE = float(os.environ.get('HB_WARM_POOL_MAX_AGE', '600'))
+HB_WARM_POOL_RETIRE_MARGIN = float(os.environ.get('HB_WARM_POOL_RETIRE_MARGIN', '300'))
+HB_WARM_POOL_TICK = float(os.environ.get('HB_WARM_POOL_TICK', '5'))
+HB_WARM_POOL_BACKOFF_BASE = float(os.environ.get('HB_WARM_POOL_BACKOFF_BASE', '5'))
+HB_WARM_POOL_BACKOFF_MAX = float(os.environ.get('HB_WARM_POOL_BACKOFF_MAX', '300'))
+
+# (api_key, width, height, kiosk, start_url, timeout_absolute, timeout_inactive)
+PoolKey = Tuple[str, int, int, bool, str, int, int]
+
+def _vm_body(key: PoolKey) -> Dict[str, Any]:
+    _, width, height, kiosk, start_url, absolute, inactive = key
+    return {
+        "start_url": start_url,
+        "width": width,
+        "height": height,
+        "kiosk": kiosk,
+        "timeout": {"absolute": absolute, "inactive": inactive},
+    }
+
+class WarmPool:
+    """Idle pre-launched VMs per PoolKey, oldest first, each with a retire deadline.
+
+    Entries are (retire deadline, launch time, Hyperbeam response). The launch time
+    goes into the session doc, since Hyperbeam's absolute timeout started then.
+    """
+
+    def __init__(self, min_size: int = HB_WARM_POOL_MIN, max_size: int = HB_WARM_POOL_MAX) -> None:
+        self.min_size = min_size
+        self.max_size = max_size
+        self._idle: Dict[PoolKey, Deque[Tuple[float, str, Dict[str, Any]]]] = {}
+        self._demand: Dict[PoolKey, Deque[float]] = {}
+        self._filling: Dict[PoolKey, int] = {}
+        self._backoff: Dict[PoolKey, Tuple[float, int]] = {}  # key -> (no launches until, failures)
+        self._tasks: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "launched": 0, "launch_errors": 0, "retired": 0,
+                                      "backoffs": 0}
+
+    @staticmethod
+    def key(api_key: str, body: Dict[str, Any]) -> PoolKey:
+        return (api_key, body["width"], body["height"], body["kiosk"], body["start_url"],
+                body["timeout"]["absolute"], body["timeout"]["inactive"])
+
+    @staticmethod
+    def lifetime(key: PoolKey) -> float:
+        """How long a VM for `key` may sit idle; <= 0 means the shape isn't poolable."""
+        return min(HB_WARM_POOL_MAX_AGE, key[5] - HB_WARM_POOL_RETIRE_MARGIN, key[6] - HB_WARM_POOL_RETIRE_MARGIN)
+
+    @property
+    def idle(self) -> int:
+        return sum(len(q) for q in self._idle.values())
+
+    def take(self, key: PoolKey) -> Optional[Tuple[Dict[str, Any], str]]:
+        """Pop a ready VM's Hyperbeam response and launch time for `key` (None on a miss) and refill."""
+        if self.lifetime(key) <= 0:
+            return None
+        if key not in self._demand:
+            self.stats["misses"] += 1  # no pool until a create for this key succeeds
+            return None
+        self._start()
+        now = time.monotonic()
+        self._demand[key].append(now)
+        idle = self._idle.get(key)
+        taken = None
+        while idle:
+            deadline, launched_at, vm = idle.popleft()
+            if deadline > now:
+                taken = (vm, launched_at)
+                break
+            self._retire(key, vm)
+        self.stats["hits" if taken is not None else "misses"] += 1
+        self._refill(key)
+        return taken
+
+    def launched(self, key: PoolKey) -> None:
+        """Start a pool for `key` after a create that missed it succeeded upstream."""
+        if self.lifetime(key) <= 0 or key in self._demand:
+            return  # not poolable, or take() already counted this create
+        self._start()
+        self._demand[key] = deque((time.monotonic(),))
+        self._refill(key)
+
+    def _start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def target(self, key: PoolKey) -> int:
+        demand = self._demand.get(key)
+        cutoff = time.monotonic() - HB_WARM_POOL_WINDOW
+        while demand and demand[0] < cutoff:
+            demand.popleft()
+        return max(self.min_size, min(self.max_size, len(demand) if demand else 0))
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _refill(self, key: PoolKey) -> None:
+        backoff = self._backoff.get(key)
+        if backoff is not None and backoff[0] > time.monotonic():
+            return
+        missing = self.target(key) - len(self._idle.get(key, ())) - self._filling.get(key, 0)
+        for _ in range(max(0, missing)):
+            self._filling[key] = self._filling.get(key, 0) + 1
+            self._spawn(self._launch(key))
+
+    async def _launch(self, key: PoolKey) -> None:
+        launched_at = now_iso()  # no later than Hyperbeam starts the VM's clock
+        try:
+            resp = await _hb_request("pool_create", "POST", "/vm", json=_vm_body(key),
+                                     headers={"Authorization": f"Bearer {key[0]}"})
+            if resp.status_code != 200:
+                logging.warning("Warm pool launch failed: Hyperbeam returned %s", resp.status_code)
+                self._failed(key)
+                if resp.status_code in (401, 403):
+                    self._demand.pop(key, None)  # bad key: maintain() drops the pool
+                return
+            data = resp.json()
+        except UpstreamUnavailable:
+            self._failed(key)
+            return
+        except httpx.HTTPError:
+            logging.exception("Network error calling Hyperbeam (warm pool launch)")
+            self._failed(key)
+            return
+        finally:
+            self._filling[key] = self._filling.get(key, 1) - 1
+        self._backoff.pop(key, None)
+        self.stats["launched"] += 1
+        self._idle.setdefault(key, deque()).append((time.monotonic() + self.lifetime(key), launched_at, data))
+
+    def _failed(self, key: PoolKey) -> None:
+        self.stats["launch_errors"] += 1
+        _, failures = self._backoff.get(key, (0.0, 0))
+        if failures == 0:
+            self.stats["backoffs"] += 1
+        delay = min(HB_WARM_POOL_BACKOFF_MAX, HB_WARM_POOL_BACKOFF_BASE * 2 ** min(failures, 16))
+        self._backoff[key] = (time.monotonic() + delay * random.uniform(0.5, 1.0), failures + 1)
+
+    def _retire(self, key: PoolKey, vm: Dict[str, Any]) -> None:
+        self.stats["retired"] += 1
+        self._spawn(self._terminate(key[0], vm))
+
+    @staticmethod
+    async def _terminate(api_key: str, vm: Dict[str, Any]) -> None:
+        try:
+            await _hb_request("pool_retire", "DELETE", f"/vm/{vm.get('session_id')}",
+                              retries=HB_TERMINATE_RETRIES, headers={"Authorization": f"Bearer {api_key}"})
+        except UpstreamUnavailable:
+            logging.warning("Warm pool VM %s not terminated: Hyperbeam unavailable", vm.get("session_id"))
+        except httpx.HTTPError:
+            logging.exception("Network error calling Hyperbeam (warm pool retire)")
+
+    def maintain(self) -> None:
+        """Retire expired and surplus VMs, top pools back up, forget unused pools."""
+        now = time.monotonic()
+        for key in list(set(self._idle) | set(self._demand)):
+            idle = self._idle.get(key, deque())
+            # every VM of a key shares one lifetime, so the oldest expires first
+            while idle and idle[0][0] <= now:
+                self._retire(key, idle.popleft()[2])
+            target = self.target(key)
+            while len(idle) > target:
+                self._retire(key, idle.popleft()[2])
+            if not idle and not self._demand.get(key) and not self._filling.get(key):
+                self._idle.pop(key, None)
+                self._demand.pop(key, None)
+                self._filling.pop(key, None)
+                self._backoff.pop(key, None)
+            else:
+                self._refill(key)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(HB_WARM_POOL_TICK)
+            try:
+                self.maintain()
+            except Exception:
+                logging.exception("Warm pool maintenance failed")
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Stop refilling and terminate every idle VM so none are left billing."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+        idle, self._idle = self._idle, {}
+        self._demand.clear()
+        self._backoff.clear()
+        jobs = [self._terminate(key[0], vm) for key, q in idle.items() for _, _, vm in q]
+        if jobs:
+            await asyncio.wait([asyncio.ensure_future(j) for j in jobs], timeout=timeout)
+
+warm_pool = WarmPool()
+
 @hb_router.get("/health")
 async def hb_health():
-    return {"status": "healthy", "service": "hyperbeam-proxy", "timestamp": now_iso()}
+    return {"status": "healthy", "service": "hyperbeam-proxy", "timestamp": now_iso(), "upstream": hb_upstream.snapshot()}
+
+# -------------------------------------------------------------------------------------
+# Idempotency-Key for session creation
+# -------------------------------------------------------------------------------------
+# Retries and double-clicks carrying the same Idempotency-Key get one VM. Requests on
+# this worker share the in-flight launch; across workers a pending claim document
+# makes a concurrent duplicate fail fast with 409. Completed responses are replayed
+# for IDEMPOTENCY_TTL seconds, after which a TTL index (or the memory store's sweep)
+# removes them. A claim left
+# behind by a crashed worker lapses after IDEMPOTENCY_PENDING_TTL.
+IDEMPOTENCY_COLLECTION = os.environ.get('IDEMPOTENCY_COLLECTION', 'hb_idempotency')
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', '3600'))
+IDEMPOTENCY_PENDING_TTL = float(os.environ.get('IDEMPOTENCY_PENDING_TTL', '120'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+class IdempotencyStore:
+    """Runs a request handler at most once per key and remembers its JSON response."""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL) -> None:
+        self.ttl = ttl
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self.stats: Dict[str, int] = {"executed": 0, "replayed": 0, "shared": 0, "conflicts": 0}
+
+    @staticmethod
+    def scope(api_key: str, key: str) -> str:
+        # Keys are per API key, so one tenant can't collide with or replay another's
+        return hashlib.sha256(f"{api_key}\0{key}".encode()).hexdigest()
+
+    async def run(self, scope: str, fingerprint: str, handler) -> Tuple[Dict[str, Any], bool]:
+        """Return (response body, replayed). `fingerprint` identifies the request body;
+        reusing a key for a different body is rejected with 422."""
+        while True:
+            entry = self._inflight.get(scope)
+            if entry is None:
+                break
+            if entry[0] != fingerprint:
+                raise self._mismatch()
+            self.stats["shared"] += 1
+            try:
+                body, _ = await asyncio.shield(entry[1])
+            except asyncio.CancelledError:
+                if not entry[1].cancelled():
+                    raise  # this caller was cancelled
+                continue  # the leading request was cancelled: retry, maybe as the new leader
+            return body, True
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[scope] = (fingerprint, fut)
+        try:
+            result = await self._run_once(scope, fingerprint, handler)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # retrieved: don't warn when nobody else was waiting
+            raise
+        finally:
+            if self._inflight.get(scope, (None, None))[1] is fut:
+                del self._inflight[scope]
+        fut.set_result(result)
+        return result
+
+    async def _run_once(self, scope: str, fingerprint: str, handler) -> Tuple[Dict[str, Any], bool]:
+        store = get_storage()
+        now = datetime.now(timezone.utc)
+        doc = await store.get_claim(scope)
+        if doc is not None and doc["expires_at"] <= now:
+            # lapsed but not yet reaped by the TTL monitor
+            await store.delete_claim(scope, doc["expires_at"])
+            doc = None
+        if doc is not None:
+            if doc.get("fingerprint") != fingerprint:
+                raise self._mismatch()
+            if doc.get("response") is None:
+                self.stats["conflicts"] += 1
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+            self.stats["replayed"] += 1
+            return doc["response"], True
+
+        try:
+            await store.insert_claim({
+                "_id": scope,
+                "fingerprint": fingerprint,
+                "response": None,
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=IDEMPOTENCY_PENDING_TTL),
+            })
+        except DuplicateKeyError:
+            self.stats["conflicts"] += 1
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+        try:
+            body = await handler()
+        except BaseException:
+            # failed requests are not remembered, so the client can retry with the same key
+            await store.delete_claim(scope)
+            raise
+        self.stats["executed"] += 1
+        await store.complete_claim(scope, body, datetime.now(timezone.utc) + timedelta(seconds=self.ttl))
+        return body, False
+
+    @staticmethod
+    def _mismatch() -> HTTPException:
+        return HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body")
+
+session_idempotency = IdempotencyStore()
 
 @hb_router.post("/sessions", response_model=HBSessionResponse)
-async def hb_create_session(payload: HBCreatePayload, api_key: str = Depends(_validate_api_key)):
+async def hb_create_session(
+    payload: HBCreatePayload,
+    api_key: str = Depends(_validate_api_key),
+    idempotency_key: Optional[str] = Header(None),
+):
+    if not idempotency_key:
+        return await _launch_session(payload, api_key)
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key longer than {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+
+    async def launch() -> Dict[str, Any]:
+        return (await _launch_session(payload, api_key)).model_dump()
+
+    fingerprint = hashlib.sha256(json.dumps(payload.model_dump(), sort_keys=True).encode()).hexdigest()
+    body, replayed = await session_idempotency.run(
+        IdempotencyStore.scope(api_key, idempotency_key), fingerprint, launch
+    )
+    return JSONResponse(body, headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+async def _launch_session(payload: HBCreatePayload, api_key: str) -> HBSessionResponse:
     body = {
         "start_url": payload.start_url or "https://www.google.com",
         "width": payload.width or 1280,
@@ -112,24 +1522,35 @@ async def hb_create_session(payload: HBCreatePayload, api_key: str = Depends(_va
         },
     }
 
-    def _post():
-        return requests.post(
-            f"{HYPERBEAM_BASE}/vm",
-            json=body,
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            timeout=30,
-        )
-
-    try:
-        resp = await run_in_threadpool(_post)
-    except requests.RequestException as e:
-        logging.exception("Network error calling Hyperbeam")
-        raise HTTPException(status_code=503, detail="Service temporarily unavailable") from e
+    started = time.perf_counter()
+    pool_key = WarmPool.key(api_key, body)
+    taken = warm_pool.take(pool_key) if HB_WARM_POOL_ENABLED else None
+    source = "pool"
+    if taken is not None:
+        data, created_at = taken
+    else:
+        source = "upstream"
+        try:
+            resp = await _hb_request(
+                "create", "POST", "/vm",
+                json=body,
+                headers={"Authorization": f"Bearer {api_key}"},
+            )
+        except UpstreamUnavailable as e:
+            raise _upstream_unavailable(e) from e
+        except httpx.HTTPError as e:
+            logging.exception("Network error calling Hyperbeam")
+            raise HTTPException(status_code=503, detail="Service temporarily unavailable") from e
 
-    if resp.status_code != 200:
-        raise HTTPException(status_code=resp.status_code, detail=f"Hyperbeam error: {resp.text}")
+        if resp.status_code != 200:
+            raise HTTPException(status_code=resp.status_code, detail=f"Hyperbeam error: {resp.text}")
 
-    data = resp.json()
+        data = resp.json()
+        created_at = now_iso()
+        if HB_WARM_POOL_ENABLED:
+            warm_pool.launched(pool_key)
+    if METRICS_ENABLED:
+        HB_LAUNCH_SECONDS.observe(time.perf_counter() - started, source)
     session_uuid = str(uuid.uuid4())
 
     doc = {
@@ -137,16 +1558,18 @@ async def hb_create_session(payload: HBCreatePayload, api_key: str = Depends(_va
         "hyperbeam_session_id": data.get("session_id"),
         "embed_url": data.get("embed_url"),
         "admin_token": data.get("admin_token"),
-        "created_at": now_iso(),
+        "created_at": created_at,  # a pooled VM's absolute timeout runs from its launch
         "last_accessed": now_iso(),
         "is_active": True,
+        "timeout_absolute": body["timeout"]["absolute"],
+        "timeout_inactive": body["timeout"]["inactive"],
         "metadata": {
             "width": body["width"],
             "height": body["height"],
             "start_url": body["start_url"],
         },
     }
-    await db.hb_sessions.insert_one(prepare_for_mongo(doc))
+    await get_storage().insert_session(prepare_for_mongo(doc))
 
     return HBSessionResponse(
         session_uuid=session_uuid,
@@ -157,16 +1580,13 @@ async def hb_create_session(payload: HBCreatePayload, api_key: str = Depends(_va
 
 @hb_router.get("/sessions/{session_uuid}", response_model=HBSessionResponse)
 async def hb_get_session(session_uuid: str):
-    doc = await db.hb_sessions.find_one({"session_uuid": session_uuid})
+    doc = await _load_session(session_uuid)
     if not doc:
         raise HTTPException(status_code=404, detail="Session not found")
     if not doc.get("is_active", False):
         raise HTTPException(status_code=410, detail="Session inactive")
 
-    await db.hb_sessions.update_one(
-        {"session_uuid": session_uuid},
-        {"$set": {"last_accessed": now_iso()}},
-    )
+    write_behind.touch(session_uuid, now_iso())
 
     return HBSessionResponse(
         session_uuid=doc["session_uuid"],
@@ -177,30 +1597,32 @@ async def hb_get_session(session_uuid: str):
 
 @hb_router.delete("/sessions/{session_uuid}")
 async def hb_terminate_session(session_uuid: str, api_key: str = Depends(_validate_api_key)):
-    doc = await db.hb_sessions.find_one({"session_uuid": session_uuid})
+    doc = await _load_session(session_uuid)
     if not doc:
         raise HTTPException(status_code=404, detail="Session not found")
 
     hb_id = doc.get("hyperbeam_session_id")
 
-    def _delete():
-        return requests.delete(
-            f"{HYPERBEAM_BASE}/vm/{hb_id}",
+    try:
+        resp = await _hb_request(
+            "terminate", "DELETE", f"/vm/{hb_id}",
+            retries=HB_TERMINATE_RETRIES,
             headers={"Authorization": f"Bearer {api_key}"},
-            timeout=30,
         )
-
-    try:
-        resp = await run_in_threadpool(_delete)
-    except requests.RequestException as e:
+    except UpstreamUnavailable as e:
+        raise _upstream_unavailable(e) from e
+    except httpx.HTTPError as e:
         logging.exception("Network error calling Hyperbeam (terminate)")
         raise HTTPException(status_code=503, detail="Service temporarily unavailable") from e
 
     # Mark inactive regardless of external response to avoid zombie sessions
-    await db.hb_sessions.update_one(
-        {"session_uuid": session_uuid},
-        {"$set": {"is_active": False, "last_accessed": now_iso()}},
-    )
+    ended_at = now_iso()
+    ended = await get_storage().end_sessions({session_uuid: {
+        "is_active": False, "last_accessed": ended_at, "ended_at": ended_at, "ended_reason": "terminated",
+    }})
+    session_cache.invalidate(session_uuid)
+    if ended:
+        await session_reaper.end_rooms({session_uuid: "terminated"})
 
     if resp.status_code not in (200, 204):
         # Still consider session terminated locally
@@ -227,40 +1649,43 @@ def _gen_code(n: int = 6) -> str:
 
 @hb_router.post("/rooms", response_model=RoomResponse)
 async def create_room(payload: CreateRoomPayload):
-    sess = await db.hb_sessions.find_one({"session_uuid": payload.session_uuid, "is_active": True})
-    if not sess:
+    sess = await _load_session(payload.session_uuid)
+    if not sess or not sess.get("is_active", False):
         raise HTTPException(status_code=404, detail="Active session not found")
 
-    # ensure unique code
+    # unique index on code: insert and retry on the rare collision
     for _ in range(10):
-        code = _gen_code()
-        existing = await db.hb_rooms.find_one({"code": code})
-        if not existing:
+        doc = {
+            "code": _gen_code(),
+            "session_uuid": payload.session_uuid,
+            "label": payload.label or "",
+            "created_at": now_iso(),
+        }
+        try:
+            await get_storage().insert_room(doc)
             break
+        except DuplicateKeyError:
+            continue
     else:
         raise HTTPException(status_code=500, detail="Failed to generate room code")
 
-    doc = {
-        "code": code,
-        "session_uuid": payload.session_uuid,
-        "label": payload.label or "",
-        "created_at": now_iso(),
-    }
-    await db.hb_rooms.insert_one(doc)
+    room_cache.set(doc["code"], doc)
     return RoomResponse(**doc)
 
 @hb_router.get("/rooms/{code}", response_model=HBSessionResponse)
 async def get_room_session(code: str):
-    room = await db.hb_rooms.find_one({"code": code})
+    room = await _load_room(code)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
 
-    sess = await db.hb_sessions.find_one({"session_uuid": room["session_uuid"]})
+    sess = await _load_session(room["session_uuid"])
     if not sess:
         raise HTTPException(status_code=404, detail="Session not found")
     if not sess.get("is_active", False):
         raise HTTPException(status_code=410, detail="Session inactive")
 
+    await session_reaper.room_active(code)
+
     return HBSessionResponse(
         session_uuid=sess["session_uuid"],
         embed_url=sess["embed_url"],
@@ -268,35 +1693,395 @@ async def get_room_session(code: str):
         metadata=sess.get("metadata", {}),
     )
 
-# -------------------------------------------------------------------------------------
-# WebSocket: presence + chat per room code
-# -------------------------------------------------------------------------------------
+# -------------------------------------------------------------------------------------
+# Rate limiting for realtime traffic
+# -------------------------------------------------------------------------------------
+# Token buckets per connection, per user within a room and per room, with separate
+# budgets for chat and presence. RATE_LIMITS entries are "<kind>.<scope>=<rate>/<burst>"
+# (events per second / bucket size); a level without an entry is unlimited. Event
+# POSTs have no connection to key on (client addresses are shared behind proxies), so
+# they are limited per user and per room. Over-limit socket messages are dropped
+# before they are encoded or fanned out, except head moves: the latest refused head
+# per user is held by the presence coalescer and sent once the budget refills, so
+# the final position always lands. Over-limit POSTs get a 429.
+RATE_LIMIT_SWEEP_INTERVAL = 60.0
+
+def _parse_rate_limits(raw: str) -> Dict[Tuple[str, str], Tuple[float, float]]:
+    limits: Dict[Tuple[str, str], Tuple[float, float]] = {}
+    for item in raw.split(','):
+        if '=' not in item or '.' not in item.split('=', 1)[0]:
+            continue
+        name, value = item.split('=', 1)
+        kind, scope = name.strip().split('.', 1)
+        rate, _, burst = value.partition('/')
+        limits[(kind, scope)] = (float(rate), float(burst or rate))
+    return limits
+
+RATE_LIMITS = _parse_rate_limits(os.environ.get(
+    'RATE_LIMITS',
+    'chat.conn=2/10,chat.user=3/15,chat.room=30/60,'
+    'presence.conn=30/60,presence.user=40/80,presence.room=600/1200',
+))
+
+def _rate_kind(mtype: Optional[str]) -> str:
+    return "presence" if mtype in ("presence", "ping") else "chat"
+
+class RateLimiter:
+    """Token buckets keyed by (kind, scope, identity); each check is O(1).
+
+    Buckets are created full and forgotten by a periodic sweep once they have
+    refilled, which makes them indistinguishable from a fresh one.
+    """
+
+    SCOPES = ("conn", "user", "room")
+
+    def __init__(self, limits: Dict[Tuple[str, str], Tuple[float, float]] = RATE_LIMITS) -> None:
+        self.limits = limits
+        self._buckets: Dict[Tuple[str, str, Any], List[float]] = {}
+        self._next_sweep = time.monotonic() + RATE_LIMIT_SWEEP_INTERVAL
+        self.stats: Dict[Tuple[str, str], int] = {
+            (kind, scope): 0 for kind in ("chat", "presence") for scope in self.SCOPES
+        }
+
+    def acquire(self, kind: str, conn: Any = None, code: Optional[str] = None, user: Optional[str] = None) -> float:
+        """Take a token at every applicable level. Returns 0 when allowed, otherwise
+        the seconds until the refusing bucket has a token again (nothing is taken)."""
+        if not self.limits:
+            return 0.0
+        now = time.monotonic()
+        taken: List[List[float]] = []
+        for scope, ident in (("conn", conn), ("user", (code, user) if user else None), ("room", code)):
+            limit = self.limits.get((kind, scope))
+            if limit is None or ident is None:
+                continue
+            rate, burst = limit
+            key = (kind, scope, ident)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now, rate, burst]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                for b in taken:
+                    b[0] += 1
+                self.stats[(kind, scope)] = self.stats.get((kind, scope), 0) + 1
+                return (1 - bucket[0]) / rate
+            bucket[0] -= 1
+            taken.append(bucket)
+        if now >= self._next_sweep:
+            self._sweep(now)
+        return 0.0
+
+    def forget_conn(self, conn: Any) -> None:
+        for kind in ("chat", "presence"):
+            self._buckets.pop((kind, "conn", conn), None)
+
+    def _sweep(self, now: float) -> None:
+        self._next_sweep = now + RATE_LIMIT_SWEEP_INTERVAL
+        full = [k for k, (tokens, last, rate, burst) in self._buckets.items() if tokens + (now - last) * rate >= burst]
+        for key in full:
+            del self._buckets[key]
+
+rate_limiter = RateLimiter()
+
+# -------------------------------------------------------------------------------------
+# WebSocket: presence + chat per room code
+# -------------------------------------------------------------------------------------
+# Outbound frames are queued per connection and written by that connection's own
+# task, so a slow client only ever backs up its own queue. When a queue is full the
+# policy for the frame's type decides: "drop_oldest" sheds the oldest queued frame of
+# that type (fine for presence batches, the next move supersedes them), "drop_newest"
+# discards the new frame, "disconnect" evicts the client rather than losing the frame
+# (chat). Presence frames are typed by their event, "presence/batch",
+# "presence/join" or "presence/leave", falling back to a plain "presence" entry:
+# a lost join or leave is never superseded and would leave a ghost avatar, so only
+# batches are shed by default.
+WS_SEND_QUEUE_MAX = int(os.environ.get('WS_SEND_QUEUE_MAX', '256'))
+WS_OVERFLOW_DEFAULT = os.environ.get('WS_OVERFLOW_DEFAULT', 'disconnect')
+
+def _parse_overflow_policy(raw: str) -> Dict[str, str]:
+    policy: Dict[str, str] = {}
+    for item in raw.split(','):
+        if '=' in item:
+            mtype, action = item.split('=', 1)
+            policy[mtype.strip()] = action.strip()
+    return policy
+
+WS_OVERFLOW_POLICY = _parse_overflow_policy(
+    os.environ.get('WS_OVERFLOW_POLICY', 'presence/batch=drop_oldest,pong=drop_newest,chat=disconnect')
+)
+
+def _overflow_kind(kind: str, event: Optional[Dict[str, Any]]) -> str:
+    if kind == "presence" and event is not None and event.get("event"):
+        return f"presence/{event['event']}"
+    return kind
+
+def _overflow_action(kind: str) -> str:
+    action = WS_OVERFLOW_POLICY.get(kind)
+    if action is None:
+        action = WS_OVERFLOW_POLICY.get(kind.split('/', 1)[0], WS_OVERFLOW_DEFAULT)
+    return action
+
+# -------------------------------------------------------------------------------------
+# Compact binary WS protocol (opt-in via {"type": "hello", "encoding": "compact"})
+# -------------------------------------------------------------------------------------
+# Every server frame is binary and starts with an opcode byte:
+#   0x01 JSON   <json bytes>                    any event, same body as the text protocol
+#   0x02 USER   !H uid, <json user>             introduces a room-local numeric uid
+#   0x03 HEADS  !H count, count x !Hhhh         uid, dx, dy, dsize per user
+# Head values are integer deltas against the last HEADS state this connection was
+# sent for that uid (starting from 0,0,0). Frames are translated by the connection's
+# writer task at send time, so frames shed under backpressure never break the chain.
+# Clients may send 0x04 HEAD !hhh (x, y, size, absolute) instead of a JSON presence.
+WS_OP_JSON = 0x01
+WS_OP_USER = 0x02
+WS_OP_HEADS = 0x03
+WS_OP_HEAD_IN = 0x04
+_HEADS_HDR = struct.Struct("!BH")
+_HEADS_ENTRY = struct.Struct("!Hhhh")
+_USER_HDR = struct.Struct("!BH")
+_HEAD_IN = struct.Struct("!Bhhh")
+
+def _clamp16(v: int) -> int:
+    return -32768 if v < -32768 else 32767 if v > 32767 else v
+
+def _head_ints(head: Dict[str, Any]) -> Tuple[int, int, int]:
+    pos = head.get("pos") or {}
+    try:
+        return int(round(pos.get("x", 0))), int(round(pos.get("y", 0))), int(round(head.get("size", 0) or 0))
+    except (TypeError, ValueError):
+        return 0, 0, 0
+
+class CompactCodec:
+    """Per-connection translator from room events to the compact binary protocol."""
+
+    def __init__(self, uids: Dict[str, int], next_uid) -> None:
+        self.uids = uids            # room-wide user id -> small uid (shared)
+        self._next_uid = next_uid   # allocates a uid for a user not seen yet
+        self.announced: Set[int] = set()
+        self.heads: Dict[int, Tuple[int, int, int]] = {}
+
+    def encode(self, frame: bytes, event: Optional[Dict[str, Any]]) -> List[bytes]:
+        if not (event and event.get("type") == "presence" and event.get("event") == "batch"):
+            return [bytes((WS_OP_JSON,)) + frame]
+        out: List[bytes] = []
+        entries: List[bytes] = []
+        for update in event.get("updates", ()):
+            user = update.get("user") or {}
+            uid = self._next_uid(str(user.get("id") or ""))
+            if uid not in self.announced:
+                self.announced.add(uid)
+                out.append(_USER_HDR.pack(WS_OP_USER, uid) + dumps_frame(user))
+            x, y, size = _head_ints(update.get("head") or {})
+            px, py, ps = self.heads.get(uid, (0, 0, 0))
+            dx, dy, ds = _clamp16(x - px), _clamp16(y - py), _clamp16(size - ps)
+            self.heads[uid] = (px + dx, py + dy, ps + ds)
+            entries.append(_HEADS_ENTRY.pack(uid, dx, dy, ds))
+        out.append(_HEADS_HDR.pack(WS_OP_HEADS, len(entries)) + b"".join(entries))
+        return out
+
+def decode_head_in(data: bytes) -> Optional[Dict[str, Any]]:
+    if len(data) != _HEAD_IN.size or data[0] != WS_OP_HEAD_IN:
+        return None
+    _, x, y, size = _HEAD_IN.unpack(data)
+    return {"pos": {"x": x, "y": y}, "size": size}
+
+class RoomConnection:
+    """Outbound side of one socket: a bounded frame queue drained by a writer task.
+
+    Queue items are (kind, frame bytes, text or None, event or None). JSON clients
+    get the text frame; compact clients get it translated by their codec.
+    """
+
+    def __init__(self, websocket: WebSocket, maxsize: int = WS_SEND_QUEUE_MAX) -> None:
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.codec: Optional[CompactCodec] = None
+        self.queue: Deque[Tuple[str, bytes, Optional[str], Optional[Dict[str, Any]]]] = deque()
+        self.dropped = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, on_error) -> None:
+        self._task = asyncio.create_task(self._run(on_error))
+
+    def preload(self, frames: List[bytes]) -> None:
+        """Queue replayed log frames ahead of live traffic, outside the overflow policy."""
+        for frame in frames:
+            event = loads_frame(frame) if self.codec is not None else None
+            self.queue.append(("replay", frame, None, event))
+        if frames:
+            self._wakeup.set()
+
+    def offer(self, kind: str, frame: bytes, text: Optional[str] = None, event: Optional[Dict[str, Any]] = None) -> bool:
+        """Queue a frame without blocking. False means the client should be evicted."""
+        if self.closed:
+            return False
+        kind = _overflow_kind(kind, event)
+        if len(self.queue) >= self.maxsize:
+            action = _overflow_action(kind)
+            if action == "disconnect":
+                return False
+            self.dropped += 1
+            if action != "drop_oldest":
+                return True
+            for i, item in enumerate(self.queue):
+                if item[0] == kind:
+                    del self.queue[i]
+                    break
+            else:
+                # nothing of this type to shed; the new frame is the one that goes
+                return True
+        self.queue.append((kind, frame, text, event))
+        self._wakeup.set()
+        return True
+
+    async def _run(self, on_error) -> None:
+        try:
+            while True:
+                if not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                _, frame, text, event = self.queue.popleft()
+                if self.codec is not None:
+                    for chunk in self.codec.encode(frame, event):
+                        await self.websocket.send_bytes(chunk)
+                else:
+                    await self.websocket.send_text(text if text is not None else frame.decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # drop broken connection silently
+            on_error()
+
+    def close(self) -> None:
+        self.closed = True
+        self.queue.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
 class RoomManager:
     def __init__(self) -> None:
         self.rooms: Dict[str, Set[WebSocket]] = {}
         self.ident: Dict[WebSocket, Dict[str, Any]] = {}
+        self.conns: Dict[WebSocket, RoomConnection] = {}
+        self.uids: Dict[str, Dict[str, int]] = {}  # code -> user id -> compact uid
+        self.evicted = 0
 
     async def connect(self, code: str, websocket: WebSocket):
+        # Accepted but not yet in the room: live frames start at join()
         await websocket.accept()
-        self.rooms.setdefault(code, set()).add(websocket)
+        conn = RoomConnection(websocket)
+        conn.start(lambda: self.evict(code, websocket))
+        self.conns[websocket] = conn
+
+    def join(self, code: str, websocket: WebSocket, resume_from: Optional[int] = None, snapshot: bool = False):
+        """Start live delivery, first replaying the room log after `resume_from`.
+
+        The replay is queued and the socket added to the room without an await in
+        between, so every seq reaches the client exactly once. resume_from=0 (or a
+        seq from before the log restarted) replays the recent tail. With `snapshot`
+        and nothing to resume, the client gets the room snapshot instead.
+        """
+        conn = self.conns.get(websocket)
+        if conn is None:
+            return
+        log = room_logs.get(code) if resume_from is not None or snapshot else None
+        resumable = (log is not None and resume_from is not None
+                     and 0 < resume_from <= log.last_seq and resume_from + 1 >= log.first_seq)
+        if snapshot and not resumable:
+            conn.preload([log.state.encode(log.last_seq) if log is not None else EMPTY_SNAPSHOT])
+        elif log is not None:
+            if resume_from <= 0 or resume_from > log.last_seq:
+                frames = log.tail(50)
+            else:
+                if resume_from + 1 < log.first_seq:
+                    # missed more than the ring holds: tell the client to resync
+                    conn.preload([dumps_frame({"type": "gap", "from": resume_from + 1, "to": log.first_seq - 1})])
+                frames = log.since(resume_from)
+            conn.preload(frames)
+        sockets = self.rooms.setdefault(code, set())
+        sockets.add(websocket)
+        room_directory.set_sockets(code, len(sockets))
 
     def disconnect(self, code: str, websocket: WebSocket):
         try:
             self.rooms.get(code, set()).discard(websocket)
             self.ident.pop(websocket, None)
+            conn = self.conns.pop(websocket, None)
+            if conn is not None:
+                conn.close()
+            room_directory.set_sockets(code, len(self.rooms.get(code, ())))
             if not self.rooms.get(code):
                 self.rooms.pop(code, None)
+                self.uids.pop(code, None)
+        except Exception:
+            pass
+
+    def use_compact(self, code: str, websocket: WebSocket) -> Optional[int]:
+        """Switch a connection to the compact protocol; returns the caller's uid."""
+        conn = self.conns.get(websocket)
+        if conn is None:
+            return None
+        uids = self.uids.setdefault(code, {})
+
+        def next_uid(user_id: str) -> int:
+            uid = uids.get(user_id)
+            if uid is None:
+                uid = uids[user_id] = len(uids) + 1
+            return uid
+
+        conn.codec = CompactCodec(uids, next_uid)
+        return next_uid(str(self.ident.get(websocket, {}).get("id") or ""))
+
+    def evict(self, code: str, websocket: WebSocket):
+        """Stop sending to a client that overflowed or broke; its handler does the rest."""
+        conn = self.conns.get(websocket)
+        if conn is None or conn.closed:
+            return
+        conn.close()
+        self.evicted += 1
+        self.rooms.get(code, set()).discard(websocket)
+        room_directory.set_sockets(code, len(self.rooms.get(code, ())))
+        if not self.rooms.get(code):
+            self.rooms.pop(code, None)
+            self.uids.pop(code, None)
+        # 1013: try again later; wakes the handler's receive loop so it cleans up
+        asyncio.ensure_future(self._close_quietly(websocket, 1013))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
         except Exception:
             pass
 
+    def send(self, code: str, websocket: WebSocket, message: Dict[str, Any]):
+        conn = self.conns.get(websocket)
+        if conn is not None and not conn.offer(message.get("type", ""), dumps_frame(message), event=message):
+            self.evict(code, websocket)
+
     async def broadcast(self, code: str, message: Dict[str, Any]):
-        data = json.dumps(message)
-        for ws in list(self.rooms.get(code, set())):
-            try:
-                await ws.send_text(data)
-            except Exception:
-                # drop broken connection silently
-                self.disconnect(code, ws)
+        self.broadcast_frame(code, message.get("type", ""), dumps_frame(message), message)
+
+    def broadcast_frame(self, code: str, kind: str, frame: bytes, event: Optional[Dict[str, Any]] = None):
+        # Enqueue only; each connection's writer task does the actual send
+        started = time.perf_counter() if METRICS_ENABLED else 0.0
+        text = None
+        sockets = list(self.rooms.get(code, ()))
+        for ws in sockets:
+            conn = self.conns.get(ws)
+            if conn is not None and conn.codec is None and text is None:
+                text = frame.decode()  # decoded once, shared by every JSON client
+            if conn is None or not conn.offer(kind, frame, text, event):
+                self.evict(code, ws)
+        if METRICS_ENABLED:
+            label = kind if kind in METRIC_EVENT_KINDS else "other"
+            WS_BROADCAST_SECONDS.observe(time.perf_counter() - started, label)
+            WS_FRAMES.inc(label, amount=len(sockets))
 
 manager = RoomManager()
 
@@ -306,35 +2091,65 @@ async def ws_room(websocket: WebSocket, code: str):
     await manager.connect(code, websocket)
     try:
         # Expect first message to be an identify payload
-        # {"type":"hello","user":{"id":...,"name":...,"color":...}}
+        # {"type":"hello","user":{"id":...,"name":...,"color":...},"resume_from":<last seen id>}
+        # or {..., "snapshot": true} to start from the room snapshot instead of a replay
         raw = await websocket.receive_text()
         try:
-            init = json.loads(raw)
+            init = loads_frame(raw)
         except Exception:
             init = {}
         if isinstance(init, dict) and init.get("type") == "hello":
             manager.ident[websocket] = init.get("user", {})
+            if init.get("encoding") == "compact":
+                uid = manager.use_compact(code, websocket)
+                manager.send(code, websocket, {"type": "welcome", "encoding": "compact", "uid": uid})
+            resume_from = init.get("resume_from")
+            manager.join(code, websocket, resume_from if isinstance(resume_from, int) else None,
+                         snapshot=bool(init.get("snapshot")))
             # announce join
-            await manager.broadcast(code, {"type": "presence", "event": "join", "user": manager.ident[websocket], "ts": now_iso()})
+            await broker.publish(code, {"type": "presence", "event": "join", "user": manager.ident[websocket], "ts": realtime_ts()})
         else:
             manager.ident[websocket] = {"id": str(uuid.uuid4())}
+            manager.join(code, websocket)
+        await session_reaper.room_active(code)
 
         # Main loop
+        conn_key = id(websocket)
         while True:
-            msg = await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            await session_reaper.room_active(code)
+            user_id = str(manager.ident.get(websocket, {}).get("id") or "")
+            if message.get("bytes") is not None:
+                head = decode_head_in(message["bytes"])
+                if head is not None:
+                    presence_coalescer.offer(code, manager.ident.get(websocket, {}), head,
+                                             delay=rate_limiter.acquire("presence", conn_key, code, user_id))
+                continue
             try:
-                payload = json.loads(msg)
+                payload = loads_frame(message.get("text") or "")
             except Exception:
                 continue
+            if not isinstance(payload, dict):
+                continue
             mtype = payload.get("type")
+            if mtype == "presence" and payload.get("head") is not None:
+                # head moves are coalesced and flushed once per tick
+                presence_coalescer.offer(code, manager.ident.get(websocket, {}), payload["head"],
+                                         delay=rate_limiter.acquire("presence", conn_key, code, user_id))
+                continue
+            if rate_limiter.acquire(_rate_kind(mtype), conn_key, code, user_id):
+                continue
             if mtype == "ping":
-                await websocket.send_text(json.dumps({"type": "pong", "ts": now_iso()}))
+                manager.send(code, websocket, {"type": "pong", "ts": realtime_ts()})
                 continue
             if mtype in ("chat", "presence"):
                 # attach user
                 payload["user"] = manager.ident.get(websocket, {})
-                payload.setdefault("ts", now_iso())
-                await manager.broadcast(code, payload)
+                payload.setdefault("ts", realtime_ts())
+                # broadcast, and mirror into the polling log so long-poll clients wake up too
+                await broker.publish(code, payload)
     except WebSocketDisconnect:
         pass
     except Exception:
@@ -342,23 +2157,295 @@ async def ws_room(websocket: WebSocket, code: str):
     finally:
         user = manager.ident.get(websocket)
         manager.disconnect(code, websocket)
+        rate_limiter.forget_conn(id(websocket))
         if user:
+            presence_coalescer.forget(code, str(user.get("id") or ""))
             # announce leave
             try:
-                await manager.broadcast(code, {"type": "presence", "event": "leave", "user": user, "ts": now_iso()})
+                await broker.publish(code, {"type": "presence", "event": "leave", "user": user, "ts": realtime_ts()})
             except Exception:
                 pass
 
 # -------------------------------------------------------------------------------------
 # HTTP Polling fallback for realtime events (chat + presence)
 # -------------------------------------------------------------------------------------
-# In-memory event storage per room (MVP). Note: not multi-pod persistent.
-ROOM_EVENTS: Dict[str, List[Dict[str, Any]]] = {}
-ROOM_SEQ: Dict[str, int] = {}
-MAX_EVENTS = 200
+# In-memory event storage per room. Each worker keeps its own copy, fed by the room
+# broker below (ROOM_BROKER=mongo shares events and sequence numbers across workers).
+MAX_EVENTS = int(os.environ.get('ROOM_LOG_CAPACITY', '200'))
+ROOM_LOG_MAX_BYTES = int(os.environ.get('ROOM_LOG_MAX_BYTES', str(256 * 1024)))
+ROOM_LOG_TOTAL_MAX_BYTES = int(os.environ.get('ROOM_LOG_TOTAL_MAX_BYTES', str(64 * 1024 * 1024)))
+ROOM_LOG_IDLE_SECONDS = float(os.environ.get('ROOM_LOG_IDLE_SECONDS', '900'))
+ROOM_LOG_SWEEP_INTERVAL = 30.0
+
+# Materialized room state served to joiners instead of a replay of presence noise
+SNAPSHOT_CHAT_MESSAGES = int(os.environ.get('SNAPSHOT_CHAT_MESSAGES', '50'))
+SNAPSHOT_IDLE_SECONDS = float(os.environ.get('SNAPSHOT_IDLE_SECONDS', '120'))
+
+class RoomState:
+    """Who is in a room, where their heads are, and the last few chat messages.
+
+    Folded incrementally from every event the room log stores. Participants that
+    joined over a socket stay until their `leave`; ones only seen through posted
+    events (pollers) are dropped after SNAPSHOT_IDLE_SECONDS without activity.
+    """
+
+    def __init__(self) -> None:
+        self.participants: Dict[str, Dict[str, Any]] = {}  # user id -> {user, head, live, seen}
+        self.chat: Deque[Tuple[int, bytes]] = deque(maxlen=SNAPSHOT_CHAT_MESSAGES)  # (seq, frame)
+        self.chat_floor: Optional[int] = None  # self.chat holds every chat message from this seq on
+
+    def apply(self, seq: int, event: Dict[str, Any], frame: bytes) -> None:
+        if self.chat_floor is None:
+            self.chat_floor = seq
+        etype = event.get("type")
+        if etype == "chat":
+            full = len(self.chat) == self.chat.maxlen
+            self.chat.append((seq, frame))
+            if full:
+                self.chat_floor = self.chat[0][0]
+            self._see(event.get("user"), None, False)
+        elif etype == "presence":
+            kind = event.get("event")
+            if kind == "batch":
+                for update in event.get("updates", ()):
+                    self._see(update.get("user"), update.get("head"), False)
+            elif kind == "join":
+                self._see(event.get("user"), None, True)
+            elif kind == "leave":
+                self.participants.pop(str((event.get("user") or {}).get("id") or ""), None)
+            else:
+                self._see(event.get("user"), event.get("head"), False)
+
+    def _see(self, user: Optional[Dict[str, Any]], head: Optional[Dict[str, Any]], live: bool) -> None:
+        uid = str((user or {}).get("id") or "")
+        if not uid:
+            return
+        entry = self.participants.get(uid)
+        if entry is None:
+            entry = self.participants[uid] = {"user": user, "head": None, "live": live, "seen": 0.0}
+        else:
+            entry["user"] = user
+            entry["live"] = entry["live"] or live
+        if head is not None:
+            entry["head"] = head
+        entry["seen"] = time.monotonic()
+
+    def encode(self, seq: int) -> bytes:
+        """The snapshot frame; `seq` is where the live event stream continues from."""
+        cutoff = time.monotonic() - SNAPSHOT_IDLE_SECONDS
+        for uid in [u for u, e in self.participants.items() if not e["live"] and e["seen"] < cutoff]:
+            del self.participants[uid]
+        people = dumps_frame([{"user": e["user"], "head": e["head"]} for e in self.participants.values()])
+        chat = b",".join(frame for _, frame in self.chat)
+        return b'{"type":"snapshot","seq":%d,"participants":%s,"chat":[%s]}' % (seq, people, chat)
+
+EMPTY_SNAPSHOT = b'{"type":"snapshot","seq":0,"participants":[],"chat":[]}'
+
+class RoomEventLog:
+    """Fixed-capacity ring of events addressed by sequence number.
+
+    Event `seq` lives in slot `seq % capacity`, so reading everything after
+    `since` touches only the events returned. Events are encoded to JSON bytes once
+    on append; polls, streams and sockets all reuse those bytes. The oldest events
+    are dropped when the ring is full or the room goes over its byte budget.
+    """
+
+    def __init__(self, capacity: int = MAX_EVENTS, max_bytes: int = ROOM_LOG_MAX_BYTES) -> None:
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._slots: List[Optional[bytes]] = [None] * capacity
+        self.first_seq = 1  # oldest retained
+        self.last_seq = 0   # newest appended
+        self.bytes = 0
+        self.touched = time.monotonic()
+        self.state = RoomState()
+
+    def __len__(self) -> int:
+        return self.last_seq - self.first_seq + 1
+
+    def _drop_oldest(self) -> int:
+        slot = self.first_seq % self.capacity
+        frame = self._slots[slot]
+        freed = len(frame) if frame is not None else 0
+        self._slots[slot] = None
+        self.bytes -= freed
+        self.first_seq += 1
+        return freed
+
+    def append(self, event: Dict[str, Any]) -> Tuple[int, int, int]:
+        """Store `event` under the next seq. Returns (seq, bytes delta, events dropped)."""
+        seq = self.last_seq + 1
+        return (seq,) + self.put(seq, event)
+
+    def put(self, seq: int, event: Dict[str, Any]) -> Tuple[int, int]:
+        """Store `event` under a seq assigned elsewhere (e.g. by the broker).
+
+        Seqs may skip ahead (the gap is left as holes) or arrive late into a hole
+        that is still inside the window. Returns (bytes delta, events dropped).
+        """
+        before = self.bytes
+        dropped = 0
+        if seq <= self.last_seq:
+            if seq < self.first_seq or self._slots[seq % self.capacity] is not None:
+                return 0, 0
+        elif self.last_seq < self.first_seq or seq - self.last_seq > self.capacity:
+            # empty log, or a jump past the whole window: restart the ring at seq
+            while self.first_seq <= self.last_seq:
+                self._drop_oldest()
+                dropped += 1
+            self.first_seq = seq
+            self.last_seq = seq - 1
+        while seq - self.first_seq >= self.capacity:
+            self._drop_oldest()
+            dropped += 1
+        event["id"] = seq
+        frame = dumps_frame(event)
+        size = len(frame)
+        self._slots[seq % self.capacity] = frame
+        self.last_seq = max(self.last_seq, seq)
+        self.state.apply(seq, event, frame)
+        self.bytes += size
+        while self.bytes > self.max_bytes and self.first_seq < self.last_seq:
+            self._drop_oldest()
+            dropped += 1
+        self.touched = time.monotonic()
+        return self.bytes - before, dropped
+
+    def get(self, seq: int) -> Optional[bytes]:
+        if self.first_seq <= seq <= self.last_seq:
+            return self._slots[seq % self.capacity]
+        return None
+
+    def since(self, since: int) -> List[bytes]:
+        start = max(since + 1, self.first_seq)
+        slots = self._slots
+        cap = self.capacity
+        return [e for e in (slots[s % cap] for s in range(start, self.last_seq + 1)) if e is not None]
+
+    def tail(self, n: int) -> List[bytes]:
+        return self.since(self.last_seq - n)
+
+    def entries(self, since: int, limit: int) -> List[Tuple[int, bytes]]:
+        """Up to `limit` (seq, frame) pairs after `since`, for streams that emit ids."""
+        start = max(since + 1, self.first_seq)
+        end = min(self.last_seq, start + limit - 1)
+        slots = self._slots
+        cap = self.capacity
+        return [(s, slots[s % cap]) for s in range(start, end + 1) if slots[s % cap] is not None]
+
+class RoomLogStore:
+    """All room logs, kept in LRU order with per-room, global and idle limits.
+
+    A room with connected sockets is never evicted: its log also holds the state the
+    snapshot is served from, and dropping it would hand joiners an empty room.
+    """
+
+    def __init__(
+        self,
+        total_max_bytes: int = ROOM_LOG_TOTAL_MAX_BYTES,
+        idle_seconds: float = ROOM_LOG_IDLE_SECONDS,
+    ) -> None:
+        self.total_max_bytes = total_max_bytes
+        self.idle_seconds = idle_seconds
+        self._logs: "OrderedDict[str, RoomEventLog]" = OrderedDict()
+        self.total_bytes = 0
+        self._next_sweep = time.monotonic() + ROOM_LOG_SWEEP_INTERVAL
+        self.stats: Dict[str, int] = {
+            "evicted_idle": 0,
+            "evicted_memory": 0,
+            "events_dropped": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._logs)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._logs
+
+    def get(self, code: str) -> Optional[RoomEventLog]:
+        log = self._logs.get(code)
+        if log is not None:
+            log.touched = time.monotonic()
+            self._logs.move_to_end(code)
+        self._maybe_sweep()
+        return log
+
+    def append(self, code: str, event: Dict[str, Any]) -> Tuple[int, Optional[bytes]]:
+        log = self._room(code)
+        seq = log.last_seq + 1
+        return seq, self._store(code, log, seq, event)
+
+    def start_at(self, code: str, seq: int) -> None:
+        """Make an empty room log hand out `seq` next."""
+        log = self._room(code)
+        if log.last_seq < log.first_seq:
+            log.first_seq = seq
+            log.last_seq = seq - 1
+
+    def put(self, code: str, seq: int, event: Dict[str, Any]) -> Optional[bytes]:
+        """Store under a given seq; returns the encoded frame (None if outside the window)."""
+        return self._store(code, self._room(code), seq, event)
+
+    def _room(self, code: str) -> RoomEventLog:
+        log = self._logs.get(code)
+        if log is None:
+            log = self._logs[code] = RoomEventLog()
+        else:
+            self._logs.move_to_end(code)
+        return log
+
+    def _store(self, code: str, log: RoomEventLog, seq: int, event: Dict[str, Any]) -> Optional[bytes]:
+        delta, dropped = log.put(seq, event)
+        self.total_bytes += delta
+        self.stats["events_dropped"] += dropped
+        # Global budget: evict the coldest rooms, never the one just written or a live one
+        kept = 0
+        while self.total_bytes > self.total_max_bytes and len(self._logs) - kept > 1:
+            cold = next(iter(self._logs))
+            if cold == code or self._live(cold):
+                self._logs.move_to_end(cold)
+                kept += 1
+                continue
+            self._evict(cold)
+            self.stats["evicted_memory"] += 1
+        self._maybe_sweep()
+        return log.get(seq)
+
+    def discard(self, code: str) -> None:
+        if code in self._logs:
+            self._evict(code)
+
+    def _evict(self, code: str) -> None:
+        log = self._logs.pop(code)
+        self.total_bytes -= log.bytes
+
+    @staticmethod
+    def _live(code: str) -> bool:
+        return bool(manager.rooms.get(code))
+
+    def _maybe_sweep(self) -> None:
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + ROOM_LOG_SWEEP_INTERVAL
+        cutoff = now - self.idle_seconds
+        # LRU order: stop at the first room touched after the cutoff
+        for _ in range(len(self._logs)):
+            code, log = next(iter(self._logs.items()))
+            if log.touched > cutoff:
+                break
+            if self._live(code):
+                log.touched = now
+                self._logs.move_to_end(code)
+                continue
+            self._evict(code)
+            self.stats["evicted_idle"] += 1
+
+room_logs = RoomLogStore()
 
 class EventIn(BaseModel):
-    type: str
+    # session_end, snapshot, gap and welcome are server-only
+    type: Literal["chat", "presence"]
     text: Optional[str] = None
     head: Optional[Dict[str, Any]] = None
     user: Optional[Dict[str, Any]] = None
@@ -367,36 +2454,1122 @@ class EventsOut(BaseModel):
     events: List[Dict[str, Any]]
     last_id: int
 
+# Long-poll: GET /events?wait=N parks until something newer than `since` is appended
+LONGPOLL_MAX_WAIT = float(os.environ.get('LONGPOLL_MAX_WAIT', '25'))
+
+class RoomNotifier:
+    """Per-room wake-up signal for long-poll waiters (no threads held while parked)."""
+
+    def __init__(self) -> None:
+        self._events: Dict[str, asyncio.Event] = {}
+        self._waiting: Dict[str, int] = {}
+
+    def event(self, code: str) -> asyncio.Event:
+        """Register a waiter right away; the next notify() sets the returned event.
+
+        Pair with release(). Registering before anything yields means a publish that
+        lands while the caller is still setting up its wait can't be missed.
+        """
+        ev = self._events.get(code)
+        if ev is None:
+            ev = self._events[code] = asyncio.Event()
+        self._waiting[code] = self._waiting.get(code, 0) + 1
+        return ev
+
+    def release(self, code: str, ev: asyncio.Event) -> None:
+        left = self._waiting.get(code, 1) - 1
+        if left <= 0:
+            self._waiting.pop(code, None)
+            if self._events.get(code) is ev:
+                self._events.pop(code, None)
+        else:
+            self._waiting[code] = left
+
+    async def wait(self, code: str, timeout: float) -> bool:
+        ev = self.event(code)
+        try:
+            await asyncio.wait_for(ev.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.release(code, ev)
+
+    def notify(self, code: str) -> None:
+        # Swap in a fresh event so later waiters don't see a stale "set"
+        ev = self._events.pop(code, None)
+        if ev is not None:
+            ev.set()
+
+room_notifier = RoomNotifier()
+
+async def _deliver_room_event(
+    code: str,
+    event: Dict[str, Any],
+    seq: Optional[int] = None,
+    log: bool = True,
+    ws: bool = True,
+) -> Optional[int]:
+    """Hand an event to this worker's polling log and/or sockets (called by the broker).
+
+    A logged event is encoded once by the log and the same bytes go out to sockets.
+    """
+    frame = None
+    if log:
+        payload = {"id": 0, "ts": event.get("ts") or realtime_ts()}
+        payload.update({k: v for k, v in event.items() if k not in ("id", "ts")})
+        if seq is None:
+            seq, frame = room_logs.append(code, payload)
+        else:
+            frame = room_logs.put(code, seq, payload)
+        room_notifier.notify(code)
+    if ws:
+        if frame is None:
+            frame = dumps_frame(event)
+        manager.broadcast_frame(code, event.get("type", ""), frame, event)
+    room_directory.event(code)
+    if event.get("type") == "session_end":
+        session_reaper.release_room_later(code)
+    return seq
+
+def _read_room_events(code: str, since: int) -> Tuple[List[bytes], int]:
+    log = room_logs.get(code)
+    if log is None:
+        return [], (0 if since <= 0 else since)
+    if since <= 0 or since > log.last_seq:
+        # Fresh client, or the log was evicted and restarted at 1 since the
+        # client last saw it: return the tail to avoid huge payloads
+        tail = log.tail(50)
+        return tail, (log.last_seq if tail else 0)
+    # Return events with id > since
+    return log.since(since), log.last_seq
+
+def _events_response(frames: List[bytes], last_id: int) -> Response:
+    # Splice the cached per-event frames instead of re-validating and re-encoding
+    body = b'{"events":[' + b",".join(frames) + b'],"last_id":' + str(last_id).encode() + b"}"
+    return Response(content=body, media_type="application/json")
+
+async def _wait_for_disconnect(request: Request) -> None:
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
 @hb_router.post("/rooms/{code}/events", response_model=Dict[str, Any])
 async def post_room_event(code: str, event: EventIn):
-    seq = ROOM_SEQ.get(code, 0) + 1
-    ROOM_SEQ[code] = seq
-    payload = {
-        "id": seq,
-        "ts": now_iso(),
+    # Buckets are per room and user, so only real rooms get them; otherwise a client
+    # could rotate made-up codes for a fresh budget on every request
+    if not await _load_room(code):
+        raise HTTPException(status_code=404, detail="Room not found")
+    retry_in = rate_limiter.acquire(_rate_kind(event.type), None, code, str((event.user or {}).get("id") or ""))
+    if retry_in:
+        raise HTTPException(status_code=429, detail="Too many events", headers={"Retry-After": str(max(1, math.ceil(retry_in)))})
+    await session_reaper.room_active(code)
+    if event.type == "presence" and event.head is not None:
+        presence_coalescer.offer(code, event.user or {}, event.head)
+        return {"ok": True, "id": None, "coalesced": True}
+    seq = await broker.publish(code, {
         "type": event.type,
         "text": event.text,
         "head": event.head,
         "user": event.user or {},
-    }
-    lst = ROOM_EVENTS.setdefault(code, [])
-    lst.append(payload)
-    if len(lst) > MAX_EVENTS:
-        del lst[: len(lst) - MAX_EVENTS]
+        "ts": realtime_ts(),
+    })
     return {"ok": True, "id": seq}
 
 @hb_router.get("/rooms/{code}/events", response_model=EventsOut)
-async def get_room_events(code: str, since: int = Query(0, ge=0)):
-    lst = ROOM_EVENTS.get(code, [])
-    if since <= 0:
-        # Return the tail to avoid huge payloads
-        tail = lst[-50:]
-        last_id = tail[-1]["id"] if tail else 0
-        return {"events": tail, "last_id": last_id}
-    # Return events with id > since
-    out = [e for e in lst if e["id"] > since]
-    last_id = lst[-1]["id"] if lst else since
-    return {"events": out, "last_id": last_id}
+async def get_room_events(
+    request: Request,
+    code: str,
+    since: int = Query(0, ge=0),
+    wait: float = Query(0, ge=0, description="Long-poll: seconds to wait for new events"),
+    client: Optional[str] = Query(None, max_length=128, description="Stable poller id for occupancy counts"),
+):
+    room_directory.polled(code, client or (request.client.host if request.client else ""))
+    await session_reaper.room_active(code)
+    frames, last_id = _read_room_events(code, since)
+    if frames or wait <= 0:
+        return _events_response(frames, last_id)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(wait, LONGPOLL_MAX_WAIT)
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        while not frames:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            # registered before the first await, so a publish from here on wakes us
+            ev = room_notifier.event(code)
+            waiter = asyncio.ensure_future(ev.wait())
+            try:
+                done, _ = await asyncio.wait({waiter, disconnect}, timeout=remaining,
+                                             return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+                room_notifier.release(code, ev)
+            if disconnect in done:
+                break  # client went away: nobody will read the response
+            frames, last_id = _read_room_events(code, since)
+    finally:
+        disconnect.cancel()
+    return _events_response(frames, last_id)
+
+@hb_router.get("/rooms/{code}/snapshot")
+async def get_room_snapshot(code: str):
+    """Participants with their latest heads plus recent chat; continue with ?since=seq."""
+    log = room_logs.get(code)
+    body = log.state.encode(log.last_seq) if log is not None else EMPTY_SNAPSHOT
+    return Response(content=body, media_type="application/json")
+
+# -------------------------------------------------------------------------------------
+# Server-Sent Events stream fed from the same per-room log
+# -------------------------------------------------------------------------------------
+# One long-lived response per client instead of a poll every few seconds. Frames are
+# read from the ring at the client's pace: the generator only advances once the
+# previous chunk was written, so a slow reader never grows a server-side queue. A
+# reader that falls behind the ring window gets an explicit `gap` event.
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_MAX_BATCH = int(os.environ.get('SSE_MAX_BATCH', '100'))
+SSE_RETRY_MS = 2000
+
+async def _sse_stream(code: str, since: int):
+    room_directory.stream_opened(code)
+    try:
+        async for chunk in _sse_chunks(code, since):
+            yield chunk
+    finally:
+        room_directory.stream_closed(code)
+
+async def _sse_chunks(code: str, since: int):
+    yield b"retry: %d\n\n" % SSE_RETRY_MS
+    cursor = since
+    while True:
+        await session_reaper.room_active(code)
+        log = room_logs.get(code)
+        if log is not None and (cursor <= 0 or cursor > log.last_seq):
+            # fresh client (or the log restarted since it last saw it): start at the tail
+            cursor = max(0, log.last_seq - 50)
+        entries = log.entries(cursor, SSE_MAX_BATCH) if log is not None else []
+        if entries:
+            chunks = []
+            if log.first_seq > cursor + 1 and cursor > 0:
+                chunks.append(b'event: gap\ndata: {"from":%d,"to":%d}\n\n' % (cursor + 1, log.first_seq - 1))
+            for seq, frame in entries:
+                chunks.append(b"id: %d\ndata: %s\n\n" % (seq, frame))
+            cursor = entries[-1][0]
+            yield b"".join(chunks)
+            continue
+        if not await room_notifier.wait(code, SSE_HEARTBEAT_SECONDS):
+            yield b": keepalive\n\n"
+
+@hb_router.get("/rooms/{code}/stream")
+async def stream_room_events(
+    code: str,
+    last_event_id: Optional[str] = Header(None),
+    since: int = Query(0, ge=0, description="Resume point when Last-Event-ID can't be sent"),
+):
+    try:
+        resume = int(last_event_id) if last_event_id else since
+    except ValueError:
+        resume = since
+    return StreamingResponse(
+        _sse_stream(code, resume),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# -------------------------------------------------------------------------------------
+# Room directory: live rooms ranked by activity
+# -------------------------------------------------------------------------------------
+# Per-room counters are updated where things happen, in O(1): sockets joining and
+# leaving, SSE streams opening and closing, polls (distinct pollers seen in the last
+# ROOM_POLLER_WINDOW seconds), and delivered events. The event rate is an
+# exponentially decaying average with a ROOM_RATE_HALF_LIFE half-life. Scores are
+# stored relative to a shared epoch, so decay never reorders rooms. Events only mark
+# a room dirty. GET /api/hb/rooms pushes the dirty rooms onto a lazy max-heap and
+# pops the top N, skipping stale entries, so a request never scans every room.
+# Counts are per worker. The directory lists joinable room codes, so it is off unless
+# ROOM_DIRECTORY_ENABLED is set and ROOM_DIRECTORY_TOKEN is configured, and requires
+# that token as `Authorization: Bearer <token>`.
+ROOM_DIRECTORY_ENABLED = os.environ.get('ROOM_DIRECTORY_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+ROOM_DIRECTORY_TOKEN = os.environ.get('ROOM_DIRECTORY_TOKEN', '')
+ROOM_RATE_HALF_LIFE = float(os.environ.get('ROOM_RATE_HALF_LIFE', '30'))
+ROOM_POLLER_WINDOW = float(os.environ.get('ROOM_POLLER_WINDOW', '60'))
+ROOM_DIRECTORY_MAX = 100
+ROOM_RATE_REBASE = 50.0  # rescale scores once exp() of the epoch offset passes e^50
+
+class RoomActivity:
+    __slots__ = ("sockets", "streams", "pollers", "peak", "score", "events", "last_event")
+
+    def __init__(self) -> None:
+        self.sockets = 0
+        self.streams = 0
+        self.pollers: "OrderedDict[str, float]" = OrderedDict()  # client -> last poll, oldest first
+        self.peak = 0
+        self.score = 0.0  # decayed event rate, scaled to the directory's epoch
+        self.events = 0
+        self.last_event = 0.0
+
+    def occupancy(self) -> int:
+        return self.sockets + self.streams + len(self.pollers)
+
+class RoomDirectory:
+    def __init__(self, half_life: float = ROOM_RATE_HALF_LIFE, poller_window: float = ROOM_POLLER_WINDOW) -> None:
+        self.tau = half_life / math.log(2)
+        self.poller_window = poller_window
+        self.rooms: Dict[str, RoomActivity] = {}
+        self._epoch = time.monotonic()
+        self._heap: List[Tuple[float, str]] = []  # (-score, code); stale entries are skipped
+        self._dirty: Set[str] = set()
+        self._next_sweep = self._epoch + poller_window
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def _room(self, code: str) -> RoomActivity:
+        room = self.rooms.get(code)
+        if room is None:
+            room = self.rooms[code] = RoomActivity()
+            self._dirty.add(code)
+        return room
+
+    @staticmethod
+    def _seen(room: RoomActivity) -> None:
+        n = room.occupancy()
+        if n > room.peak:
+            room.peak = n
+
+    def set_sockets(self, code: str, n: int) -> None:
+        if n == 0 and code not in self.rooms:
+            return
+        room = self._room(code)
+        room.sockets = n
+        self._seen(room)
+
+    def stream_opened(self, code: str) -> None:
+        room = self._room(code)
+        room.streams += 1
+        self._seen(room)
+
+    def stream_closed(self, code: str) -> None:
+        room = self.rooms.get(code)
+        if room is not None and room.streams > 0:
+            room.streams -= 1
+
+    def polled(self, code: str, client: str) -> None:
+        now = time.monotonic()
+        room = self._room(code)
+        room.pollers[client] = now
+        room.pollers.move_to_end(client)
+        self._expire_pollers(room, now)
+        self._seen(room)
+        self._maybe_sweep(now)
+
+    def event(self, code: str) -> None:
+        now = time.monotonic()
+        offset = (now - self._epoch) / self.tau
+        if offset > ROOM_RATE_REBASE:
+            self._rebase(now)
+            offset = 0.0
+        room = self._room(code)
+        room.score += math.exp(offset) / self.tau
+        room.events += 1
+        room.last_event = now
+        self._dirty.add(code)
+        self._maybe_sweep(now)
+
+    def _expire_pollers(self, room: RoomActivity, now: float) -> None:
+        cutoff = now - self.poller_window
+        pollers = room.pollers
+        while pollers and next(iter(pollers.values())) < cutoff:
+            pollers.popitem(last=False)
+
+    def _rebase(self, now: float) -> None:
+        # same factor for every room: order is unchanged, the heap is rebuilt anyway
+        factor = math.exp(-(now - self._epoch) / self.tau)
+        for room in self.rooms.values():
+            room.score *= factor
+        self._epoch = now
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._heap = [(-room.score, code) for code, room in self.rooms.items()]
+        heapq.heapify(self._heap)
+        self._dirty.clear()
+
+    def _maybe_sweep(self, now: float) -> None:
+        # Forget rooms nobody is in and nothing happened in for a whole window
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.poller_window
+        for code, room in list(self.rooms.items()):
+            self._expire_pollers(room, now)
+            if not room.occupancy() and now - room.last_event > self.poller_window:
+                del self.rooms[code]
+                self._dirty.discard(code)
+
+    def top(self, n: int) -> List[Dict[str, Any]]:
+        """The `n` rooms with the highest current event rate."""
+        if len(self._heap) > 2 * len(self.rooms) + 64:
+            self._rebuild()
+        for code in self._dirty:
+            heapq.heappush(self._heap, (-self.rooms[code].score, code))
+        self._dirty.clear()
+        picked: List[Tuple[float, str]] = []
+        seen: Set[str] = set()
+        while self._heap and len(picked) < n:
+            entry = heapq.heappop(self._heap)
+            room = self.rooms.get(entry[1])
+            if room is None or -entry[0] != room.score or entry[1] in seen:
+                continue  # superseded by a newer push, or the room is gone
+            picked.append(entry)
+            seen.add(entry[1])
+        for entry in picked:
+            heapq.heappush(self._heap, entry)
+        now = time.monotonic()
+        return [self.describe(code, now) for _, code in picked]
+
+    def describe(self, code: str, now: float) -> Dict[str, Any]:
+        room = self.rooms[code]
+        self._expire_pollers(room, now)
+        return {
+            "code": code,
+            "sockets": room.sockets,
+            "streams": room.streams,
+            "pollers": len(room.pollers),
+            "occupancy": room.occupancy(),
+            "peak": room.peak,
+            "events_per_sec": round(room.score * math.exp(-(now - self._epoch) / self.tau), 3),
+            "events": room.events,
+            "idle_seconds": round(now - room.last_event, 1) if room.events else None,
+        }
+
+room_directory = RoomDirectory()
+
+@hb_router.get("/rooms")
+async def list_rooms(limit: int = Query(20, ge=1, le=ROOM_DIRECTORY_MAX), api_key: str = Depends(_validate_api_key)):
+    if not ROOM_DIRECTORY_ENABLED or not ROOM_DIRECTORY_TOKEN:
+        raise HTTPException(status_code=404, detail="Room directory disabled")
+    if not hmac.compare_digest(api_key.encode(), ROOM_DIRECTORY_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid directory token")
+    return {"rooms": room_directory.top(limit), "total": len(room_directory)}
+
+# -------------------------------------------------------------------------------------
+# Room broker: carries realtime events between workers
+# -------------------------------------------------------------------------------------
+# Every WS broadcast and polling-log append goes through broker.publish(). The broker
+# then delivers the event on every worker (this one included) via
+# _deliver_room_event, so sockets and logs on all workers see the same events with
+# the same per-room sequence numbers.
+ROOM_BROKER = os.environ.get('ROOM_BROKER', 'memory')
+ROOM_BUS_COLLECTION = os.environ.get('ROOM_BUS_COLLECTION', 'hb_room_bus')
+ROOM_BUS_SIZE_BYTES = int(os.environ.get('ROOM_BUS_SIZE_BYTES', str(64 * 1024 * 1024)))
+ROOM_BUS_REORDER_WAIT = float(os.environ.get('ROOM_BUS_REORDER_WAIT', '0.25'))
+# how far behind one writer's ObjectId clock may run; bounds where a reopened tail starts
+ROOM_BUS_CLOCK_SKEW = float(os.environ.get('ROOM_BUS_CLOCK_SKEW', '300'))
+
+class RoomBroker(ABC):
+    """Pub/sub seam for room events. `log` feeds the polling log, `ws` the sockets."""
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def publish(self, code: str, event: Dict[str, Any], log: bool = True, ws: bool = True) -> Optional[int]:
+        seq = await self._publish(code, event, log, ws)
+        # only the publishing worker persists, so history gets each chat message once
+        if seq is not None and event.get("type") == "chat":
+            chat_history.record(code, seq, event)
+        return seq
+
+    @abstractmethod
+    async def _publish(self, code: str, event: Dict[str, Any], log: bool, ws: bool) -> Optional[int]:
+        ...
+
+    async def forget(self, code: str) -> None:
+        """Drop any shared per-room state (e.g. sequence counters) for a dead room."""
+
+class InProcessBroker(RoomBroker):
+    """Single-worker broker: sequence numbers come from the local log.
+
+    A room log that starts from scratch (first event since startup or eviction)
+    continues after the newest persisted chat seq, so history keys never repeat.
+    """
+
+    def __init__(self) -> None:
+        self._seeding: Dict[str, asyncio.Future] = {}
+
+    async def _publish(self, code: str, event: Dict[str, Any], log: bool, ws: bool) -> Optional[int]:
+        if log and CHAT_HISTORY_ENABLED and code not in room_logs:
+            await self._seed(code)
+        return await _deliver_room_event(code, event, log=log, ws=ws)
+
+    async def _seed(self, code: str) -> None:
+        pending = self._seeding.get(code)
+        if pending is not None:
+            await asyncio.shield(pending)
+            return
+        fut = self._seeding[code] = asyncio.get_running_loop().create_future()
+        try:
+            last = await chat_history.last_seq(code)
+            if last and code not in room_logs:
+                room_logs.start_at(code, last + 1)
+        except Exception:
+            logging.exception("Failed to seed room %s from chat history", code)
+        finally:
+            del self._seeding[code]
+            fut.set_result(None)
+
+class MongoBroker(RoomBroker):
+    """Cross-worker broker on a capped collection tailed by every worker.
+
+    Per-room sequence numbers come from an atomic $inc on `hb_room_seq`, so they are
+    global. Two workers can insert seqs N and N+1 in either order; events that
+    arrive ahead of a gap are held for ROOM_BUS_REORDER_WAIT before the gap is
+    skipped (a straggler still lands in its hole if the window hasn't moved on).
+    """
+
+    def __init__(self, database, collection: str = ROOM_BUS_COLLECTION, size_bytes: int = ROOM_BUS_SIZE_BYTES) -> None:
+        self.db = database
+        self.collection = collection
+        self.size_bytes = size_bytes
+        self.bus = database[collection]
+        self.counters = database.hb_room_seq
+        self._held: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._release: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_id = None
+
+    async def start(self) -> None:
+        try:
+            await self.db.create_collection(self.collection, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass  # already there
+        last = await self.bus.find_one(sort=[("$natural", -1)])
+        if last is None:
+            # a tailable cursor on an empty capped collection dies immediately
+            await self.bus.insert_one({"code": None})
+            last = await self.bus.find_one(sort=[("$natural", -1)])
+        self._last_id = last["_id"]
+        self._task = asyncio.create_task(self._tail())
+
+    async def close(self) -> None:
+        for task in [self._task, *self._release.values()]:
+            if task is not None:
+                task.cancel()
+        self._release.clear()
+
+    async def _publish(self, code: str, event: Dict[str, Any], log: bool, ws: bool) -> Optional[int]:
+        seq = None
+        if log:
+            counter = await self.counters.find_one_and_update(
+                {"_id": code},
+                {"$inc": {"seq": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            seq = counter["seq"]
+        await self.bus.insert_one({"code": code, "seq": seq, "log": log, "ws": ws, "event": event})
+        return seq
+
+    async def forget(self, code: str) -> None:
+        # the counter must keep rising while the room's chat history is kept
+        if not CHAT_HISTORY_ENABLED:
+            await self.counters.delete_one({"_id": code})
+
+    async def _tail(self) -> None:
+        # Insertion ($natural) order is the only order every writer shares: ObjectIds
+        # come from each process's own clock and counter, so an `_id > last` filter
+        # would hide a later insert from a worker whose ids sort lower. A (re)opened
+        # cursor only asks for ids no older than the last one seen minus the allowed
+        # clock skew, and skips up to that document in insertion order.
+        while True:
+            cursor = self.bus.find(self._tail_query(), cursor_type=CursorType.TAILABLE_AWAIT)
+            skipping = self._last_id is not None
+            try:
+                while cursor.alive:
+                    async for doc in cursor:
+                        if skipping:
+                            skipping = doc["_id"] != self._last_id
+                            continue
+                        self._last_id = doc["_id"]
+                        if doc.get("code") is not None:
+                            await self._dispatch(doc)
+                    if skipping:
+                        # read everything without meeting it: it has rolled off the bus
+                        logging.warning("Room bus position lost; resuming at the newest events")
+                        skipping = False
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Room bus tail failed; reopening")
+            await asyncio.sleep(0.5)
+
+    def _tail_query(self) -> Dict[str, Any]:
+        if self._last_id is None:
+            return {}
+        since = self._last_id.generation_time - timedelta(seconds=ROOM_BUS_CLOCK_SKEW)
+        return {"_id": {"$gte": ObjectId.from_datetime(since)}}
+
+    async def _dispatch(self, doc: Dict[str, Any]) -> None:
+        code, seq = doc["code"], doc.get("seq")
+        if seq is None:
+            await self._deliver(doc)
+            return
+        log = room_logs.get(code)
+        expected = log.last_seq + 1 if log is not None and len(log) else seq
+        if seq > expected:
+            self._held.setdefault(code, {})[seq] = doc
+            if code not in self._release:
+                self._release[code] = asyncio.create_task(self._release_after(code))
+            return
+        await self._deliver(doc)
+        held = self._held.get(code)
+        while held and seq + 1 in held:
+            seq += 1
+            await self._deliver(held.pop(seq))
+        if not held:
+            self._drop_held(code)
+
+    async def _release_after(self, code: str) -> None:
+        await asyncio.sleep(ROOM_BUS_REORDER_WAIT)
+        self._release.pop(code, None)
+        held = self._held.pop(code, {})
+        for seq in sorted(held):
+            await self._deliver(held[seq])
+
+    def _drop_held(self, code: str) -> None:
+        self._held.pop(code, None)
+        task = self._release.pop(code, None)
+        if task is not None:
+            task.cancel()
+
+    async def _deliver(self, doc: Dict[str, Any]) -> None:
+        try:
+            await _deliver_room_event(doc["code"], doc.get("event") or {}, seq=doc.get("seq"),
+                                      log=doc.get("log", True), ws=doc.get("ws", True))
+        except Exception:
+            logging.exception("Room event delivery failed")
+
+def _build_broker() -> RoomBroker:
+    if ROOM_BROKER == "mongo":
+        store = get_storage()
+        if not isinstance(store, MongoStorage):
+            raise RuntimeError("ROOM_BROKER=mongo needs STORAGE_BACKEND=mongo")
+        return MongoBroker(store.db)
+    return InProcessBroker()
+
+# built on startup, once storage exists; in-process until then
+broker: RoomBroker = InProcessBroker()
+
+# -------------------------------------------------------------------------------------
+# Presence coalescing: latest head state per user, flushed as one frame per tick
+# -------------------------------------------------------------------------------------
+PRESENCE_TICK_HZ = float(os.environ.get('PRESENCE_TICK_HZ', '20'))
+
+class PresenceCoalescer:
+    """Collapses head moves to the latest state per user and flushes them in batches.
+
+    Each tick sends one `{"type": "presence", "event": "batch", "updates": [...]}`
+    frame per dirty room to WebSocket clients and appends it to the polling log, so
+    fan-out cost follows the tick rate instead of the drag rate. Join/leave and chat
+    never pass through here.
+
+    A head offered over the rate limit (`delay` > 0) is held instead of dropped and
+    enters the next batch once the sender's tokens have refilled, unless a newer head
+    from the same user got there first; otherwise a burst that ends over the limit
+    would leave everyone else seeing a stale position.
+    """
+
+    def __init__(self, hz: float = PRESENCE_TICK_HZ) -> None:
+        self.interval = 1.0 / hz
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._held: Dict[Tuple[str, str], Dict[str, Any]] = {}  # (code, user id) -> latest refused update
+        self._timers: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"received": 0, "frames": 0, "held": 0}
+
+    def offer(self, code: str, user: Dict[str, Any], head: Dict[str, Any], delay: float = 0.0) -> None:
+        self.stats["received"] += 1
+        uid = str(user.get("id") or "")
+        key = (code, uid)
+        if delay > 0:
+            self.stats["held"] += 1
+            self._held[key] = {"user": user, "head": head}
+            if key not in self._timers:
+                self._timers[key] = asyncio.get_running_loop().call_later(delay, self._release, key)
+            return
+        self._held.pop(key, None)  # superseded by this newer head
+        self._add(code, uid, {"user": user, "head": head})
+
+    def _release(self, key: Tuple[str, str]) -> None:
+        self._timers.pop(key, None)
+        update = self._held.pop(key, None)
+        if update is not None:
+            self._add(key[0], key[1], update)
+
+    def _add(self, code: str, uid: str, update: Dict[str, Any]) -> None:
+        self._pending.setdefault(code, {})[uid] = update
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        # Ticks only while there is something to flush; offer() restarts it
+        while self._pending:
+            await asyncio.sleep(self.interval)
+            pending, self._pending = self._pending, {}
+            for code, updates in pending.items():
+                try:
+                    await self.flush_room(code, list(updates.values()))
+                except Exception:
+                    logging.exception("Presence flush failed")
+
+    async def flush_room(self, code: str, updates: List[Dict[str, Any]]) -> None:
+        frame = {"type": "presence", "event": "batch", "updates": updates, "ts": realtime_ts()}
+        self.stats["frames"] += 1
+        await broker.publish(code, frame)
+
+    def forget(self, code: str, uid: str) -> None:
+        # Called before a leave is published so no batch can re-place the user's head
+        # after it
+        updates = self._pending.get(code)
+        if updates is not None:
+            updates.pop(uid, None)
+            if not updates:
+                del self._pending[code]
+        self._held.pop((code, uid), None)
+        handle = self._timers.pop((code, uid), None)
+        if handle is not None:
+            handle.cancel()
+
+    def discard(self, code: str) -> None:
+        self._pending.pop(code, None)
+        for key in [k for k in self._timers if k[0] == code]:
+            self._timers.pop(key).cancel()
+            self._held.pop(key, None)
+
+    def close(self) -> None:
+        self._pending.clear()
+        self._held.clear()
+        for handle in self._timers.values():
+            handle.cancel()
+        self._timers.clear()
+        if self._task is not None:
+            self._task.cancel()
+
+presence_coalescer = PresenceCoalescer()
+
+# -------------------------------------------------------------------------------------
+# Chat history: durable, paged, with the room state as its hot cache
+# -------------------------------------------------------------------------------------
+# Every chat message is written to CHAT_HISTORY_COLLECTION, keyed by (code, seq),
+# through the write-behind batcher, so the socket loop never waits on Mongo. Pages
+# are served from the room's in-memory recent chat where it covers the range (which
+# also covers messages not flushed yet) and from storage for the rest. Each room
+# keeps at most CHAT_HISTORY_MAX_PER_ROOM messages (trimmed every
+# CHAT_HISTORY_TRIM_EVERY writes); on Mongo a TTL index also drops messages after
+# CHAT_HISTORY_TTL_DAYS.
+CHAT_HISTORY_ENABLED = os.environ.get('CHAT_HISTORY_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+CHAT_HISTORY_COLLECTION = os.environ.get('CHAT_HISTORY_COLLECTION', 'hb_chat')
+CHAT_HISTORY_MAX_PER_ROOM = int(os.environ.get('CHAT_HISTORY_MAX_PER_ROOM', '5000'))
+CHAT_HISTORY_TRIM_EVERY = int(os.environ.get('CHAT_HISTORY_TRIM_EVERY', '200'))
+CHAT_HISTORY_TTL_DAYS = float(os.environ.get('CHAT_HISTORY_TTL_DAYS', '30'))
+CHAT_HISTORY_PAGE_MAX = 200
+
+class ChatHistory:
+    def __init__(self, max_per_room: int = CHAT_HISTORY_MAX_PER_ROOM) -> None:
+        self.max_per_room = max_per_room
+        self._since_trim: Dict[str, int] = {}
+        self.stats: Dict[str, int] = {"recorded": 0, "served_cache": 0, "served_db": 0, "trimmed": 0}
+
+    def record(self, code: str, seq: int, event: Dict[str, Any]) -> None:
+        if not CHAT_HISTORY_ENABLED:
+            return
+        message = {k: v for k, v in event.items() if k != "id"}
+        message["id"] = seq
+        write_behind.insert(CHAT_HISTORY_COLLECTION, {
+            "code": code,
+            "seq": seq,
+            "event": message,
+            "created_at": datetime.now(timezone.utc),
+        })
+        self.stats["recorded"] += 1
+        count = self._since_trim.get(code, 0) + 1
+        if count >= CHAT_HISTORY_TRIM_EVERY:
+            self._since_trim.pop(code, None)
+            asyncio.ensure_future(self.trim(code))
+        else:
+            self._since_trim[code] = count
+
+    async def trim(self, code: str) -> None:
+        try:
+            self.stats["trimmed"] += await get_storage().trim_chat(code, self.max_per_room)
+        except Exception:
+            logging.exception("Chat history trim failed for room %s", code)
+
+    async def page(self, code: str, before: Optional[int], after: Optional[int], limit: int) -> Tuple[List[bytes], bool]:
+        """Chat frames in seq order: the oldest `limit` after `after`, otherwise the
+        newest `limit` before `before` (or overall). Returns (frames, more)."""
+        log = room_logs.get(code)
+        cached = list(log.state.chat) if log is not None else []
+        floor = log.state.chat_floor if log is not None else None
+        hot = [f for seq, f in cached if (after is None or seq > after) and (before is None or seq < before)]
+        # the cache has every chat message from `floor` on; anything older is in Mongo
+        if floor is None:
+            upper = before
+        else:
+            upper = floor if before is None else min(floor, before)
+        if after is not None:
+            if floor is not None and after + 1 >= floor:
+                self.stats["served_cache"] += 1
+                return hot[:limit], len(hot) > limit
+            frames = await self._query(code, after, upper, limit + 1, newest=False) + hot
+            return frames[:limit], len(frames) > limit
+        if len(hot) > limit or floor == 1:
+            self.stats["served_cache"] += 1
+            return hot[-limit:], len(hot) > limit
+        need = limit - len(hot)
+        cold = await self._query(code, None, upper, need + 1, newest=True)
+        return cold[max(0, len(cold) - need):] + hot, len(cold) > need
+
+    async def last_seq(self, code: str) -> int:
+        return await get_storage().last_chat_seq(code)
+
+    async def _query(self, code: str, after: Optional[int], before: Optional[int], limit: int, newest: bool) -> List[bytes]:
+        events = await get_storage().chat_range(code, after, before, limit, newest)
+        self.stats["served_db"] += 1
+        return [dumps_frame(e) for e in events]
+
+chat_history = ChatHistory()
+
+@hb_router.get("/rooms/{code}/chat")
+async def get_chat_history(
+    code: str,
+    before: Optional[int] = Query(None, ge=1, description="Only messages with seq below this"),
+    after: Optional[int] = Query(None, ge=0, description="Only messages with seq above this (pages forward)"),
+    limit: int = Query(50, ge=1, le=CHAT_HISTORY_PAGE_MAX),
+):
+    frames, more = await chat_history.page(code, before, after, limit)
+    body = b'{"messages":[' + b",".join(frames) + b'],"has_more":' + (b"true" if more else b"false") + b"}"
+    return Response(content=body, media_type="application/json")
+
+# -------------------------------------------------------------------------------------
+# Reaper: ends sessions past their timeouts and frees their rooms
+# -------------------------------------------------------------------------------------
+# Closed tabs never send DELETE. Every REAPER_INTERVAL seconds (jittered so workers
+# drift apart) active sessions are scanned, least recently used first, and those
+# past timeout_inactive since last_accessed or timeout_absolute since created_at are
+# ended: marked inactive with conditional updates (on multiple workers only the one
+# whose update matched goes on), terminated upstream REAPER_CONCURRENCY at a time and
+# announced to their rooms with `session_end`; DELETE /sessions announces the same
+# way. Clients can't post that type. Upstream calls need
+# HYPERBEAM_API_KEY and are skipped without it (Hyperbeam enforces the same
+# timeouts itself). Every worker drops a room's log and presence state
+# REAPER_ROOM_GRACE seconds after delivering its `session_end`, so pollers and
+# streams still get to read the announcement.
+#
+# Room activity counts as access to the room's session: joins, socket messages,
+# polls, streams and room lookups bump last_accessed (through the write-behind
+# batcher, at most once per ROOM_TOUCH_INTERVAL per room). Each pass first touches
+# every room with occupants on this worker, so a session whose room is in use but
+# silent is not ended as inactive, and flushes the batcher before it scans.
+REAPER_ENABLED = os.environ.get('REAPER_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+REAPER_INTERVAL = float(os.environ.get('REAPER_INTERVAL', '60'))
+REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', '200'))
+REAPER_CONCURRENCY = int(os.environ.get('REAPER_CONCURRENCY', '8'))
+REAPER_ROOM_GRACE = float(os.environ.get('REAPER_ROOM_GRACE', '30'))
+ROOM_TOUCH_INTERVAL = float(os.environ.get('ROOM_TOUCH_INTERVAL', '30'))
+HYPERBEAM_API_KEY = os.environ.get('HYPERBEAM_API_KEY', '')
+DEFAULT_TIMEOUT_ABSOLUTE = 3600
+DEFAULT_TIMEOUT_INACTIVE = 1800
+
+def _session_expiry_reason(doc: Dict[str, Any], now: datetime) -> Optional[str]:
+    try:
+        created = datetime.fromisoformat(doc["created_at"])
+        accessed = datetime.fromisoformat(doc.get("last_accessed") or doc["created_at"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if now - created >= timedelta(seconds=doc.get("timeout_absolute") or DEFAULT_TIMEOUT_ABSOLUTE):
+        return "timeout_absolute"
+    if now - accessed >= timedelta(seconds=doc.get("timeout_inactive") or DEFAULT_TIMEOUT_INACTIVE):
+        return "timeout_inactive"
+    return None
+
+class SessionReaper:
+    """Periodic sweep that ends expired sessions and schedules their rooms for cleanup."""
+
+    def __init__(
+        self,
+        interval: float = REAPER_INTERVAL,
+        batch_size: int = REAPER_BATCH_SIZE,
+        concurrency: int = REAPER_CONCURRENCY,
+        touch_interval: float = ROOM_TOUCH_INTERVAL,
+    ) -> None:
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+        self._releases: Dict[str, asyncio.TimerHandle] = {}
+        self._owned: Set[str] = set()  # rooms this worker ended; it also clears their shared state
+        self.touch_interval = touch_interval
+        self._touched: Dict[str, float] = {}  # code -> monotonic time of the last session touch
+        self._next_prune = time.monotonic() + touch_interval
+        self.stats: Dict[str, int] = {"runs": 0, "reaped": 0, "upstream_errors": 0, "rooms_ended": 0,
+                                      "rooms_released": 0, "room_touches": 0}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval * random.uniform(0.8, 1.2))
+            try:
+                await self.reap_once()
+            except Exception:
+                logging.exception("Session reaper pass failed")
+
+    async def reap_once(self) -> int:
+        """One sweep; returns how many sessions were ended."""
+        self.stats["runs"] += 1
+        for code in [code for code, room in room_directory.rooms.items() if room.occupancy()]:
+            await self.room_active(code)
+        await write_behind.flush()  # the scan must see touches still queued
+        now = datetime.now(timezone.utc)
+        expired: List[Tuple[Dict[str, Any], str]] = []
+        store = get_storage()
+        async with contextlib.aclosing(store.active_sessions()) as sessions:
+            async for doc in sessions:
+                reason = _session_expiry_reason(doc, now)
+                if reason is not None:
+                    expired.append((doc, reason))
+                    if len(expired) >= self.batch_size:
+                        break
+        if not expired:
+            return 0
+
+        # Every worker scans; only the one whose update flipped a session acts on it
+        ended_at = now_iso()
+        flipped = set(await store.end_sessions({
+            doc["session_uuid"]: {"is_active": False, "ended_at": ended_at, "ended_reason": reason}
+            for doc, reason in expired
+        }))
+        expired = [(doc, reason) for doc, reason in expired if doc["session_uuid"] in flipped]
+        if not expired:
+            return 0
+        reasons = {doc["session_uuid"]: reason for doc, reason in expired}
+        for session_uuid in reasons:
+            session_cache.invalidate(session_uuid)
+        self.stats["reaped"] += len(expired)
+
+        if HYPERBEAM_API_KEY:
+            limit = asyncio.Semaphore(self.concurrency)
+            await asyncio.gather(*(self._terminate(limit, doc) for doc, _ in expired))
+
+        await self.end_rooms(reasons)
+        return len(expired)
+
+    async def end_rooms(self, reasons: Dict[str, str]) -> None:
+        """Announce `session_end` to the rooms of sessions this worker just ended.
+
+        Clients can't post this type, so every worker that delivers one may release
+        the room's state after the grace period.
+        """
+        for room in await get_storage().rooms_for_sessions(list(reasons)):
+            code = room["code"]
+            room_cache.invalidate(code)
+            await broker.publish(code, {
+                "type": "session_end",
+                "session_uuid": room["session_uuid"],
+                "reason": reasons[room["session_uuid"]],
+                "user": {},
+                "ts": realtime_ts(),
+            })
+            self.stats["rooms_ended"] += 1
+            self._owned.add(code)
+
+    async def room_active(self, code: str) -> None:
+        """Count activity in room `code` as access to its session."""
+        now = time.monotonic()
+        if now - self._touched.get(code, -math.inf) < self.touch_interval:
+            return
+        if now >= self._next_prune:
+            self._next_prune = now + self.touch_interval
+            self._touched = {c: t for c, t in self._touched.items() if now - t < self.touch_interval}
+        self._touched[code] = now
+        try:
+            room = await _load_room(code)
+        except Exception:
+            logging.exception("Failed to load room %s for a session touch", code)
+            return
+        if room is not None:
+            write_behind.touch(room["session_uuid"], now_iso())
+            self.stats["room_touches"] += 1
+
+    async def _terminate(self, limit: asyncio.Semaphore, doc: Dict[str, Any]) -> None:
+        async with limit:
+            try:
+                resp = await _hb_request("reap", "DELETE", f"/vm/{doc.get('hyperbeam_session_id')}",
+                                         retries=HB_TERMINATE_RETRIES,
+                                         headers={"Authorization": f"Bearer {HYPERBEAM_API_KEY}"})
+                if resp.status_code not in (200, 204, 404):
+                    self.stats["upstream_errors"] += 1
+            except UpstreamUnavailable:
+                self.stats["upstream_errors"] += 1
+            except httpx.HTTPError:
+                logging.exception("Network error calling Hyperbeam (reaper)")
+                self.stats["upstream_errors"] += 1
+
+    def release_room_later(self, code: str) -> None:
+        """Drop this worker's in-memory state for `code` after the grace period."""
+        if code in self._releases:
+            return
+        self._releases[code] = asyncio.get_running_loop().call_later(REAPER_ROOM_GRACE, self._release_room, code)
+
+    def _release_room(self, code: str) -> None:
+        self._releases.pop(code, None)
+        room_logs.discard(code)
+        presence_coalescer.discard(code)
+        room_cache.invalidate(code)
+        self.stats["rooms_released"] += 1
+        if code in self._owned:
+            self._owned.discard(code)
+            asyncio.ensure_future(self._forget(code))
+
+    @staticmethod
+    async def _forget(code: str) -> None:
+        try:
+            await broker.forget(code)
+        except Exception:
+            logging.exception("Failed to clear broker state for room %s", code)
+
+    async def close(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        for handle in self._releases.values():
+            handle.cancel()
+        self._releases.clear()
+
+session_reaper = SessionReaper()
+
+# -------------------------------------------------------------------------------------
+# Metrics endpoint, request timing middleware and event-loop lag sampler
+# -------------------------------------------------------------------------------------
+def _room_socket_counts() -> Dict[Tuple[str], int]:
+    # Largest rooms only: one series per room code would grow without bound
+    sizes = sorted(((len(s), code) for code, s in manager.rooms.items()), reverse=True)
+    return {(code,): n for n, code in sizes[:METRICS_ROOM_LABELS_MAX]}
+
+def _stats_series(stats: Dict[str, Any], keys: Tuple[str, ...]) -> Dict[Tuple[str], Any]:
+    return {(k,): stats[k] for k in keys}
+
+metrics.gauge("ws_connections", "Open WebSocket connections.", fn=lambda: len(manager.conns))
+metrics.gauge("ws_rooms", "Rooms with at least one open socket.", fn=lambda: len(manager.rooms))
+metrics.gauge("ws_room_connections", "Open sockets in the largest rooms.", ("room",), fn=_room_socket_counts)
+metrics.gauge("ws_send_queue_frames", "Frames queued across all sockets.",
+              fn=lambda: sum(len(c.queue) for c in list(manager.conns.values())))
+metrics.gauge("ws_dropped_frames", "Frames shed by the overflow policy on open sockets.",
+              fn=lambda: sum(c.dropped for c in list(manager.conns.values())))
+metrics.counter("ws_evicted_total", "Sockets evicted for overflow or send errors.", fn=lambda: manager.evicted)
+metrics.gauge("room_logs", "Rooms with an in-memory event log.", fn=lambda: len(room_logs))
+metrics.gauge("room_log_bytes", "Encoded bytes held by all room logs.", fn=lambda: room_logs.total_bytes)
+metrics.counter("room_log_evictions_total", "Room logs and events dropped by limit.", ("reason",),
+                fn=lambda: _stats_series(room_logs.stats, ("evicted_idle", "evicted_memory", "events_dropped")))
+metrics.gauge("room_directory_rooms", "Rooms with occupants or recent events.", fn=lambda: len(room_directory))
+metrics.gauge("longpoll_waiters", "Parked long-poll requests.", fn=lambda: sum(room_notifier._waiting.values()))
+metrics.counter("presence_updates_total", "Head updates offered to the coalescer.",
+                fn=lambda: presence_coalescer.stats["received"])
+metrics.counter("presence_frames_total", "Coalesced presence frames published.",
+                fn=lambda: presence_coalescer.stats["frames"])
+metrics.counter("cache_lookups_total", "Session/room cache lookups by result.", ("cache", "result"),
+                fn=lambda: {(name, k): v for name, c in (("session", session_cache), ("room", room_cache))
+                            for k, v in c.stats.items()})
+metrics.gauge("cache_entries", "Entries held per cache.", ("cache",),
+              fn=lambda: {("session",): len(session_cache), ("room",): len(room_cache)})
+metrics.counter("write_behind_total", "Write-behind flushes and ops by outcome.", ("what",),
+                fn=lambda: _stats_series(write_behind.stats, ("flushes", "ops", "merged", "errors", "dropped", "duplicates")))
+metrics.counter("hb_warm_pool_requests_total", "Session creates served from the warm pool or not.", ("result",),
+                fn=lambda: _stats_series(warm_pool.stats, ("hits", "misses")))
+metrics.counter("hb_warm_pool_vms_total", "Warm pool VM launches, launch failures and retirements.", ("what",),
+                fn=lambda: _stats_series(warm_pool.stats, ("launched", "launch_errors", "retired")))
+metrics.gauge("hb_warm_pool_idle", "Idle pre-launched VMs across all pools.", fn=lambda: warm_pool.idle)
+metrics.counter("idempotency_requests_total", "Keyed session creates by outcome.", ("outcome",),
+                fn=lambda: _stats_series(session_idempotency.stats, ("executed", "replayed", "shared", "conflicts")))
+metrics.counter("reaper_total", "Reaper passes, sessions ended and rooms closed.", ("what",),
+                fn=lambda: _stats_series(session_reaper.stats, ("runs", "reaped", "upstream_errors", "rooms_ended", "rooms_released")))
+metrics.gauge("hb_upstream_breaker_state", "Hyperbeam circuit breaker: 0 closed, 1 half-open, 2 open.",
+              fn=lambda: UpstreamGuard.STATES[hb_upstream.state])
+metrics.gauge("hb_upstream_inflight", "Hyperbeam calls in flight.", fn=lambda: hb_upstream.inflight)
+metrics.gauge("hb_upstream_queued", "Hyperbeam calls waiting for a concurrency slot.", fn=lambda: hb_upstream.waiting)
+metrics.counter("hb_upstream_guard_total", "Breaker openings and calls rejected without reaching Hyperbeam.", ("what",),
+                fn=lambda: _stats_series(hb_upstream.stats, ("opened", "rejected_open", "rejected_queue")))
+metrics.counter("rate_limited_total", "Realtime messages and event POSTs refused by rate limits.", ("kind", "scope"),
+                fn=lambda: dict(rate_limiter.stats))
+metrics.counter("chat_history_total", "Chat messages recorded and trimmed, history pages by source.", ("what",),
+                fn=lambda: _stats_series(chat_history.stats, ("recorded", "served_cache", "served_db", "trimmed")))
+metrics.gauge("write_behind_pending", "Writes waiting for the next flush.", fn=lambda: write_behind.pending)
+
+class MetricsMiddleware:
+    """Times HTTP requests to the response start, labelled by route template.
+
+    Plain ASGI rather than BaseHTTPMiddleware so streaming and long-poll responses
+    keep their own receive channel. Streams are timed to their first byte.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self._routes: Optional[Dict[Any, str]] = None
+
+    def _route(self, scope) -> str:
+        if self._routes is None:
+            self._routes = {r.endpoint: r.path for r in app.routes if hasattr(r, "endpoint")}
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    def _record(self, scope, status: int, started: float) -> None:
+        route = self._route(scope)
+        HTTP_SECONDS.observe(time.perf_counter() - started, scope["method"], route)
+        HTTP_REQUESTS.inc(scope["method"], route, str(status))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        responded = False
+
+        async def send_timed(message):
+            nonlocal responded
+            if message["type"] == "http.response.start" and not responded:
+                responded = True
+                self._record(scope, message["status"], started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        except BaseException:
+            if not responded:
+                self._record(scope, 500, started)
+            raise
+
+@api_router.get("/metrics")
+async def get_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+_lag_task: Optional[asyncio.Task] = None
+
+async def _sample_loop_lag() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(METRICS_LAG_INTERVAL)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - METRICS_LAG_INTERVAL))
 
 # Include routers in the main app
 app.include_router(api_router)
@@ -408,7 +3581,10 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
 )
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -417,6 +3593,62 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_storage():
+    await get_storage().start()
+
+@app.on_event("startup")
+async def startup_hb_client():
+    global hb_http, hb_http_closed
+    hb_http_closed = False
+    if hb_http is None:
+        hb_http = _build_hb_client()
+
+@app.on_event("shutdown")
+async def shutdown_hb_client():
+    global hb_http, hb_http_closed
+    # Stop everything that calls upstream in the background first; idle pooled VMs
+    # are terminated while the client is still open
+    await session_reaper.close()
+    await warm_pool.close()
+    hb_http_closed = True
+    if hb_http is not None:
+        await hb_http.aclose()
+        hb_http = None
+
+@app.on_event("startup")
+async def startup_metrics():
+    global _lag_task
+    if METRICS_ENABLED and _lag_task is None:
+        _lag_task = asyncio.create_task(_sample_loop_lag())
+
+@app.on_event("shutdown")
+async def shutdown_metrics():
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        _lag_task = None
+
+@app.on_event("startup")
+async def startup_broker():
+    global broker
+    broker = _build_broker()
+    await broker.start()
+
+@app.on_event("startup")
+async def startup_reaper():
+    if REAPER_ENABLED:
+        session_reaper.start()
+
+@app.on_event("shutdown")
+async def shutdown_realtime():
+    presence_coalescer.close()
+    await broker.close()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    global storage
+    await write_behind.close()
+    if storage is not None:
+        await storage.close()
+        storage = None
\ No newline at end of file
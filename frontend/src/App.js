@@ -164,12 +164,13 @@ function App() {
   const [joinCode, setJoinCode] = useState("");
 
   // presence & chat via WebSocket or HTTP polling
-  const [liveMode, setLiveMode] = useState("none"); // none | ws | poll
+  const [liveMode, setLiveMode] = useState("none"); // none | ws | sse | poll
   const wsRef = useRef(null);
   const pollRef = useRef(null);
   const lastEventIdRef = useRef(0);
   const [messages, setMessages] = useState([]);
   const [chatOpen, setChatOpen] = useState(false);
+  const [olderChat, setOlderChat] = useState(true);
   const [others, setOthers] = useState({}); // userId -> {initial,color,pos,size}
 
   // chat audio volume (separate from browser audio)
@@ -179,6 +180,17 @@ function App() {
 
   useEffect(() => { if (apiKey) sessionStorage.setItem("hb_api_key", apiKey); }, [apiKey]);
 
+  // scroll back through the room's persisted chat, one page before the oldest loaded message
+  const loadOlderChat = useCallback(async () => {
+    const oldest = messages.find((m) => m.id)?.id;
+    if (!shareCode || !oldest) return;
+    try {
+      const res = await axios.get(`${API}/hb/rooms/${shareCode}/chat`, { params: { before: oldest, limit: 50 } });
+      setMessages((m) => [...res.data.messages, ...m]);
+      setOlderChat(res.data.has_more);
+    } catch {}
+  }, [messages, shareCode]);
+
   const headers = useMemo(() => ({ Authorization: `Bearer ${apiKey}` }), [apiKey]);
 
   // Initialize Hyperbeam SDK when session active in real mode
@@ -209,29 +221,67 @@ function App() {
 
   function cleanupHB() { if (hbClientRef.current) { try { hbClientRef.current.destroy(); } catch {} hbClientRef.current = null; } setHbReady(false); }
 
-  // Live connection management (WS first, then poll)
-  const stopPolling = useCallback(() => { if (pollRef.current) { clearInterval(pollRef.current); pollRef.current = null; } }, []);
+  // Live connection management (WS first, then SSE stream, then long-poll)
+  const stopPolling = useCallback(() => { if (pollRef.current) { pollRef.current.abort(); pollRef.current = null; } }, []);
   const stopWS = useCallback(() => { try { wsRef.current?.close(); } catch {} wsRef.current = null; }, []);
 
   const startPolling = useCallback((code) => {
     stopPolling();
     setLiveMode("poll");
-    lastEventIdRef.current = 0; // fresh
-    const tick = async () => {
-      try {
-        const res = await axios.get(`${API}/hb/rooms/${code}/events`, { params: { since: lastEventIdRef.current } });
-        const { events, last_id } = res.data || {};
-        if (Array.isArray(events) && events.length) {
-          events.forEach(handleInboundEvent);
-          lastEventIdRef.current = last_id || lastEventIdRef.current;
+    // carry on from the last event seen on WS/SSE (0 when the room is fresh)
+    // long-poll: the server parks each request until something newer than `since` arrives
+    const ctrl = new AbortController();
+    pollRef.current = ctrl;
+    const loop = async () => {
+      while (!ctrl.signal.aborted) {
+        try {
+          const res = await axios.get(`${API}/hb/rooms/${code}/events`, { params: { since: lastEventIdRef.current, wait: 25, client: user.id }, signal: ctrl.signal, timeout: 35000 });
+          const { events, last_id } = res.data || {};
+          if (Array.isArray(events) && events.length) {
+            events.forEach(handleInboundEvent);
+            lastEventIdRef.current = last_id || lastEventIdRef.current;
+          }
+        } catch (e) {
+          // keep polling even on transient errors, with a short back-off
+          if (!ctrl.signal.aborted) await new Promise((r) => setTimeout(r, 1200));
         }
-      } catch (e) {
-        // keep polling even on transient errors
       }
     };
-    tick();
-    pollRef.current = setInterval(tick, 1200);
-  }, [stopPolling]);
+    loop();
+  }, [stopPolling, user.id]);
+
+  // fresh joiners start from the room snapshot (who is here, heads, recent chat) and
+  // continue from its seq instead of replaying a tail of stale presence events
+  const loadSnapshot = useCallback(async (code) => {
+    if (lastEventIdRef.current) return;
+    try {
+      const res = await axios.get(`${API}/hb/rooms/${code}/snapshot`, { timeout: 5000 });
+      handleInboundEvent(res.data);
+    } catch {}
+  }, []);
+
+  const startStream = useCallback((code) => {
+    stopPolling();
+    if (typeof window.EventSource === "undefined") { loadSnapshot(code).then(() => startPolling(code)); return; }
+    setLiveMode("sse");
+    let es = null;
+    let cancelled = false;
+    pollRef.current = { abort: () => { cancelled = true; es?.close(); } };
+    loadSnapshot(code).then(() => {
+      if (cancelled) return;
+      es = new EventSource(`${API}/hb/rooms/${code}/stream?since=${lastEventIdRef.current}`);
+      let opened = false;
+      es.onopen = () => { opened = true; };
+      es.onmessage = (ev) => {
+        try { const data = JSON.parse(ev.data); handleInboundEvent(data); if (data.id) lastEventIdRef.current = data.id; } catch {}
+      };
+      es.onerror = () => {
+        // the browser reconnects by itself (resuming via Last-Event-ID); only give up
+        // on streams that never opened or were closed for good
+        if (!opened || es.readyState === window.EventSource.CLOSED) { es.close(); startPolling(code); }
+      };
+    });
+  }, [loadSnapshot, startPolling, stopPolling]);
 
   const startWS = useCallback((code) => {
     stopWS();
@@ -241,35 +291,64 @@ function App() {
       wsRef.current = ws;
       ws.onopen = () => {
         setLiveMode("ws");
-        ws.send(JSON.stringify({ type: "hello", user }));
+        // resume_from: the server replays only what we missed before going live
+        const hello = { type: "hello", user };
+        if (lastEventIdRef.current) hello.resume_from = lastEventIdRef.current;
+        else hello.snapshot = true;
+        ws.send(JSON.stringify(hello));
       };
       ws.onmessage = (ev) => {
-        try { const data = JSON.parse(ev.data); handleInboundEvent(data); } catch {}
+        try {
+          const data = JSON.parse(ev.data);
+          handleInboundEvent(data);
+          if (data.id > lastEventIdRef.current) lastEventIdRef.current = data.id;
+        } catch {}
       };
       ws.onclose = () => {
         wsRef.current = null;
-        // fallback to polling
-        startPolling(code);
+        // fallback to SSE (then polling)
+        startStream(code);
       };
       ws.onerror = () => {
-        // fallback to polling
+        // fallback to SSE (then polling)
         try { ws.close(); } catch {}
         wsRef.current = null;
-        startPolling(code);
+        startStream(code);
       };
     } catch (e) {
-      startPolling(code);
+      startStream(code);
     }
-  }, [startPolling, stopWS, user]);
+  }, [startStream, stopWS, user]);
 
   const handleInboundEvent = useCallback((data) => {
+    if (data.type === "snapshot") {
+      const people = {};
+      (data.participants || []).forEach((p) => {
+        if (!p.user?.id || p.user.id === user.id) return;
+        people[p.user.id] = { initial: p.user.initial, color: p.user.color, pos: p.head?.pos || { x: 24, y: 24 }, size: p.head?.size || 64 };
+      });
+      setOthers(people);
+      setMessages(data.chat || []);
+      if (data.seq > lastEventIdRef.current) lastEventIdRef.current = data.seq;
+      return;
+    }
     if (data.type === "chat") {
       setMessages((m) => [...m, data]);
       if (data.user?.id !== user.id) chatAudioRef.current?.play().catch(() => {});
       return;
     }
     if (data.type === "presence") {
-      if (data.event === "leave") {
+      if (data.event === "batch") {
+        // server-coalesced head moves: latest state per user for this tick
+        const updates = (data.updates || []).filter((u) => u.head && u.user?.id && u.user.id !== user.id);
+        if (updates.length) {
+          setOthers((o) => {
+            const c = { ...o };
+            updates.forEach((u) => { c[u.user.id] = { initial: u.user.initial, color: u.user.color, pos: u.head.pos, size: u.head.size }; });
+            return c;
+          });
+        }
+      } else if (data.event === "leave") {
         setOthers((o) => { const c = { ...o }; if (data.user?.id) delete c[data.user.id]; return c; });
       } else if (data.event === "join" && data.user?.id && data.user.id !== user.id) {
         setOthers((o) => ({ ...o, [data.user.id]: { initial: data.user.initial, color: data.user.color, pos: { x: 24, y: 24 }, size: 64 } }));
@@ -373,13 +452,10 @@ function App() {
           const rooms = getMockRooms();
           delete rooms[shareCode];
           setMockRooms(rooms);
-          await axios.post(`${API}/hb/rooms/${shareCode}/events`, { type: "session_end", user });
         }
       } else {
+        // the backend announces session_end to the room itself
         await axios.delete(`${API}/hb/sessions/${session.session_uuid}`, { headers });
-        if (shareCode) {
-          await axios.post(`${API}/hb/rooms/${shareCode}/events`, { type: "session_end", user });
-        }
       }
     } catch (err) { console.error(err); setError(err?.response?.data?.detail || err.message || "Remote terminate error; marked inactive locally"); }
     finally { cleanupHB(); setSession(null); setShareCode(""); stopPolling(); stopWS(); setLiveMode("none"); setOthers({}); setMessages([]); setLoading(false); }
@@ -505,7 +581,7 @@ function App() {
 
             {error ? <div className="ct-alert error">{String(error)}</div> : null}
             {session ? (
-              <div className="ct-alert success">Session Active • {session.session_uuid} {shareCode ? `• Code ${shareCode}` : ""} {liveMode === 'ws' ? '• Live WS' : liveMode === 'poll' ? '• Live Poll' : ''}</div>
+              <div className="ct-alert success">Session Active • {session.session_uuid} {shareCode ? `• Code ${shareCode}` : ""} {liveMode === 'ws' ? '• Live WS' : liveMode === 'sse' ? '• Live Stream' : liveMode === 'poll' ? '• Live Poll' : ''}</div>
             ) : null}
           </form>
 
@@ -637,10 +713,11 @@ function App() {
           {/* Chat panel */}
           {session && (
             <div className="ct-chat-panel">
-              <button className="btn ghost" onClick={() => setChatOpen((v) => !v)}>{chatOpen ? "Close Chat" : "Open Chat"}{liveMode !== 'none' ? (liveMode === 'ws' ? ' • Live WS' : ' • Live Poll') : ''}</button>
+              <button className="btn ghost" onClick={() => setChatOpen((v) => !v)}>{chatOpen ? "Close Chat" : "Open Chat"}{liveMode !== 'none' ? (liveMode === 'ws' ? ' • Live WS' : liveMode === 'sse' ? ' • Live Stream' : ' • Live Poll') : ''}</button>
               {chatOpen && (
                 <div className="ct-chat-window">
                   <div className="ct-chat-messages">
+                    {olderChat && messages.length > 0 && <button className="btn ghost ct-chat-older" onClick={loadOlderChat}>Load earlier messages</button>}
                     {messages.map((m, i) => (
                       <div key={i} className="ct-chat-item">
                         <span className="ct-chat-tag" style={{background: m.user?.color || '#334155'}}>{m.user?.initial || '👤'}</span>
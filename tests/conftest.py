@@ -0,0 +1,75 @@
+"""Unit tests for backend/server.py.
+
+They run against MemoryStorage, so no MongoDB is needed; storage parity tests also
+run against mongomock when mongomock_motor is installed. Each test gets fresh
+module-level singletons (storage, logs, caches, broker, batchers), since every
+test drives its own event loop through `run`.
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("REAPER_ENABLED", "false")
+
+import server  # noqa: E402
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch):
+    monkeypatch.setattr(server, "storage", server.MemoryStorage())
+    monkeypatch.setattr(server, "room_logs", server.RoomLogStore())
+    monkeypatch.setattr(server, "write_behind", server.WriteBehind())
+    monkeypatch.setattr(server, "broker", server.InProcessBroker())
+    monkeypatch.setattr(server, "manager", server.RoomManager())
+    monkeypatch.setattr(server, "session_cache", server.TTLCache())
+    monkeypatch.setattr(server, "room_cache", server.TTLCache())
+    monkeypatch.setattr(server, "room_directory", server.RoomDirectory())
+    monkeypatch.setattr(server, "chat_history", server.ChatHistory())
+    monkeypatch.setattr(server, "session_reaper", server.SessionReaper())
+    monkeypatch.setattr(server, "presence_coalescer", server.PresenceCoalescer())
+    monkeypatch.setattr(server, "room_notifier", server.RoomNotifier())
+    monkeypatch.setattr(server, "rate_limiter", server.RateLimiter())
+    monkeypatch.setattr(server, "hb_upstream", server.UpstreamGuard())
+    monkeypatch.setattr(server, "warm_pool", server.WarmPool())
+    monkeypatch.setattr(server, "session_idempotency", server.IdempotencyStore())
+    monkeypatch.setattr(server, "hb_http", None)
+    monkeypatch.setattr(server, "hb_http_closed", False)
+
+
+@pytest.fixture
+def store():
+    return server.storage
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """A mock Hyperbeam behind the shared client; returns the requests it received."""
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        if request.method == "POST":
+            n = len(seen)
+            return httpx.Response(200, json={"session_id": f"vm{n}", "embed_url": f"https://hb/{n}",
+                                             "admin_token": "adm"})
+        return httpx.Response(204)
+
+    monkeypatch.setattr(server, "hb_http", httpx.AsyncClient(transport=httpx.MockTransport(handler),
+                                                             base_url=server.HYPERBEAM_BASE))
+    return seen
+
+
+def api():
+    """An async client driving the app in-process, without lifespan events."""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test")
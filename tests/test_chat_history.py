@@ -0,0 +1,67 @@
+import json
+
+from tests.conftest import run
+import server
+
+
+def _texts(frames):
+    return [json.loads(f)["text"] for f in frames]
+
+
+async def _chat(code, n, start=0):
+    for i in range(start, start + n):
+        await server.broker.publish(code, {"type": "chat", "text": f"m{i}", "user": {"id": "u"}})
+    await server.write_behind.flush()
+
+
+def test_pages_backwards_across_cache_and_storage():
+    async def main():
+        await _chat("R", 80)  # the room state caches only the newest 50
+        pages, before = [], None
+        while True:
+            frames, more = await server.chat_history.page("R", before, None, 30)
+            pages.append(_texts(frames))
+            if not more:
+                return pages
+            before = json.loads(frames[0])["id"]
+
+    pages = run(main())
+    assert [len(p) for p in pages] == [30, 30, 20]
+    assert sum(reversed(pages), []) == [f"m{i}" for i in range(80)]
+    assert server.chat_history.stats["served_db"] >= 1
+
+
+def test_pages_forwards_with_after():
+    async def main():
+        await _chat("R", 70)
+        out, after = [], 0
+        while True:
+            frames, more = await server.chat_history.page("R", None, after, 25)
+            out += _texts(frames)
+            if not more:
+                return out
+            after = json.loads(frames[-1])["id"]
+
+    assert run(main()) == [f"m{i}" for i in range(70)]
+
+
+def test_fresh_room_log_continues_after_persisted_seq(store):
+    async def main():
+        await _chat("R", 3)
+        server.room_logs.discard("R")
+        seq = await server.broker.publish("R", {"type": "chat", "text": "again", "user": {}})
+        return seq, await store.last_chat_seq("R")
+
+    seq, persisted = run(main())
+    assert seq == persisted + 1
+
+
+def test_trim_keeps_newest(store):
+    history = server.ChatHistory(max_per_room=5)
+
+    async def main():
+        await _chat("R", 12)
+        await history.trim("R")
+        return await store.chat_range("R", None, None, 100, newest=False)
+
+    assert [e["text"] for e in run(main())] == [f"m{i}" for i in range(7, 12)]
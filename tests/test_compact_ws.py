@@ -0,0 +1,72 @@
+import json
+import struct
+
+from starlette.testclient import TestClient
+
+import server
+
+
+def _codec():
+    uids = {}
+
+    def next_uid(user_id):
+        return uids.setdefault(user_id, len(uids) + 1)
+
+    return server.CompactCodec(uids, next_uid)
+
+
+def _batch(*updates):
+    return {"type": "presence", "event": "batch",
+            "updates": [{"user": {"id": uid}, "head": {"pos": {"x": x, "y": y}, "size": s}}
+                        for uid, x, y, s in updates]}
+
+
+def _heads(chunk):
+    op, count = struct.unpack_from("!BH", chunk)
+    assert op == server.WS_OP_HEADS
+    return [struct.unpack_from("!Hhhh", chunk, 3 + 8 * i) for i in range(count)]
+
+
+def test_users_are_announced_once_and_heads_sent_as_deltas():
+    codec = _codec()
+    first = codec.encode(b"", _batch(("a", 10, 20, 3), ("b", -5, 0, 1)))
+    assert [c[0] for c in first] == [server.WS_OP_USER, server.WS_OP_USER, server.WS_OP_HEADS]
+    assert struct.unpack_from("!BH", first[0]) == (server.WS_OP_USER, 1)
+    assert json.loads(first[0][3:]) == {"id": "a"}
+    assert _heads(first[2]) == [(1, 10, 20, 3), (2, -5, 0, 1)]
+
+    second = codec.encode(b"", _batch(("a", 12, 18, 3)))
+    assert len(second) == 1
+    assert _heads(second[0]) == [(1, 2, -2, 0)]
+
+
+def test_large_jumps_are_clamped_and_finished_by_the_next_delta():
+    codec = _codec()
+    assert _heads(codec.encode(b"", _batch(("a", 40000, 0, 0)))[-1]) == [(1, 32767, 0, 0)]
+    assert _heads(codec.encode(b"", _batch(("a", 40000, 0, 0)))[-1]) == [(1, 40000 - 32767, 0, 0)]
+
+
+def test_other_events_are_wrapped_json():
+    frame = server.dumps_frame({"type": "chat", "text": "hi"})
+    assert _codec().encode(frame, {"type": "chat", "text": "hi"}) == [bytes((server.WS_OP_JSON,)) + frame]
+
+
+def test_decode_head_in():
+    raw = struct.pack("!Bhhh", server.WS_OP_HEAD_IN, 7, -3, 2)
+    assert server.decode_head_in(raw) == {"pos": {"x": 7, "y": -3}, "size": 2}
+    assert server.decode_head_in(raw[:-1]) is None
+    assert server.decode_head_in(bytes((server.WS_OP_JSON,)) + raw[1:]) is None
+
+
+def test_compact_client_gets_its_own_head_back_as_a_delta():
+    with TestClient(server.app) as client, client.websocket_connect("/api/hb/ws/room/R") as ws:
+        ws.send_text(json.dumps({"type": "hello", "user": {"id": "a"}, "encoding": "compact"}))
+        welcome = ws.receive_bytes()
+        assert welcome[0] == server.WS_OP_JSON
+        assert json.loads(welcome[1:]) == {"type": "welcome", "encoding": "compact", "uid": 1}
+        join = ws.receive_bytes()
+        assert json.loads(join[1:])["event"] == "join"
+        ws.send_bytes(struct.pack("!Bhhh", server.WS_OP_HEAD_IN, 5, 6, 1))
+        user = ws.receive_bytes()
+        assert user[0] == server.WS_OP_USER and json.loads(user[3:]) == {"id": "a"}
+        assert _heads(ws.receive_bytes()) == [(1, 5, 6, 1)]
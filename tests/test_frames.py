@@ -0,0 +1,40 @@
+import json
+
+from tests.conftest import api, run
+import server
+
+BIG = 2 ** 70
+
+
+def test_dumps_frame_is_compact_json():
+    frame = server.dumps_frame({"type": "chat", "text": "hi", "n": [1, 2]})
+    assert frame == b'{"type":"chat","text":"hi","n":[1,2]}'
+
+
+def test_dumps_frame_takes_ints_beyond_64_bits():
+    assert json.loads(server.dumps_frame({"user": {"id": BIG}})) == {"user": {"id": BIG}}
+
+
+def test_spliced_poll_body_is_valid_json():
+    for text in ("one", 'quote " and é', "three"):
+        server.room_logs.append("R", {"id": 0, "type": "chat", "text": text, "n": BIG})
+    frames, last_id = server._read_room_events("R", 1)
+    body = json.loads(server._events_response(frames, last_id).body)
+    assert body["last_id"] == 3
+    assert [(e["id"], e["text"], e["n"]) for e in body["events"]] == [
+        (2, 'quote " and é', BIG), (3, "three", BIG)]
+
+
+def test_big_int_event_round_trips_through_post_and_poll():
+    async def main():
+        await server.storage.insert_room({"code": "R", "session_uuid": "s1", "created_at": "t"})
+        async with api() as client:
+            posted = await client.post("/api/hb/rooms/R/events",
+                                       json={"type": "chat", "text": "hi", "user": {"id": BIG}})
+            polled = await client.get("/api/hb/rooms/R/events")
+            return posted, polled
+
+    posted, polled = run(main())
+    assert posted.status_code == 200 and posted.json()["id"] == 1
+    events = polled.json()["events"]
+    assert [(e["id"], e["user"]["id"]) for e in events] == [(1, BIG)]
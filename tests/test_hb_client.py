@@ -0,0 +1,71 @@
+import httpx
+import pytest
+
+from tests.conftest import api, run
+import server
+
+AUTH = {"Authorization": "Bearer key-1"}
+
+
+def test_create_and_terminate_go_through_the_shared_client(upstream, store):
+    async def main():
+        async with api() as c:
+            created = await c.post("/api/hb/sessions", json={"width": 800}, headers=AUTH)
+            uuid = created.json()["session_uuid"]
+            fetched = await c.get(f"/api/hb/sessions/{uuid}")
+            ended = await c.delete(f"/api/hb/sessions/{uuid}", headers=AUTH)
+            return created, fetched, ended, await store.get_session(uuid)
+
+    created, fetched, ended, doc = run(main())
+    assert created.status_code == 200 and created.json()["embed_url"] == "https://hb/1"
+    assert fetched.json()["session_uuid"] == created.json()["session_uuid"]
+    assert ended.json()["message"] == "Session terminated successfully"
+    assert doc["is_active"] is False and doc["hyperbeam_session_id"] == "vm1"
+    post, delete = upstream
+    assert (post.method, post.url.path) == ("POST", "/v0/vm")
+    assert post.headers["authorization"] == "Bearer key-1"
+    assert server.loads_frame(post.content)["width"] == 800
+    assert (delete.method, delete.url.path) == ("DELETE", "/v0/vm/vm1")
+
+
+def test_upstream_errors_are_passed_through(monkeypatch):
+    monkeypatch.setattr(server, "hb_http", httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(403, text="bad key")),
+        base_url=server.HYPERBEAM_BASE))
+
+    async def main():
+        async with api() as c:
+            return await c.post("/api/hb/sessions", json={}, headers=AUTH)
+
+    resp = run(main())
+    assert resp.status_code == 403 and "bad key" in resp.json()["detail"]
+
+
+def test_network_errors_become_503(monkeypatch):
+    def refuse(request):
+        raise httpx.ConnectError("refused")
+
+    monkeypatch.setattr(server, "hb_http", httpx.AsyncClient(transport=httpx.MockTransport(refuse),
+                                                             base_url=server.HYPERBEAM_BASE))
+
+    async def main():
+        async with api() as c:
+            return await c.post("/api/hb/sessions", json={}, headers=AUTH)
+
+    assert run(main()).status_code == 503
+
+
+def test_shutdown_stops_the_reaper_before_closing_the_client(upstream):
+    async def main():
+        server.session_reaper.start()
+        client = server.hb_http
+        await server.shutdown_hb_client()
+        assert server.session_reaper._task is None
+        assert client.is_closed and server.hb_http is None
+        with pytest.raises(server.UpstreamUnavailable):
+            server.get_hb_client()
+        await server.startup_hb_client()
+        assert server.get_hb_client() is server.hb_http
+        await server.hb_http.aclose()
+
+    run(main())
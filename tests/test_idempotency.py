@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from tests.conftest import run
+import server
+
+
+def test_replays_completed_response():
+    idem = server.IdempotencyStore(ttl=60)
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return {"session_uuid": "s1"}
+
+    async def main():
+        first = await idem.run("scope", "fp", handler)
+        second = await idem.run("scope", "fp", handler)
+        return first, second
+
+    assert run(main()) == (({"session_uuid": "s1"}, False), ({"session_uuid": "s1"}, True))
+    assert len(calls) == 1
+
+
+def test_concurrent_duplicates_share_the_launch():
+    idem = server.IdempotencyStore(ttl=60)
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"n": len(calls)}
+
+    async def main():
+        return await asyncio.gather(*(idem.run("scope", "fp", handler) for _ in range(3)))
+
+    results = run(main())
+    assert len(calls) == 1
+    assert [r[1] for r in results] == [False, True, True]
+
+
+def test_different_body_is_rejected():
+    idem = server.IdempotencyStore(ttl=60)
+
+    async def handler():
+        return {"ok": True}
+
+    async def main():
+        await idem.run("scope", "fp-a", handler)
+        with pytest.raises(HTTPException) as exc:
+            await idem.run("scope", "fp-b", handler)
+        assert exc.value.status_code == 422
+
+    run(main())
+
+
+def test_failed_request_can_be_retried(store):
+    idem = server.IdempotencyStore(ttl=60)
+    attempts = []
+
+    async def handler():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise HTTPException(status_code=503, detail="upstream")
+        return {"ok": True}
+
+    async def main():
+        with pytest.raises(HTTPException):
+            await idem.run("scope", "fp", handler)
+        assert await store.get_claim("scope") is None
+        return await idem.run("scope", "fp", handler)
+
+    assert run(main()) == ({"ok": True}, False)
+
+
+def test_cancelled_leader_hands_over_to_a_follower(store):
+    idem = server.IdempotencyStore(ttl=60)
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return {"attempt": len(calls)}
+
+    async def main():
+        leader = asyncio.ensure_future(idem.run("scope", "fp", handler))
+        await asyncio.sleep(0.005)
+        followers = [asyncio.ensure_future(idem.run("scope", "fp", handler)) for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        assert leader.cancelled()
+        return results
+
+    assert run(main()) == [({"attempt": 2}, False), ({"attempt": 2}, True)]
+    assert len(calls) == 2
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+from tests.conftest import api, run
+import server
+
+
+def _publish(code, text):
+    server.room_logs.append(code, {"type": "chat", "text": text, "user": {}})
+    server.room_notifier.notify(code)
+
+
+def test_returns_pending_events_without_waiting():
+    async def main():
+        _publish("R", "a")
+        async with api() as c:
+            started = time.monotonic()
+            body = (await c.get("/api/hb/rooms/R/events", params={"since": 0, "wait": 5})).json()
+            return body, time.monotonic() - started
+
+    body, elapsed = run(main())
+    assert [e["text"] for e in body["events"]] == ["a"] and body["last_id"] == 1
+    assert elapsed < 1
+
+
+def test_times_out_empty():
+    async def main():
+        async with api() as c:
+            started = time.monotonic()
+            body = (await c.get("/api/hb/rooms/R/events", params={"since": 0, "wait": 0.1})).json()
+            return body, time.monotonic() - started
+
+    body, elapsed = run(main())
+    assert body == {"events": [], "last_id": 0}
+    assert 0.1 <= elapsed < 1
+
+
+def test_wakes_on_a_later_publish():
+    async def main():
+        async with api() as c:
+            poll = asyncio.ensure_future(c.get("/api/hb/rooms/R/events", params={"since": 0, "wait": 5}))
+            await asyncio.sleep(0.05)
+            started = time.monotonic()
+            await server.broker.publish("R", {"type": "chat", "text": "b", "user": {}})
+            body = (await poll).json()
+            return body, time.monotonic() - started
+
+    body, elapsed = run(main())
+    assert [e["text"] for e in body["events"]] == ["b"]
+    assert elapsed < 1
+
+
+def test_publish_right_after_the_empty_read_is_not_missed(monkeypatch):
+    read = server._read_room_events
+    scheduled = []
+
+    def read_then_publish(code, since):
+        result = read(code, since)
+        if not scheduled:
+            # lands on the next loop iteration, before any task the handler spawns runs
+            scheduled.append(asyncio.get_running_loop().call_soon(_publish, code, "c"))
+        return result
+
+    monkeypatch.setattr(server, "_read_room_events", read_then_publish)
+
+    async def main():
+        async with api() as c:
+            started = time.monotonic()
+            body = (await c.get("/api/hb/rooms/R/events", params={"since": 0, "wait": 3})).json()
+            return body, time.monotonic() - started
+
+    body, elapsed = run(main())
+    assert [e["text"] for e in body["events"]] == ["c"]
+    assert elapsed < 1
+
+
+def test_notifier_registration_is_synchronous():
+    notifier = server.RoomNotifier()
+
+    async def main():
+        ev = notifier.event("R")
+        notifier.notify("R")
+        assert ev.is_set()
+        notifier.release("R", ev)
+        assert await notifier.wait("R", 0.01) is False
+
+    run(main())
+    assert notifier._events == {} and notifier._waiting == {}
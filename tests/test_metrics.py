@@ -0,0 +1,56 @@
+import pytest
+
+from tests.conftest import api, run
+import server
+
+
+def test_registry_renders_prometheus_text():
+    registry = server.MetricsRegistry()
+    hits = registry.counter("hits_total", "Hits.", ("path",))
+    hits.inc('/a"b')
+    hits.inc('/a"b', amount=2)
+    registry.gauge("rooms", "Rooms.", fn=lambda: 3)
+    lat = registry.histogram("lat_seconds", "Latency.", ("op",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        lat.observe(v, "get")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE hits_total counter" in lines
+    assert 'hits_total{path="/a\\"b"} 3' in lines
+    assert "rooms 3" in lines
+    assert [line for line in lines if line.startswith("lat_seconds")] == [
+        'lat_seconds_bucket{op="get",le="0.1"} 1',
+        'lat_seconds_bucket{op="get",le="1.0"} 2',
+        'lat_seconds_bucket{op="get",le="+Inf"} 3',
+        'lat_seconds_sum{op="get"} 5.55',
+        'lat_seconds_count{op="get"} 3',
+    ]
+
+
+def test_a_failing_family_does_not_break_the_scrape():
+    registry = server.MetricsRegistry()
+    registry.gauge("broken", "Broken.", fn=lambda: 1 / 0)
+    registry.gauge("fine", "Fine.", fn=lambda: 1)
+    assert "fine 1" in registry.render().splitlines()
+
+
+@pytest.mark.skipif(not server.METRICS_ENABLED, reason="METRICS_ENABLED is off")
+def test_requests_are_labelled_by_route_template():
+    def count(route, status):
+        return server.HTTP_REQUESTS._values.get(("GET", route, status), 0)
+
+    before = (count("/api/hb/rooms/{code}/events", "200"), count("unmatched", "404"))
+
+    async def main():
+        async with api() as client:
+            await client.get("/api/hb/rooms/ABC123/events")
+            await client.get("/api/hb/rooms/XYZ789/events")
+            await client.get("/api/nowhere")
+            return await client.get("/api/metrics")
+
+    scrape = run(main())
+    assert count("/api/hb/rooms/{code}/events", "200") == before[0] + 2
+    assert count("unmatched", "404") == before[1] + 1
+    assert scrape.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/api/hb/rooms/{code}/events",status="200"}' in scrape.text
+    assert "ABC123" not in scrape.text
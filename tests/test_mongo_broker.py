@@ -0,0 +1,198 @@
+"""MongoBroker's bus tail.
+
+The first tests drive `_tail` over an in-memory stand-in for a tailable cursor. The
+last one runs several worker processes against a real mongod and only runs when
+MONGO_TEST_URL is set (e.g. MONGO_TEST_URL=mongodb://localhost:27017); this file is
+also the worker script it starts.
+"""
+
+import asyncio
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+if __name__ == "__main__":
+    os.environ.setdefault("CHAT_HISTORY_ENABLED", "false")
+    os.environ.setdefault("REAPER_ENABLED", "false")
+
+import server  # noqa: E402
+
+
+def _oid(ts, n=0):
+    return ObjectId(struct.pack(">I", ts) + n.to_bytes(8, "big"))
+
+
+class _Cursor:
+    """Tailable-cursor stand-in: yields matching bus documents in insertion order, then waits."""
+
+    def __init__(self, bus, since):
+        self.bus = bus
+        self.since = since
+        self.pos = 0
+        self.alive = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while self.pos < len(self.bus.docs):
+            doc = self.bus.docs[self.pos]
+            self.pos += 1
+            if self.since is None or doc["_id"] >= self.since:
+                self.bus.returned += 1
+                return doc
+        await asyncio.sleep(0.005)
+        raise StopAsyncIteration
+
+
+class _Bus:
+    def __init__(self):
+        self.docs = []
+        self.returned = 0
+
+    def find(self, query, cursor_type=None):
+        assert set(query) <= {"_id"} and set(query.get("_id", {})) <= {"$gte"}, \
+            "the tail may only bound _id from below"
+        return _Cursor(self, query.get("_id", {}).get("$gte"))
+
+
+class _Database(dict):
+    hb_room_seq = None
+
+
+def _tail_into(bus, last_id):
+    broker = server.MongoBroker(_Database({server.ROOM_BUS_COLLECTION: bus}))
+    broker._last_id = last_id
+    seen = []
+
+    async def dispatch(doc):
+        seen.append(doc["_id"])
+
+    broker._dispatch = dispatch
+    return broker, seen
+
+
+def _run_tail(broker, late_docs, bus):
+    from tests.conftest import run
+
+    async def main():
+        task = asyncio.ensure_future(broker._tail())
+        await asyncio.sleep(0.02)
+        bus.docs.extend(late_docs)
+        await asyncio.sleep(0.02)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    run(main())
+
+
+def test_tail_follows_insertion_order_not_object_ids():
+    bus = _Bus()
+    bus.docs += [{"_id": _oid(1000), "code": None}, {"_id": _oid(1001), "code": "R"}]
+    broker, seen = _tail_into(bus, last_id=_oid(1000))
+    # another worker's clock runs behind, so its id sorts lower
+    _run_tail(broker, [{"_id": _oid(940), "code": "R"}], bus)
+    assert seen == [_oid(1001), _oid(940)]
+
+
+def test_tail_resumes_after_a_lost_position():
+    bus = _Bus()
+    bus.docs += [{"_id": _oid(1000, 1), "code": "R"}, {"_id": _oid(1000, 2), "code": "R"}]
+    broker, seen = _tail_into(bus, last_id=_oid(1000, 0))  # rolled off the capped bus
+    _run_tail(broker, [{"_id": _oid(1001), "code": "R"}], bus)
+    assert seen == [_oid(1001)]
+
+
+def test_tail_starts_near_the_end_of_the_bus():
+    bus = _Bus()
+    bus.docs += [{"_id": _oid(ts), "code": "R"} for ts in range(1000, 5000)]
+    broker, seen = _tail_into(bus, last_id=_oid(4999))
+    _run_tail(broker, [{"_id": _oid(5000), "code": "R"}], bus)
+    assert seen == [_oid(5000)]
+    assert bus.returned <= server.ROOM_BUS_CLOCK_SKEW + 2
+
+
+WORKERS = 3
+EVENTS = 150
+CODE = "BUS001"
+SKEW = 60  # seconds the skewed worker's ObjectId clock runs behind
+
+
+def test_workers_share_every_event():
+    url = os.environ.get("MONGO_TEST_URL")
+    if not url:
+        pytest.skip("MONGO_TEST_URL not set")
+    from pymongo import MongoClient
+
+    name = f"hb_bus_test_{uuid.uuid4().hex[:8]}"
+    start_at = time.time() + 3
+    procs = [
+        subprocess.Popen([sys.executable, __file__, url, name, str(i), str(start_at)],
+                         stdout=subprocess.PIPE, cwd=Path(__file__).resolve().parent.parent)
+        for i in range(WORKERS)
+    ]
+    try:
+        outputs = [json.loads(p.communicate(timeout=60)[0].decode().strip().splitlines()[-1]) for p in procs]
+    finally:
+        for p in procs:
+            p.kill()
+        MongoClient(url).drop_database(name)
+    total = WORKERS * EVENTS
+    for seqs in outputs:
+        assert len(seqs) == total
+        assert sorted(seqs) == list(range(1, total + 1))
+
+
+async def _worker(url: str, name: str, index: int, start_at: float) -> None:
+    from bson import ObjectId
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    class SkewedBus:
+        """Stamps bus documents with ObjectIds from a clock SKEW seconds behind."""
+
+        def __init__(self, bus):
+            self._bus = bus
+
+        def __getattr__(self, attr):
+            return getattr(self._bus, attr)
+
+        async def insert_one(self, doc):
+            doc["_id"] = ObjectId(struct.pack(">I", int(time.time()) - SKEW) + os.urandom(8))
+            return await self._bus.insert_one(doc)
+
+    delivered = []
+    deliver = server._deliver_room_event
+
+    async def record(code, event, seq=None, log=True, ws=True):
+        if code == CODE and seq is not None:
+            delivered.append(seq)
+        return await deliver(code, event, seq=seq, log=log, ws=ws)
+
+    server._deliver_room_event = record
+    client = AsyncIOMotorClient(url)
+    broker = server.MongoBroker(client[name])
+    await broker.start()
+    if index == 0:
+        broker.bus = SkewedBus(broker.bus)
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    for i in range(EVENTS):
+        await broker.publish(CODE, {"type": "note", "text": f"{index}:{i}", "user": {}})
+    deadline = time.monotonic() + 20
+    while len(delivered) < WORKERS * EVENTS and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    await broker.close()
+    client.close()
+    print(json.dumps(delivered))
+
+
+if __name__ == "__main__":
+    asyncio.run(_worker(sys.argv[1], sys.argv[2], int(sys.argv[3]), float(sys.argv[4])))
@@ -0,0 +1,85 @@
+import asyncio
+
+from tests.conftest import run
+import server
+
+
+def _flushes(monkeypatch, coalescer):
+    frames = []
+
+    async def flush_room(code, updates):
+        frames.append((code, [(u["user"]["id"], u["head"]["x"]) for u in updates]))
+
+    monkeypatch.setattr(coalescer, "flush_room", flush_room)
+    return frames
+
+
+def test_latest_head_per_user_per_tick(monkeypatch):
+    coalescer = server.PresenceCoalescer(hz=100)
+    frames = _flushes(monkeypatch, coalescer)
+
+    async def main():
+        for x in range(5):
+            coalescer.offer("R", {"id": "a"}, {"x": x})
+        coalescer.offer("R", {"id": "b"}, {"x": 9})
+        await asyncio.sleep(0.03)
+
+    run(main())
+    assert frames == [("R", [("a", 4), ("b", 9)])]
+
+
+def test_refused_head_is_delivered_after_refill(monkeypatch):
+    coalescer = server.PresenceCoalescer(hz=100)
+    frames = _flushes(monkeypatch, coalescer)
+
+    async def main():
+        coalescer.offer("R", {"id": "a"}, {"x": 1})
+        await asyncio.sleep(0.02)
+        coalescer.offer("R", {"id": "a"}, {"x": 2}, delay=0.03)
+        coalescer.offer("R", {"id": "a"}, {"x": 3}, delay=0.03)
+        await asyncio.sleep(0.08)
+
+    run(main())
+    assert frames == [("R", [("a", 1)]), ("R", [("a", 3)])]
+    assert coalescer.stats["held"] == 2
+
+
+def test_newer_accepted_head_supersedes_held_one(monkeypatch):
+    coalescer = server.PresenceCoalescer(hz=100)
+    frames = _flushes(monkeypatch, coalescer)
+
+    async def main():
+        coalescer.offer("R", {"id": "a"}, {"x": 1}, delay=0.03)
+        coalescer.offer("R", {"id": "a"}, {"x": 2})
+        await asyncio.sleep(0.08)
+
+    run(main())
+    assert frames == [("R", [("a", 2)])]
+
+
+def test_discard_drops_held_heads(monkeypatch):
+    coalescer = server.PresenceCoalescer(hz=100)
+    frames = _flushes(monkeypatch, coalescer)
+
+    async def main():
+        coalescer.offer("R", {"id": "a"}, {"x": 1}, delay=0.02)
+        coalescer.discard("R")
+        await asyncio.sleep(0.05)
+
+    run(main())
+    assert frames == []
+
+
+def test_forget_drops_pending_and_held_heads_for_one_user(monkeypatch):
+    coalescer = server.PresenceCoalescer(hz=100)
+    frames = _flushes(monkeypatch, coalescer)
+
+    async def main():
+        coalescer.offer("R", {"id": "a"}, {"x": 1})
+        coalescer.offer("R", {"id": "b"}, {"x": 2})
+        coalescer.offer("R", {"id": "a"}, {"x": 3}, delay=0.02)
+        coalescer.forget("R", "a")
+        await asyncio.sleep(0.05)
+
+    run(main())
+    assert frames == [("R", [("b", 2)])]
@@ -0,0 +1,50 @@
+import pytest
+
+from tests.conftest import api, run
+import server
+
+
+def test_burst_then_refusal_with_retry_time():
+    limiter = server.RateLimiter({("chat", "conn"): (2.0, 3.0)})
+    assert [limiter.acquire("chat", conn="c") for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = limiter.acquire("chat", conn="c")
+    assert wait == pytest.approx(0.5, abs=0.05)
+    assert limiter.stats[("chat", "conn")] == 1
+
+
+def test_refusal_refunds_tokens_taken_at_other_levels():
+    limiter = server.RateLimiter({("chat", "conn"): (1.0, 5.0), ("chat", "room"): (1.0, 1.0)})
+    assert limiter.acquire("chat", conn="c", code="R") == 0.0
+    assert limiter.acquire("chat", conn="c", code="R") > 0
+    # the conn bucket got its token back: 4 left, not 3
+    assert limiter._buckets[("chat", "conn", "c")][0] == pytest.approx(4.0, abs=0.01)
+
+
+def test_identities_and_kinds_are_separate():
+    limiter = server.RateLimiter({("chat", "user"): (1.0, 1.0)})
+    assert limiter.acquire("chat", code="R", user="a") == 0.0
+    assert limiter.acquire("chat", code="R", user="a") > 0
+    assert limiter.acquire("chat", code="R", user="b") == 0.0
+    assert limiter.acquire("presence", code="R", user="a") == 0.0
+    # no user id: the user level doesn't apply
+    assert limiter.acquire("chat", code="R") == 0.0
+
+
+def test_no_limits_always_allows():
+    limiter = server.RateLimiter({})
+    assert all(limiter.acquire("chat", conn="c") == 0.0 for _ in range(100))
+
+
+def test_posts_to_unknown_rooms_are_refused(store):
+    async def main():
+        await store.insert_room({"code": "REAL01", "session_uuid": "s1", "created_at": "t"})
+        async with api() as client:
+            made_up = [(await client.post(f"/api/hb/rooms/FAKE{i:02d}/events",
+                                          json={"type": "chat", "text": "x", "user": {"id": "u"}})).status_code
+                       for i in range(3)]
+            real = await client.post("/api/hb/rooms/REAL01/events", json={"type": "chat", "text": "x"})
+        return made_up, real.status_code
+
+    assert run(main()) == ([404] * 3, 200)
+    assert [key[2] for key in server.rate_limiter._buckets if key[1] == "room"] == ["REAL01"]
+    assert server.room_logs.get("FAKE00") is None
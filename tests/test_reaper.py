@@ -0,0 +1,132 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+from tests.conftest import api, run
+import server
+
+
+def _iso(delta):
+    return (datetime.now(timezone.utc) - delta).isoformat()
+
+
+async def _session(store, uuid, created, accessed, code=None):
+    await store.insert_session({
+        "session_uuid": uuid, "hyperbeam_session_id": f"hb-{uuid}", "is_active": True,
+        "created_at": created, "last_accessed": accessed,
+        "timeout_absolute": 3600, "timeout_inactive": 1800,
+    })
+    if code:
+        await store.insert_room({"code": code, "session_uuid": uuid, "label": "", "created_at": created})
+
+
+def test_reaps_expired_sessions_and_announces_to_rooms(store):
+    async def main():
+        await _session(store, "idle", _iso(timedelta(minutes=40)), _iso(timedelta(minutes=31)), code="IDLE01")
+        await _session(store, "old", _iso(timedelta(hours=2)), _iso(timedelta(minutes=1)), code="OLD001")
+        await _session(store, "fresh", _iso(timedelta(minutes=5)), _iso(timedelta(minutes=1)), code="FRESH1")
+        reaped = await server.session_reaper.reap_once()
+        return reaped, {u: await store.get_session(u) for u in ("idle", "old", "fresh")}
+
+    reaped, docs = run(main())
+    assert reaped == 2
+    assert docs["idle"]["ended_reason"] == "timeout_inactive"
+    assert docs["old"]["ended_reason"] == "timeout_absolute"
+    assert docs["fresh"]["is_active"] is True
+    last = json.loads(server.room_logs.get("IDLE01").tail(1)[0])
+    assert last["type"] == "session_end" and last["reason"] == "timeout_inactive"
+    assert server.room_logs.get("FRESH1") is None
+
+
+def test_second_pass_finds_nothing(store):
+    async def main():
+        await _session(store, "idle", _iso(timedelta(minutes=40)), _iso(timedelta(minutes=31)))
+        return await server.session_reaper.reap_once(), await server.session_reaper.reap_once()
+
+    assert run(main()) == (1, 0)
+
+
+def test_busy_room_is_not_reaped(store):
+    server.room_directory.set_sockets("BUSY01", 2)
+
+    async def main():
+        await _session(store, "busy", _iso(timedelta(minutes=40)), _iso(timedelta(minutes=31)), code="BUSY01")
+        await _session(store, "idle", _iso(timedelta(minutes=40)), _iso(timedelta(minutes=31)), code="IDLE01")
+        reaped = await server.session_reaper.reap_once()
+        return reaped, await store.get_session("busy"), await store.get_session("idle")
+
+    reaped, busy, idle = run(main())
+    assert reaped == 1
+    assert busy["is_active"] is True
+    assert idle["ended_reason"] == "timeout_inactive"
+
+
+def test_room_activity_touches_session_once_per_interval(store):
+    reaper = server.SessionReaper(touch_interval=60)
+
+    async def main():
+        stale = _iso(timedelta(minutes=31))
+        await _session(store, "s1", _iso(timedelta(minutes=40)), stale, code="ROOM01")
+        for _ in range(5):
+            await reaper.room_active("ROOM01")
+        await reaper.room_active("NOPE01")
+        await server.write_behind.flush()
+        return stale, await store.get_session("s1")
+
+    stale, doc = run(main())
+    assert doc["last_accessed"] > stale
+    assert reaper.stats["room_touches"] == 1
+
+
+def test_queued_room_activity_is_flushed_before_the_scan(store):
+    async def main():
+        await _session(store, "s1", _iso(timedelta(minutes=40)), _iso(timedelta(minutes=31)), code="ROOM01")
+        await server.session_reaper.room_active("ROOM01")  # queued, not yet written
+        return await server.session_reaper.reap_once(), await store.get_session("s1")
+
+    reaped, doc = run(main())
+    assert reaped == 0 and doc["is_active"] is True
+
+
+def test_only_the_worker_that_ends_a_session_terminates_and_announces(store, upstream, monkeypatch):
+    monkeypatch.setattr(server, "HYPERBEAM_API_KEY", "k")
+    other = server.SessionReaper()
+
+    async def main():
+        await _session(store, "idle", _iso(timedelta(minutes=40)), _iso(timedelta(minutes=31)), code="IDLE01")
+        return await asyncio.gather(server.session_reaper.reap_once(), other.reap_once())
+
+    assert sorted(run(main())) == [0, 1]
+    assert [r.method for r in upstream] == ["DELETE"]
+    ends = [json.loads(f) for f in server.room_logs.get("IDLE01").tail(50)]
+    assert [e["type"] for e in ends] == ["session_end"]
+
+
+def test_clients_cannot_post_server_event_types(store):
+    async def main():
+        await _session(store, "s1", _iso(timedelta(minutes=1)), _iso(timedelta(minutes=1)), code="ROOM01")
+        server.manager.rooms["ROOM01"] = {object()}  # someone is connected
+        async with api() as client:
+            codes = [(await client.post("/api/hb/rooms/ROOM01/events", json={"type": t, "user": {}})).status_code
+                     for t in ("session_end", "snapshot", "gap", "welcome")]
+        return codes
+
+    assert run(main()) == [422] * 4
+    assert server.room_logs.get("ROOM01") is None
+    assert not server.session_reaper._releases
+
+
+def test_delete_announces_session_end_once(store, upstream):
+    async def main():
+        await _session(store, "s1", _iso(timedelta(minutes=1)), _iso(timedelta(minutes=1)), code="ROOM01")
+        async with api() as client:
+            for _ in range(2):
+                resp = await client.delete("/api/hb/sessions/s1", headers={"Authorization": "Bearer k"})
+                assert resp.status_code == 200
+        return await store.get_session("s1")
+
+    doc = run(main())
+    assert doc["is_active"] is False and doc["ended_reason"] == "terminated"
+    ends = [json.loads(f) for f in server.room_logs.get("ROOM01").tail(50)]
+    assert [(e["type"], e["reason"]) for e in ends] == [("session_end", "terminated")]
+    assert "ROOM01" in server.session_reaper._releases
@@ -0,0 +1,46 @@
+import server
+
+
+def _batch(x):
+    return {"type": "presence", "event": "batch", "updates": [{"user": {"id": "a"}, "head": {"x": x}}]}
+
+
+def _offer(conn, event):
+    return conn.offer(event["type"], server.dumps_frame(event), None, event)
+
+
+def _queued(conn):
+    return [(item[0], item[3].get("updates", [{}])[0].get("head", {}).get("x")) for item in conn.queue]
+
+
+def test_full_queue_sheds_oldest_presence_batch_only():
+    conn = server.RoomConnection(None, maxsize=3)
+    join = {"type": "presence", "event": "join", "user": {"id": "b"}}
+    assert _offer(conn, join)
+    assert _offer(conn, _batch(1))
+    assert _offer(conn, _batch(2))
+    assert _offer(conn, _batch(3))
+    assert _queued(conn) == [("presence/join", None), ("presence/batch", 2), ("presence/batch", 3)]
+    assert conn.dropped == 1
+
+
+def test_join_and_leave_are_not_shed():
+    conn = server.RoomConnection(None, maxsize=2)
+    assert _offer(conn, _batch(1))
+    assert _offer(conn, _batch(2))
+    # a membership change must not be lost: the client is evicted and resyncs instead
+    assert not _offer(conn, {"type": "presence", "event": "leave", "user": {"id": "b"}})
+    assert not _offer(conn, {"type": "chat", "text": "hi"})
+
+
+def test_pong_drops_newest():
+    conn = server.RoomConnection(None, maxsize=1)
+    assert _offer(conn, _batch(1))
+    assert _offer(conn, {"type": "pong"})
+    assert _queued(conn) == [("presence/batch", 1)]
+
+
+def test_plain_presence_entry_is_the_fallback(monkeypatch):
+    monkeypatch.setattr(server, "WS_OVERFLOW_POLICY", {"presence": "drop_newest"})
+    assert server._overflow_action("presence/join") == "drop_newest"
+    assert server._overflow_action("chat") == server.WS_OVERFLOW_DEFAULT
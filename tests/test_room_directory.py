@@ -0,0 +1,36 @@
+from fastapi.testclient import TestClient
+
+import server
+
+
+def test_directory_is_off_by_default():
+    assert server.ROOM_DIRECTORY_ENABLED is False
+    assert TestClient(server.app).get("/api/hb/rooms", headers={"Authorization": "Bearer k"}).status_code == 404
+
+
+def test_directory_requires_the_operator_token(monkeypatch):
+    monkeypatch.setattr(server, "ROOM_DIRECTORY_ENABLED", True)
+    monkeypatch.setattr(server, "ROOM_DIRECTORY_TOKEN", "s3cret")
+    client = TestClient(server.app)
+    assert client.get("/api/hb/rooms").status_code == 422
+    assert client.get("/api/hb/rooms", headers={"Authorization": "s3cret"}).status_code == 401
+    assert client.get("/api/hb/rooms", headers={"Authorization": "Bearer k"}).status_code == 401
+    assert client.get("/api/hb/rooms", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+
+
+def test_directory_stays_off_without_a_token(monkeypatch):
+    monkeypatch.setattr(server, "ROOM_DIRECTORY_ENABLED", True)
+    monkeypatch.setattr(server, "ROOM_DIRECTORY_TOKEN", "")
+    assert TestClient(server.app).get("/api/hb/rooms", headers={"Authorization": "Bearer "}).status_code == 404
+
+
+
+def test_top_ranks_by_event_rate():
+    directory = server.RoomDirectory()
+    for code, n in (("A", 1), ("B", 5), ("C", 3)):
+        for _ in range(n):
+            directory.event(code)
+    directory.set_sockets("A", 4)
+    top = directory.top(2)
+    assert [r["code"] for r in top] == ["B", "C"]
+    assert directory.describe("A", server.time.monotonic())["occupancy"] == 4
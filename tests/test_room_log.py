@@ -0,0 +1,73 @@
+import json
+
+import server
+
+
+def _ids(frames):
+    return [json.loads(f)["id"] for f in frames]
+
+
+def test_append_since_and_tail():
+    log = server.RoomEventLog(capacity=8)
+    for i in range(5):
+        log.append({"type": "chat", "text": str(i)})
+    assert (log.first_seq, log.last_seq) == (1, 5)
+    assert _ids(log.since(2)) == [3, 4, 5]
+    assert _ids(log.tail(2)) == [4, 5]
+    assert log.since(5) == []
+
+
+def test_ring_drops_oldest_when_full():
+    log = server.RoomEventLog(capacity=4)
+    for i in range(10):
+        log.append({"type": "chat", "text": str(i)})
+    assert (log.first_seq, log.last_seq) == (7, 10)
+    assert _ids(log.since(0)) == [7, 8, 9, 10]
+
+
+def test_put_leaves_holes_and_fills_late_arrivals():
+    log = server.RoomEventLog(capacity=8)
+    log.put(1, {"type": "chat"})
+    log.put(3, {"type": "chat"})
+    assert _ids(log.since(0)) == [1, 3]
+    log.put(2, {"type": "chat"})
+    assert _ids(log.since(0)) == [1, 2, 3]
+    # a duplicate never overwrites
+    assert log.put(2, {"type": "chat", "text": "dup"}) == (0, 0)
+    assert json.loads(log.get(2)).get("text") is None
+
+
+def test_jump_past_window_restarts_ring():
+    log = server.RoomEventLog(capacity=4)
+    log.append({"type": "chat"})
+    log.put(100, {"type": "chat"})
+    assert (log.first_seq, log.last_seq) == (100, 100)
+
+
+def test_byte_budget_drops_oldest():
+    log = server.RoomEventLog(capacity=100, max_bytes=300)
+    for i in range(20):
+        log.append({"type": "chat", "text": "x" * 40})
+    assert log.bytes <= 300
+    assert log.last_seq == 20 and log.first_seq > 1
+
+
+def test_idle_logs_are_evicted():
+    logs = server.RoomLogStore(idle_seconds=0)
+    logs.append("A", {"type": "chat"})
+    logs.append("B", {"type": "chat"})
+    logs._next_sweep = 0
+    logs.get("B")
+    assert len(logs) == 0 and logs.total_bytes == 0
+    assert logs.stats["evicted_idle"] == 2
+
+
+def test_global_budget_evicts_coldest_room_first():
+    logs = server.RoomLogStore(total_max_bytes=700)
+    for code in ("A", "B", "C"):
+        for _ in range(3):
+            logs.append(code, {"type": "chat", "text": "x" * 40})
+    logs.get("A")  # touched: now warmer than B and C
+    logs.append("D", {"type": "chat", "text": "x" * 40})
+    assert list(logs._logs) == ["C", "A", "D"]
+    assert logs.total_bytes <= 700 and logs.stats["evicted_memory"] == 1
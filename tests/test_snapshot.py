@@ -0,0 +1,33 @@
+import json
+
+import server
+
+def test_state_snapshot_tracks_participants_and_chat():
+    log = server.RoomEventLog(capacity=16)
+    log.append({"type": "presence", "event": "join", "user": {"id": "a"}})
+    log.append({"type": "presence", "event": "batch", "updates": [{"user": {"id": "a"}, "head": {"size": 40}}]})
+    log.append({"type": "chat", "text": "hi", "user": {"id": "a"}})
+    log.append({"type": "presence", "event": "join", "user": {"id": "b"}})
+    log.append({"type": "presence", "event": "leave", "user": {"id": "b"}})
+    snap = json.loads(log.state.encode(log.last_seq))
+    assert snap["seq"] == 5
+    assert [p["user"]["id"] for p in snap["participants"]] == ["a"]
+    assert snap["participants"][0]["head"] == {"size": 40}
+    assert [m["text"] for m in snap["chat"]] == ["hi"]
+
+
+def test_logs_of_rooms_with_sockets_survive_eviction():
+    server.manager.rooms["LIVE"] = {object()}
+    logs = server.RoomLogStore(total_max_bytes=400, idle_seconds=0)
+    logs.append("LIVE", {"type": "presence", "event": "join", "user": {"id": "a"}})
+    for code in ("A", "B", "C"):
+        for _ in range(3):
+            logs.append(code, {"type": "chat", "text": "x" * 40})
+    assert "LIVE" in logs and "A" not in logs
+    assert logs.stats["evicted_memory"] > 0
+
+    logs._next_sweep = 0
+    logs.get("C")
+    assert list(logs._logs) == ["LIVE"]
+    snap = json.loads(logs.get("LIVE").state.encode(1))
+    assert [p["user"]["id"] for p in snap["participants"]] == ["a"]
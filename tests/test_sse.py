@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+from tests.conftest import api, run
+import server
+
+
+def _fill(code, n):
+    for i in range(n):
+        server.room_logs.append(code, {"id": 0, "type": "chat", "text": str(i + 1)})
+
+
+def _parse(chunk):
+    out = []
+    for block in chunk.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "data" in fields:
+            out.append((fields.get("event", "message"), fields.get("id"), json.loads(fields["data"])))
+    return out
+
+
+async def _take(code, since, n):
+    stream = server._sse_chunks(code, since)
+    try:
+        return [await asyncio.wait_for(stream.__anext__(), 1) for _ in range(n)]
+    finally:
+        await stream.aclose()
+
+
+def test_resume_sends_only_missing_events():
+    _fill("R", 5)
+    retry, chunk = run(_take("R", 3, 2))
+    assert retry == b"retry: %d\n\n" % server.SSE_RETRY_MS
+    assert [(kind, sid, e["text"]) for kind, sid, e in _parse(chunk)] == [
+        ("message", "4", "4"), ("message", "5", "5")]
+
+
+def test_reader_behind_the_ring_gets_a_gap_first():
+    _fill("R", server.MAX_EVENTS + 50)
+    first = server.room_logs.get("R").first_seq
+    _, chunk = run(_take("R", 10, 2))
+    events = _parse(chunk)
+    assert events[0] == ("gap", None, {"from": 11, "to": first - 1})
+    assert events[1][1] == str(first)
+
+
+def test_live_events_wake_the_stream():
+    _fill("R", 1)
+
+    async def main():
+        stream = server._sse_chunks("R", 1)
+        await stream.__anext__()  # retry
+        pending = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        assert not pending.done()
+        await server.broker.publish("R", {"type": "chat", "text": "live"})
+        chunk = await asyncio.wait_for(pending, 1)
+        await stream.aclose()
+        return chunk
+
+    assert [(sid, e["text"]) for _, sid, e in _parse(run(main()))] == [("2", "live")]
+
+
+def test_last_event_id_header_beats_the_query(monkeypatch):
+    opened = []
+
+    async def finite(code, since):
+        opened.append((code, since))
+        yield b"retry: 1\n\n"
+
+    monkeypatch.setattr(server, "_sse_stream", finite)
+
+    async def main():
+        async with api() as client:
+            resp = await client.get("/api/hb/rooms/R/stream", params={"since": 2},
+                                    headers={"Last-Event-ID": "7"})
+            await client.get("/api/hb/rooms/R/stream", params={"since": 2})
+            return resp
+
+    resp = run(main())
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    assert opened == [("R", 7), ("R", 2)]
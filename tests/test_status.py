@@ -0,0 +1,65 @@
+import json
+
+from tests.conftest import api, run
+import server
+
+
+async def _seed(store, n):
+    await store.insert_batch("status_checks", [
+        {"_id": i, "id": f"s{i:02d}", "client_name": f"c{i}", "timestamp": f"2026-01-01T00:00:{i:02d}"}
+        for i in range(n)
+    ])
+
+
+def test_pages_follow_the_cursor_to_the_end(store):
+    async def main():
+        await _seed(store, 5)
+        ids, after, pages = [], None, 0
+        async with api() as client:
+            while True:
+                params = {"limit": 2, **({"after": after} if after else {})}
+                resp = await client.get("/api/status", params=params)
+                assert resp.status_code == 200
+                pages += 1
+                ids += [row["id"] for row in resp.json()]
+                after = resp.headers.get("x-next-cursor")
+                if after is None:
+                    return ids, pages, resp.json()[-1]
+
+    ids, pages, last = run(main())
+    assert ids == [f"s{i:02d}" for i in range(5)]
+    assert pages == 3
+    assert set(last) == {"id", "client_name", "timestamp"}  # projected, no _id
+
+
+def test_bad_cursor_is_rejected():
+    async def main():
+        async with api() as client:
+            return await client.get("/api/status", params={"after": "not-a-cursor"})
+
+    assert run(main()).status_code == 400
+
+
+def test_ndjson_streams_one_row_per_line(store):
+    async def main():
+        await _seed(store, 3)
+        async with api() as client:
+            first = await client.get("/api/status", params={"limit": 1})
+            return await client.get("/api/status", params={
+                "format": "ndjson", "after": first.headers["x-next-cursor"]})
+
+    resp = run(main())
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert [row["id"] for row in rows] == ["s01", "s02"]
+
+
+def test_posted_checks_are_listed_after_the_write_behind_flush():
+    async def main():
+        async with api() as client:
+            created = (await client.post("/api/status", json={"client_name": "probe"})).json()
+            await server.write_behind.flush()
+            return created, (await client.get("/api/status")).json()
+
+    created, rows = run(main())
+    assert rows == [created]
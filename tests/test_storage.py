@@ -0,0 +1,128 @@
+"""The same behaviour from MemoryStorage and MongoStorage (on mongomock, if installed)."""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from tests.conftest import run
+import server
+
+
+def _memory():
+    return server.MemoryStorage()
+
+
+def _mongo():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return server.MongoStorage(mongomock_motor.AsyncMongoMockClient(), "test")
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def backend(request):
+    return {"memory": _memory, "mongo": _mongo}[request.param]
+
+
+def test_sessions(backend):
+    async def main():
+        st = backend()
+        await st.start()
+        for i, accessed in enumerate(["2026-01-01T00:03", "2026-01-01T00:01", "2026-01-01T00:02"]):
+            await st.insert_session({"session_uuid": f"s{i}", "is_active": True, "created_at": "2026-01-01T00:00",
+                                     "last_accessed": accessed, "metadata": {"w": 1}})
+        await st.touch_sessions({"s0": "2026-01-01T00:00", "s1": "2026-01-01T00:09"})
+        order = [d["session_uuid"] async for d in st.active_sessions()]
+        fields = {"is_active": False, "ended_reason": "timeout_inactive"}
+        ended = [await st.end_sessions({"s2": fields, "nope": fields}), await st.end_sessions({"s2": fields})]
+        await st.update_session("s0", {"label": "x"})
+        return order, ended, await st.get_session("s0"), await st.get_session("s2"), await st.get_session("nope")
+
+    order, ended, s0, s2, missing = run(main())
+    assert ended == [["s2"], []]  # only the call that flipped it reports it
+    assert order == ["s2", "s0", "s1"]  # s0's stale touch didn't rewind it
+    assert s0["last_accessed"] == "2026-01-01T00:03" and s0["label"] == "x" and "_id" not in s0
+    assert s2["is_active"] is False and s2["ended_reason"] == "timeout_inactive"
+    assert missing is None
+
+
+def test_rooms(backend):
+    async def main():
+        st = backend()
+        await st.start()
+        await st.insert_room({"code": "AAA", "session_uuid": "s1", "created_at": "t"})
+        await st.insert_room({"code": "BBB", "session_uuid": "s1", "created_at": "t"})
+        await st.insert_room({"code": "CCC", "session_uuid": "s2", "created_at": "t"})
+        with pytest.raises(DuplicateKeyError):
+            await st.insert_room({"code": "AAA", "session_uuid": "s3", "created_at": "t"})
+        return await st.get_room("AAA"), sorted(r["code"] for r in await st.rooms_for_sessions(["s1"]))
+
+    room, codes = run(main())
+    assert room == {"code": "AAA", "session_uuid": "s1", "created_at": "t"}
+    assert codes == ["AAA", "BBB"]
+
+
+def test_status_keyset_pages(backend):
+    async def main():
+        st = backend()
+        docs = [{"id": f"id{i:02d}", "client_name": f"c{i}", "timestamp": f"2026-01-01T00:00:{i // 2:02d}"}
+                for i in range(9)]
+        await st.insert_batch("status_checks", list(reversed(docs)))
+        first = [d async for d in st.status_checks(None, 4)]
+        last = first[-1]
+        rest = [d async for d in st.status_checks((last["timestamp"], last["id"]), None)]
+        return first, rest
+
+    first, rest = run(main())
+    assert [d["id"] for d in first + rest] == [f"id{i:02d}" for i in range(9)]
+
+
+def test_chat(backend):
+    async def main():
+        st = backend()
+        await st.start()
+        await st.insert_batch(server.CHAT_HISTORY_COLLECTION, [
+            {"code": "R", "seq": s, "event": {"id": s, "text": str(s)}, "created_at": datetime.now(timezone.utc)}
+            for s in (2, 4, 6, 8, 10)
+        ])
+        newest = await st.chat_range("R", None, 9, 2, newest=True)
+        oldest = await st.chat_range("R", 2, None, 2, newest=False)
+        last = await st.last_chat_seq("R")
+        trimmed = await st.trim_chat("R", 3)
+        left = await st.chat_range("R", None, None, 10, newest=False)
+        return newest, oldest, last, trimmed, left, await st.last_chat_seq("other")
+
+    newest, oldest, last, trimmed, left, none = run(main())
+    assert [e["id"] for e in newest] == [6, 8]
+    assert [e["id"] for e in oldest] == [4, 6]
+    assert (last, trimmed, none) == (10, 2, 0)
+    assert [e["id"] for e in left] == [6, 8, 10]
+
+
+def test_claims(backend):
+    async def main():
+        st = backend()
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        await st.insert_claim({"_id": "k", "fingerprint": "f", "response": None, "created_at": now,
+                               "expires_at": now + timedelta(seconds=60)})
+        with pytest.raises(DuplicateKeyError):
+            await st.insert_claim({"_id": "k", "fingerprint": "f", "response": None, "created_at": now,
+                                   "expires_at": now})
+        await st.delete_claim("k", now)  # expiry doesn't match: kept
+        kept = await st.get_claim("k")
+        await st.complete_claim("k", {"ok": 1}, now + timedelta(seconds=600))
+        done = await st.get_claim("k")
+        await st.delete_claim("k")
+        return kept, done, await st.get_claim("k")
+
+    kept, done, gone = run(main())
+    assert kept["fingerprint"] == "f" and kept["response"] is None
+    assert done["response"] == {"ok": 1}
+    assert done["expires_at"] == kept["expires_at"] + timedelta(seconds=540)
+    assert gone is None
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        server.Storage()
+    with pytest.raises(TypeError):
+        server.RoomBroker()
@@ -0,0 +1,105 @@
+import asyncio
+
+from tests.conftest import run
+import server
+
+
+def test_concurrent_misses_share_one_load():
+    cache = server.TTLCache(ttl=30)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"v": 1}
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_load("k", loader) for _ in range(5)))
+
+    assert run(main()) == [{"v": 1}] * 5
+    assert len(calls) == 1
+    assert cache.stats["coalesced"] == 4
+
+
+def test_entries_expire_and_misses_are_not_cached():
+    cache = server.TTLCache(ttl=0.01)
+    values = iter([None, 1, 2])
+
+    async def loader():
+        return next(values)
+
+    async def main():
+        assert await cache.get_or_load("k", loader) is None
+        assert await cache.get_or_load("k", loader) == 1
+        assert await cache.get_or_load("k", loader) == 1
+        await asyncio.sleep(0.02)
+        return await cache.get_or_load("k", loader)
+
+    assert run(main()) == 2
+
+
+def test_invalidate_during_load_is_not_cached():
+    cache = server.TTLCache(ttl=30)
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        return "stale"
+
+    async def main():
+        task = asyncio.ensure_future(cache.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        cache.invalidate("k")
+        assert await task == "stale"
+
+    run(main())
+    assert len(cache) == 0
+
+
+def test_lru_bound():
+    cache = server.TTLCache(maxsize=2, ttl=30)
+    for k in "abc":
+        cache.set(k, k)
+    assert list(cache._data) == ["b", "c"]
+    assert cache.stats["evictions"] == 1
+
+
+def test_cancelled_leader_does_not_fail_followers():
+    cache = server.TTLCache(ttl=30)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return len(calls)
+
+    async def main():
+        leader = asyncio.ensure_future(cache.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(cache.get_or_load("k", loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        assert leader.cancelled()
+        return results
+
+    assert run(main()) == [2, 2, 2]
+    assert len(calls) == 2
+
+
+def test_cancelled_follower_leaves_the_load_running():
+    cache = server.TTLCache(ttl=30)
+
+    async def loader():
+        await asyncio.sleep(0.02)
+        return "v"
+
+    async def main():
+        leader = asyncio.ensure_future(cache.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(cache.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        follower.cancel()
+        assert await leader == "v"
+        assert follower.cancelled()
+
+    run(main())
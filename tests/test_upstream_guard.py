@@ -0,0 +1,91 @@
+import asyncio
+
+import httpx
+import pytest
+
+from tests.conftest import run
+import server
+
+
+def _respond(status):
+    async def send():
+        return httpx.Response(status)
+    return send
+
+
+def test_breaker_opens_after_consecutive_failures_and_recovers():
+    guard = server.UpstreamGuard(max_concurrency=2, queue_timeout=1, failure_threshold=3, cooldown=0.05)
+
+    async def main():
+        for _ in range(3):
+            assert (await guard.call(_respond(502))).status_code == 502
+        assert guard.state == "open"
+        with pytest.raises(server.UpstreamUnavailable) as exc:
+            await guard.call(_respond(200))
+        assert exc.value.retry_after >= 1
+        await asyncio.sleep(0.06)
+        # half-open probe succeeds and closes the breaker
+        assert (await guard.call(_respond(200))).status_code == 200
+        assert guard.state == "closed" and guard.failures == 0
+
+    run(main())
+    assert guard.stats["opened"] == 1
+
+
+def test_success_resets_failure_count():
+    guard = server.UpstreamGuard(failure_threshold=2, cooldown=10)
+
+    async def main():
+        await guard.call(_respond(500))
+        await guard.call(_respond(204))
+        await guard.call(_respond(500))
+
+    run(main())
+    assert guard.state == "closed"
+
+
+def test_network_errors_count_as_failures():
+    guard = server.UpstreamGuard(failure_threshold=1, cooldown=10)
+
+    async def boom():
+        raise httpx.ConnectError("down")
+
+    async def main():
+        with pytest.raises(httpx.ConnectError):
+            await guard.call(boom)
+
+    run(main())
+    assert guard.state == "open"
+
+
+def test_queue_timeout_rejects_when_slots_are_busy():
+    guard = server.UpstreamGuard(max_concurrency=1, queue_timeout=0.01, failure_threshold=5, cooldown=10)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return httpx.Response(200)
+
+    async def main():
+        first = asyncio.ensure_future(guard.call(slow))
+        await asyncio.sleep(0)
+        with pytest.raises(server.UpstreamUnavailable):
+            await guard.call(_respond(200))
+        await first
+
+    run(main())
+    assert guard.stats["rejected_queue"] == 1
+    assert guard.state == "closed"
+
+
+def test_rate_limited_responses_do_not_open_the_shared_breaker():
+    guard = server.UpstreamGuard(failure_threshold=2, cooldown=10)
+
+    async def main():
+        await guard.call(_respond(500))
+        for _ in range(10):
+            assert (await guard.call(_respond(429))).status_code == 429
+        assert guard.state == "closed" and guard.failures == 1
+        await guard.call(_respond(500))
+
+    run(main())
+    assert guard.state == "open"
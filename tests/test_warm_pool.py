@@ -0,0 +1,109 @@
+import asyncio
+
+import httpx
+
+from tests.conftest import run
+import server
+
+BODY = {"width": 1280, "height": 720, "kiosk": False, "start_url": "https://example.com",
+        "timeout": {"absolute": 3600, "inactive": 1800}}
+
+
+def _upstream(monkeypatch, statuses):
+    calls = []
+
+    async def fake(op, method, url, retries=0, **kwargs):
+        calls.append(op)
+        status = statuses.pop(0) if statuses else 200
+        return httpx.Response(status, json={"session_id": f"vm{len(calls)}", "embed_url": "e"})
+
+    monkeypatch.setattr(server, "_hb_request", fake)
+    return calls
+
+
+async def _settle(pool):
+    while pool._tasks:
+        await asyncio.gather(*pool._tasks, return_exceptions=True)
+
+
+def test_no_pool_until_an_upstream_create_succeeds(monkeypatch):
+    pool = server.WarmPool(min_size=0, max_size=3)
+    calls = _upstream(monkeypatch, [])
+    key = pool.key("k", BODY)
+
+    async def main():
+        assert pool.take(key) is None
+        await _settle(pool)
+        assert calls == [] and key not in pool._demand
+        pool.launched(key)
+        await _settle(pool)
+        vm, launched_at = pool.take(key)
+        await pool.close()
+        return vm
+
+    assert run(main())["session_id"] == "vm1"
+    assert pool.stats["hits"] == 1 and pool.stats["misses"] == 1
+
+
+def test_failed_launches_back_off(monkeypatch):
+    pool = server.WarmPool(min_size=1, max_size=3)
+    calls = _upstream(monkeypatch, [502, 502])
+    key = pool.key("k", BODY)
+
+    async def main():
+        pool.launched(key)
+        await _settle(pool)
+        for _ in range(5):
+            pool.maintain()
+            await _settle(pool)
+        assert len(calls) == 1
+        assert pool._backoff[key][0] > server.time.monotonic()
+        pool._backoff[key] = (0.0, 1)  # backoff elapsed
+        pool.maintain()
+        await _settle(pool)
+        assert len(calls) == 2 and pool._backoff[key][1] == 2
+        pool._backoff[key] = (0.0, 2)
+        pool.maintain()
+        await _settle(pool)
+        assert key not in pool._backoff and len(pool._idle[key]) == 1
+        await pool.close()
+
+    run(main())
+    assert pool.stats["launch_errors"] == 2 and pool.stats["launched"] == 1
+
+
+def test_rejected_api_key_drops_the_pool(monkeypatch):
+    pool = server.WarmPool(min_size=1, max_size=3)
+    _upstream(monkeypatch, [401])
+    key = pool.key("k", BODY)
+
+    async def main():
+        pool.launched(key)
+        await _settle(pool)
+        pool.maintain()
+        await pool.close()
+
+    run(main())
+    assert key not in pool._demand and key not in pool._idle
+
+
+def test_pooled_session_keeps_the_vm_launch_time(monkeypatch):
+    _upstream(monkeypatch, [])
+    monkeypatch.setattr(server, "HB_WARM_POOL_ENABLED", True)
+    payload = server.HBCreatePayload(start_url=BODY["start_url"], kiosk=False)
+    key = server.warm_pool.key("k", BODY)
+
+    async def main():
+        server.warm_pool.launched(key)
+        await _settle(server.warm_pool)
+        deadline, launched_at, vm = server.warm_pool._idle[key][0]
+        await asyncio.sleep(0.01)
+        created = await server._launch_session(payload, "k")
+        doc = await server.storage.get_session(created.session_uuid)
+        await server.warm_pool.close()
+        return launched_at, created, doc
+
+    launched_at, created, doc = run(main())
+    assert created.created_at == doc["created_at"] == launched_at
+    assert doc["timeout_absolute"] == BODY["timeout"]["absolute"]
+    assert doc["last_accessed"] > launched_at
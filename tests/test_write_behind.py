@@ -0,0 +1,64 @@
+import asyncio
+
+from tests.conftest import run
+import server
+
+
+def test_touches_collapse_to_newest(store):
+    wb = server.WriteBehind()
+
+    async def main():
+        wb.touch("s", "2026-01-01T00:02")
+        wb.touch("s", "2026-01-01T00:01")
+        wb.touch("s", "2026-01-01T00:03")
+        assert wb._touches == {"s": "2026-01-01T00:03"}
+        await wb.close()
+
+    run(main())
+    assert wb.stats["merged"] == 2
+
+
+def test_close_waits_for_the_inflight_flush(store, monkeypatch):
+    wb = server.WriteBehind(interval=0.01)
+
+    async def main():
+        flushing = asyncio.Event()
+        insert_batch = store.insert_batch
+
+        async def slow_insert(name, docs):
+            flushing.set()
+            await asyncio.sleep(0.05)
+            await insert_batch(name, docs)
+
+        monkeypatch.setattr(store, "insert_batch", slow_insert)
+        for i in range(3):
+            wb.insert("status_checks", {"id": str(i), "timestamp": str(i)})
+        await flushing.wait()
+        wb.insert("status_checks", {"id": "late", "timestamp": "9"})
+        await wb.close()
+        return [d["id"] async for d in store.status_checks(None, None)]
+
+    assert run(main()) == ["0", "1", "2", "late"]
+    assert wb.pending == 0 and wb.stats["ops"] == 4
+
+
+def test_failed_batch_is_requeued(store, monkeypatch):
+    wb = server.WriteBehind()
+    calls = []
+
+    async def flaky(touches):
+        calls.append(dict(touches))
+        if len(calls) == 1:
+            raise RuntimeError("down")
+
+    monkeypatch.setattr(store, "touch_sessions", flaky)
+
+    async def main():
+        wb.touch("s", "t1")
+        await wb.flush()
+        assert wb.pending == 1
+        await wb.flush()
+
+    run(main())
+    assert calls == [{"s": "t1"}, {"s": "t1"}]
+    assert wb.stats["errors"] == 1 and wb.pending == 0
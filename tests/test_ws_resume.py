@@ -0,0 +1,46 @@
+import json
+
+from starlette.testclient import TestClient
+
+import server
+
+
+def _fill(code, n):
+    for i in range(n):
+        server.room_logs.append(code, {"id": 0, "type": "chat", "text": str(i + 1)})
+
+
+def _hello(ws, **extra):
+    ws.send_text(json.dumps({"type": "hello", "user": {"id": "a"}, **extra}))
+
+
+def test_resume_replays_only_the_missed_range():
+    _fill("R", 5)
+    with TestClient(server.app) as client, client.websocket_connect("/api/hb/ws/room/R") as ws:
+        _hello(ws, resume_from=3)
+        frames = [ws.receive_json() for _ in range(3)]
+    assert [(f["id"], f.get("text")) for f in frames[:2]] == [(4, "4"), (5, "5")]
+    assert frames[2]["event"] == "join" and frames[2]["id"] == 6
+
+
+def test_resume_behind_the_ring_starts_with_a_gap():
+    _fill("R", server.MAX_EVENTS + 50)
+    first = server.room_logs.get("R").first_seq
+    with TestClient(server.app) as client, client.websocket_connect("/api/hb/ws/room/R") as ws:
+        _hello(ws, resume_from=10)
+        gap = ws.receive_json()
+        replay = [ws.receive_json()["id"] for _ in range(server.MAX_EVENTS)]
+    assert gap == {"type": "gap", "from": 11, "to": first - 1}
+    assert replay == list(range(first, server.MAX_EVENTS + 51))
+
+
+def test_socket_chat_is_sequenced_into_the_polling_log():
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/hb/ws/room/R") as ws:
+            _hello(ws)
+            assert ws.receive_json()["event"] == "join"
+            ws.send_text(json.dumps({"type": "chat", "text": "hi"}))
+            echoed = ws.receive_json()
+        polled = client.get("/api/hb/rooms/R/events", params={"since": 1}).json()
+    assert echoed["id"] == 2 and echoed["text"] == "hi"
+    assert [(e["id"], e.get("text")) for e in polled["events"][:1]] == [(2, "hi")]